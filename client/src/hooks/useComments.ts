@@ -1,12 +1,14 @@
 import { useEffect, useState } from "react"
-import { doc, getDoc, onSnapshot, deleteDoc } from "firebase/firestore"
+import { collection, deleteDoc, doc, documentId, getDocs, onSnapshot, query, where } from "firebase/firestore"
 import { db } from "../lib/firebase"
 import type { Comment } from "../types/types"
 
+// Firestore caps "in" filters at 30 values
+const FIRESTORE_IN_LIMIT = 30
+
 export function useRoomComments(songId: string | undefined) {
   const [comments, setComments] = useState<Comment[]>([])
   const [loading, setLoading] = useState(true)
-  const [listeners, setListeners] = useState(0)
 
   useEffect(() => {
     if (!songId) return
@@ -21,8 +23,6 @@ export function useRoomComments(songId: string | undefined) {
       }
 
       const data = snapshot.data()
-
-      setListeners(data?.listeners)
       const commentIds: string[] = data?.comments || []
 
       if (commentIds.length === 0) {
@@ -32,22 +32,30 @@ export function useRoomComments(songId: string | undefined) {
         return
       }
 
-      const commentDocs = await Promise.all(
-        commentIds.map(async (cid) => {
-          const cSnap = await getDoc(doc(db, "comments", cid))
-          if (!cSnap.exists()) return null
-          const data = cSnap.data() as Omit<Comment, "id">
-
-          return { id: cid, ...data }
-        })
+      // One query per FIRESTORE_IN_LIMIT comments instead of one read per comment.
+      // The server's /songs/{id}/comments endpoint has no likes yet, so the
+      // switch to it waits until it does.
+      const chunks: string[][] = []
+      for (let i = 0; i < commentIds.length; i += FIRESTORE_IN_LIMIT) {
+        chunks.push(commentIds.slice(i, i + FIRESTORE_IN_LIMIT))
+      }
+      const snapshots = await Promise.all(
+        chunks.map((chunk) => getDocs(query(collection(db, "comments"), where(documentId(), "in", chunk))))
       )
+      const found = new Map<string, Comment>()
+      for (const snap of snapshots) {
+        snap.forEach((cSnap) => {
+          found.set(cSnap.id, { id: cSnap.id, ...(cSnap.data() as Omit<NonNullable<Comment>, "id">) })
+        })
+      }
 
-      setComments(commentDocs.filter((c): c is Comment => c !== null))
+      // Keep the room's order; deleted comments are skipped
+      setComments(commentIds.map((cid) => found.get(cid)).filter((c): c is Comment => c !== undefined))
       setLoading(false)
     })
 
     return () => unsubscribe()
   }, [songId])
 
-  return { comments, listeners, loading }
+  return { comments, loading }
 }
@@ -0,0 +1,36 @@
+import { useEffect, useState } from "react"
+
+// Listener counts come from the server's live room sockets, refreshed this often
+const PRESENCE_REFRESH_MS = 15000
+
+export function useRoomPresence(songId: string | undefined) {
+  const [listeners, setListeners] = useState(0)
+
+  useEffect(() => {
+    if (!songId) return
+
+    // Being connected to the song's room is what counts us as a listener
+    const ws = new WebSocket(`wss://spotichat-backend.onrender.com/ws/${songId}`)
+
+    const refresh = async () => {
+      try {
+        const res = await fetch(`https://spotichat-backend.onrender.com/rooms/${songId}/listeners`)
+        if (!res.ok) return
+        const data = await res.json()
+        setListeners(data.listeners ?? 0)
+      } catch (err) {
+        console.error("Listener count fetch error:", err)
+      }
+    }
+
+    ws.onopen = () => { refresh() }
+    const interval = setInterval(refresh, PRESENCE_REFRESH_MS)
+
+    return () => {
+      clearInterval(interval)
+      ws.close(1000, "Left the song")
+    }
+  }, [songId])
+
+  return listeners
+}
@@ -8,8 +8,7 @@ import {
   deleteDoc, 
   collection, 
   arrayUnion, 
-  arrayRemove,
-  increment
+  arrayRemove
 } from "firebase/firestore"
 
 export async function addComment(songId: string, authorId: string, content: string, timestamp: number | null) {
@@ -28,8 +27,7 @@ export async function addComment(songId: string, authorId: string, content: stri
     await setDoc(roomRef, {
         songId: songId,
         comments: [commentRef.id],
-        createdAt: Date.now(),
-        listeners: 0
+        createdAt: Date.now()
     })
   } else {
     await updateDoc(roomRef, {
@@ -38,47 +36,6 @@ export async function addComment(songId: string, authorId: string, content: stri
   }
 }
 
-// Increment listener count
-export async function addListener(songId: string) {
-  const roomRef = doc(db, "rooms", songId)
-  const roomSnap = await getDoc(roomRef)
-  
-  if (!roomSnap.exists()) {
-    await setDoc(roomRef, {
-        songId: songId,
-        comments: [],
-        createdAt: Date.now(),
-        listeners: 1
-    })
-  } else {
-    await updateDoc(roomRef, {
-      listeners: increment(1)
-    })
-  }
-}
-
-// Decrement listener count
-export async function removeListener(songId: string) {
-  const roomRef = doc(db, "rooms", songId)
-  const roomSnap = await getDoc(roomRef)
-  
-  if (!roomSnap.exists()) {
-    await setDoc(roomRef, {
-        songId: songId,
-        comments: [],
-        createdAt: Date.now(),
-        listeners: 0
-    })
-    await updateDoc(roomRef, {
-      listeners: increment(-1)
-    })
-  } else {
-    await updateDoc(roomRef, {
-      listeners: increment(-1)
-    })
-  }
-}
-
 export async function toggleLike(commentId: string, userId: string, liked: boolean) {
   const ref = doc(db, "comments", commentId)
   await updateDoc(ref, {
@@ -11,8 +11,14 @@ interface WebSocketMessage {
   error?: string;
   interval?: number;
   timestamp?: number;
+  access_token?: string;
+  refresh_token?: string;
+  expires_at?: number;
 }
 
+// Close codes after which reconnecting would be refused again (or fight another tab)
+const FINAL_CLOSE_CODES = [1000, 4000, 4001, 4003];
+
 // WebSocket client class (include this in your project)
 class SongWebSocketClient {
   userId: string;
@@ -65,7 +71,8 @@ class SongWebSocketClient {
         this.pollingActive = false;
         this.onDisconnect();
         
-        if (event.code !== 1000) {
+        // Normal close, replaced by a newer tab (4000), missing or rejected token (4001/4003): don't come back
+        if (!FINAL_CLOSE_CODES.includes(event.code)) {
           this.attemptReconnect();
         }
       };
@@ -112,6 +119,12 @@ class SongWebSocketClient {
 
   handleMessage(message: WebSocketMessage): void {
     const action = message.action;
+
+    // Server heartbeat: answer so the connection isn't reaped as idle
+    if (action === 'ping') {
+      this.send({ action: 'pong', timestamp: message.timestamp });
+      return;
+    }
     
     if (this.messageHandlers.has(action)) {
       const handler = this.messageHandlers.get(action);
@@ -137,11 +150,22 @@ class SongWebSocketClient {
     });
   }
 
-  startPolling(interval: number = 5): boolean {
+  startPolling(interval: number = 5, mode: 'fixed' | 'adaptive' = 'adaptive'): boolean {
     this.pollingActive = true;
     return this.send({
       action: 'start_current_song_polling',
-      interval: interval
+      interval: interval,
+      mode: mode,
+      delta: true
+    });
+  }
+
+  // Lets the server refresh the access token before it expires (no reconnect needed)
+  registerRefreshToken(refreshToken: string, expiresAt: number): boolean {
+    return this.send({
+      action: 'register_refresh_token',
+      refresh_token: refreshToken,
+      expires_at: expiresAt
     });
   }
 
@@ -221,6 +245,10 @@ export default function Listening() {
       // Setup event handlers
       ws.onConnect = () => {
         setConnectionStatus('connected')
+        const refresh_token = localStorage.getItem("refresh_token")
+        if (refresh_token) {
+          ws.registerRefreshToken(refresh_token, Number(localStorage.getItem("token_expires")))
+        }
         // Start polling for current song every 3 seconds
         ws.startPolling(30)
       }
@@ -250,6 +278,13 @@ export default function Listening() {
         }
       })
 
+      // Only the changed fields (is_playing / progress_ms) of the current song
+      ws.on('current_song_delta', (message: WebSocketMessage) => {
+        if (!message.data) return
+        const changes = message.data
+        setSong(prev => (prev && 'id' in prev && prev.id === changes.id) ? { ...prev, ...changes } : prev)
+      })
+
       ws.on('current_song_response', (message: WebSocketMessage) => {
         if (message.data) {
           const transformedSong: SongItem = {
@@ -270,6 +305,17 @@ export default function Listening() {
       ws.on('polling_started', () => {
       })
 
+      // Server refreshed our token ahead of expiry; keep it for REST calls and reconnects
+      ws.on('token_refreshed', (message: WebSocketMessage) => {
+        if (!message.access_token || !message.expires_at) return
+        localStorage.setItem("spotify_token", message.access_token)
+        localStorage.setItem("token_expires", (message.expires_at * 1000).toString())
+        if (message.refresh_token) {
+          localStorage.setItem("refresh_token", message.refresh_token)
+        }
+        ws.token = message.access_token
+      })
+
       setConnectionStatus('connecting')
       ws.connect()
     }
@@ -1,7 +1,8 @@
 import { useParams, useNavigate } from "react-router"
 import { useState, useEffect } from "react"
 import { useRoomComments } from "../hooks/useComments"
-import { addComment, addListener, removeListener } from "../lib/commentService"
+import { useRoomPresence } from "../hooks/useRoomPresence"
+import { addComment } from "../lib/commentService"
 import { CommentCard } from "../components/CommentCard"
 import { ArrowLeft, Music } from "lucide-react"
 
@@ -37,7 +38,8 @@ interface SongData {
 export default function Song() {
   const { id: songId } = useParams()
   const navigate = useNavigate()
-  const { comments, listeners, loading: commentsLoading } = useRoomComments(songId)
+  const { comments, loading: commentsLoading } = useRoomComments(songId)
+  const listeners = useRoomPresence(songId)
   const [newComment, setNewComment] = useState("")
   const [, setExtractedTimestamps] = useState<Array<{ timestamp: string; milliseconds: number }>>([])
 
@@ -98,20 +100,11 @@ export default function Song() {
 
   // Format duration from milliseconds to mm:ss
 
-  // Add listeners when component mounts and remove when unmounts
   useEffect(() => {
     if (!songId) return
 
     // Fetch song data
     fetchSongData(songId)
-
-    // Add listener when component mounts
-    addListener(songId)
-
-    // Cleanup: remove listener when component unmounts
-    return () => {
-      removeListener(songId)
-    }
   }, [songId])
 
   const extractTimestampsFromComment = (comment: string): ExtractedData => {
@@ -0,0 +1,175 @@
+"""Local stand-in for the parts of the Spotify Web API this server uses.
+
+    python bench/fake_spotify.py --port 9100 --latency-ms 40 --error-rate 0.01 --ratelimit-rate 0.005
+
+Every token gets its own simulated playback (a track from a fixed pool,
+progressing in real time). GET /_stats returns request counts per route.
+"""
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+from typing import Optional
+
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, Response
+
+app = FastAPI()
+
+config = {
+    "latency_ms": 30.0,
+    "jitter_ms": 10.0,
+    "error_rate": 0.0,
+    "ratelimit_rate": 0.0,
+    "retry_after": 1,
+}
+requests_by_route: Counter = Counter()
+statuses: Counter = Counter()
+playback_started = {}
+
+
+def track_id(n: int) -> str:
+    return f"track{n:04d}".ljust(22, "x")
+
+
+TRACK_POOL = [track_id(n) for n in range(500)]
+
+
+def make_track(song_id: str) -> dict:
+    n = int(hashlib.md5(song_id.encode()).hexdigest(), 16)
+    images = [{"url": f"https://i.scdn.co/image/{song_id}-{size}", "height": size, "width": size} for size in (640, 300, 64)]
+    return {
+        "id": song_id,
+        "name": f"Track {song_id[:9]}",
+        "artists": [{"name": f"Artist {n % 97}"}, {"name": f"Feature {n % 13}"}],
+        "album": {"name": f"Album {n % 211}", "images": images},
+        "duration_ms": 120_000 + n % 180_000,
+        "explicit": bool(n % 2),
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{song_id}"},
+        "preview_url": None,
+        "popularity": n % 100,
+        "is_local": False,
+        "track_number": 1 + n % 12,
+        "disc_number": 1,
+    }
+
+
+async def simulate(route: str) -> Optional[Response]:
+    """Apply configured latency, then maybe inject a 429 or 500"""
+    requests_by_route[route] += 1
+    delay = max(config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"]), 0)
+    await asyncio.sleep(delay / 1000)
+    roll = random.random()
+    if roll < config["ratelimit_rate"]:
+        statuses[429] += 1
+        return JSONResponse({"error": {"status": 429}}, status_code=429, headers={"Retry-After": str(config["retry_after"])})
+    if roll < config["ratelimit_rate"] + config["error_rate"]:
+        statuses[500] += 1
+        return JSONResponse({"error": {"status": 500}}, status_code=500)
+    statuses[200] += 1
+    return None
+
+
+def playback_for(authorization: str) -> dict:
+    token = authorization.split(" ")[-1]
+    if token not in playback_started:
+        playback_started[token] = (random.choice(TRACK_POOL), time.time() - random.uniform(0, 60))
+    song_id, started = playback_started[token]
+    track = make_track(song_id)
+    progress = int((time.time() - started) * 1000)
+    if progress >= track["duration_ms"]:
+        # Next track in the pool
+        song_id = TRACK_POOL[(TRACK_POOL.index(song_id) + 1) % len(TRACK_POOL)]
+        playback_started[token] = (song_id, time.time())
+        track, progress = make_track(song_id), 0
+    return {"is_playing": True, "progress_ms": progress, "item": track, "timestamp": int(time.time() * 1000)}
+
+
+@app.get("/v1/tracks")
+async def tracks(ids: str):
+    error = await simulate("tracks_bulk")
+    if error:
+        return error
+    return {"tracks": [make_track(song_id) for song_id in ids.split(",")]}
+
+
+@app.get("/v1/tracks/{song_id}")
+async def track(song_id: str):
+    error = await simulate("tracks_single")
+    if error:
+        return error
+    return make_track(song_id)
+
+
+@app.get("/v1/me/player/currently-playing")
+async def currently_playing(authorization: str = Header("")):
+    error = await simulate("currently_playing")
+    return error or playback_for(authorization)
+
+
+@app.get("/v1/me/player")
+async def player(authorization: str = Header("")):
+    error = await simulate("player")
+    return error or playback_for(authorization)
+
+
+@app.put("/v1/me/player/seek")
+async def seek(position_ms: int, authorization: str = Header("")):
+    error = await simulate("seek")
+    if error:
+        return error
+    token = authorization.split(" ")[-1]
+    state = playback_for(authorization)
+    playback_started[token] = (state["item"]["id"], time.time() - position_ms / 1000)
+    return Response(status_code=204)
+
+
+@app.get("/v1/me/player/devices")
+async def devices():
+    error = await simulate("devices")
+    return error or {"devices": [{"id": "bench-device", "is_active": True, "name": "Bench", "type": "Computer"}]}
+
+
+@app.get("/v1/me")
+async def me(authorization: str = Header("")):
+    error = await simulate("me")
+    token = authorization.split(" ")[-1]
+    return error or {"id": f"user-{token}", "display_name": token, "images": []}
+
+
+@app.get("/v1/users/{user_id}")
+async def user(user_id: str):
+    error = await simulate("users")
+    return error or {"id": user_id, "display_name": user_id, "images": []}
+
+
+@app.get("/_stats")
+async def stats():
+    return {"requests": dict(requests_by_route), "total": sum(requests_by_route.values()), "statuses": dict(statuses)}
+
+
+@app.post("/_config")
+async def update_config(request: Request):
+    config.update(await request.json())
+    return config
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Spotify Web API for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=config["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=config["jitter_ms"])
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"])
+    parser.add_argument("--ratelimit-rate", type=float, default=config["ratelimit_rate"])
+    parser.add_argument("--retry-after", type=int, default=config["retry_after"])
+    args = parser.parse_args()
+    config.update(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        ratelimit_rate=args.ratelimit_rate, retry_after=args.retry_after,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,322 @@
+"""Offline load test: the real server against a local fake Spotify.
+
+Run from the server/ directory:
+
+    python bench/loadtest.py --users 200 --duration 30 --rooms 20 --output bench.json
+
+Starts bench/fake_spotify.py and `uvicorn main:app` as subprocesses, drives
+N simulated users (REST calls, /ws/songs/{user_id} polling and /ws/{song_id}
+room chat) and prints a JSON report: p50/p99 latency per endpoint, message
+rates, server event-loop lag (from /metrics), server RSS and upstream request counts.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_spotify import TRACK_POOL  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index], 2)
+
+
+def summarize(samples: List[float]) -> dict:
+    return {"count": len(samples), "p50_ms": percentile(samples, 50), "p99_ms": percentile(samples, 99),
+            "max_ms": round(max(samples), 2) if samples else None}
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def parse_loop_lag(metrics_text: str) -> dict:
+    """Summarize the server's own event-loop lag histogram from /metrics"""
+    buckets, total, count = [], 0.0, 0
+    for line in metrics_text.splitlines():
+        if line.startswith("spotichat_event_loop_lag_seconds_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets.append((float(le), int(float(line.rsplit(" ", 1)[1]))))
+        elif line.startswith("spotichat_event_loop_lag_seconds_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("spotichat_event_loop_lag_seconds_count"):
+            count = int(float(line.rsplit(" ", 1)[1]))
+
+    def bucket_for(pct: float) -> Optional[float]:
+        for bound, cumulative in buckets:
+            if count and cumulative >= pct / 100 * count:
+                return bound * 1000
+        return None
+
+    return {"samples": count, "mean_ms": round(total / count * 1000, 2) if count else None,
+            "p50_ms_at_most": bucket_for(50), "p99_ms_at_most": bucket_for(99)}
+
+
+async def wait_for_http(url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+class Results:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, started: float, ok: bool = True):
+        self.latency[name].append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[name] += 1
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.results = Results()
+        self.base_url = ""
+        self.ws_url = ""
+        self.stop_at = 0.0
+
+    # -- simulated user behaviour --
+
+    async def rest_user(self, client: httpx.AsyncClient, token: str):
+        headers = {"Authorization": f"Bearer {token}"}
+        while time.monotonic() < self.stop_at:
+            roll = random.random()
+            started = time.perf_counter()
+            try:
+                if roll < 0.6:
+                    name = "GET /song/{id}"
+                    response = await client.get(f"/song/{random.choice(TRACK_POOL)}", headers=headers)
+                elif roll < 0.75:
+                    name = "POST /songs/multiple"
+                    response = await client.post("/songs/multiple", headers=headers,
+                                                 json={"song_ids": random.sample(TRACK_POOL, 50)})
+                elif roll < 0.85:
+                    name = "POST /seek"
+                    response = await client.post("/seek", headers=headers, json={"timestamp_ms": random.randint(0, 60_000)})
+                elif roll < 0.95:
+                    name = "GET /me"
+                    response = await client.get("/me", headers=headers)
+                else:
+                    name = "GET /devices"
+                    response = await client.get("/devices", headers=headers)
+                self.results.record(name, started, response.status_code < 500)
+            except httpx.HTTPError:
+                self.results.record(name, started, False)
+            await asyncio.sleep(random.expovariate(1 / self.args.think_time))
+
+    async def polling_user(self, user_id: str, token: str):
+        url = f"{self.ws_url}/ws/songs/{user_id}?token={token}&protocol={self.args.protocol}"
+        try:
+            async with websockets.connect(url, max_size=None) as ws:
+                await ws.send(json.dumps({"action": "start_current_song_polling", "interval": self.args.poll_interval,
+                                          "mode": self.args.poll_mode, "delta": self.args.delta}))
+                while time.monotonic() < self.stop_at:
+                    try:
+                        frame = await asyncio.wait_for(ws.recv(), timeout=max(self.stop_at - time.monotonic(), 0.1))
+                    except asyncio.TimeoutError:
+                        break
+                    self.results.counters["song_ws_messages"] += 1
+                    self.results.counters["song_ws_bytes"] += len(frame)
+        except (OSError, websockets.WebSocketException):
+            self.results.errors["song_ws"] += 1
+
+    async def chat_user(self, room: str):
+        try:
+            async with websockets.connect(f"{self.ws_url}/ws/{room}", max_size=None) as ws:
+                async def sender():
+                    while time.monotonic() < self.stop_at:
+                        await asyncio.sleep(random.expovariate(self.args.chat_rate))
+                        await ws.send(json.dumps({"text": "hello", "sent_at": time.time()}))
+                        self.results.counters["chat_sent"] += 1
+
+                send_task = asyncio.create_task(sender())
+                try:
+                    while time.monotonic() < self.stop_at:
+                        try:
+                            frame = await asyncio.wait_for(ws.recv(), timeout=max(self.stop_at - time.monotonic(), 0.1))
+                        except asyncio.TimeoutError:
+                            break
+                        message = json.loads(frame)
+                        if "sent_at" in message:
+                            self.results.latency["chat delivery"].append((time.time() - message["sent_at"]) * 1000)
+                        self.results.counters["chat_received"] += 1
+                finally:
+                    send_task.cancel()
+        except (OSError, websockets.WebSocketException):
+            self.results.errors["chat_ws"] += 1
+
+    async def probe(self, client: httpx.AsyncClient, samples: List[float]):
+        """GET /monitor every 50ms: end-to-end responsiveness as a client sees it"""
+        while time.monotonic() < self.stop_at:
+            started = time.perf_counter()
+            try:
+                await client.get("/monitor")
+                samples.append((time.perf_counter() - started) * 1000)
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.05)
+
+    # -- orchestration --
+
+    async def run(self) -> dict:
+        args = self.args
+        fake_port, server_port = free_port(), free_port()
+        fake_url = f"http://127.0.0.1:{fake_port}"
+        self.base_url = f"http://127.0.0.1:{server_port}"
+        self.ws_url = f"ws://127.0.0.1:{server_port}"
+
+        fake = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "fake_spotify.py"), "--port", str(fake_port),
+             "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate),
+             "--ratelimit-rate", str(args.ratelimit_rate)],
+        )
+        db_dir = tempfile.mkdtemp(prefix="spotichat-bench-")
+        env = {
+            **os.environ,
+            "SPOTIFY_API_URL": f"{fake_url}/v1",
+            "SPOTIFY_CLIENT_ID": os.getenv("SPOTIFY_CLIENT_ID", "bench"),
+            "SPOTIFY_CLIENT_SECRET": os.getenv("SPOTIFY_CLIENT_SECRET", "bench"),
+            "DATABASE_PATH": os.path.join(db_dir, "bench.db"),
+            # Every simulated user connects from 127.0.0.1
+            "WS_MAX_CONNECTIONS_PER_IP": "0",
+        }
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(server_port), "--log-level", "warning"],
+            cwd=SERVER_DIR, env=env,
+        )
+        try:
+            await wait_for_http(f"{fake_url}/_stats")
+            await wait_for_http(f"{self.base_url}/monitor")
+            rss_start = rss_mb(server.pid)
+            rss_samples: List[float] = []
+            probe_samples: List[float] = []
+
+            limits = httpx.Limits(max_connections=args.users + 10)
+            async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30) as client:
+                started = time.monotonic()
+                self.stop_at = started + args.duration
+                tasks = [asyncio.create_task(self.probe(client, probe_samples))]
+                for n in range(args.users):
+                    # The fake's /me id for a token, which /ws/songs checks the path against
+                    token = f"bench-token-{n}"
+                    user_id = f"user-{token}"
+                    tasks.append(asyncio.create_task(self.rest_user(client, token)))
+                    tasks.append(asyncio.create_task(self.polling_user(user_id, token)))
+                    if args.rooms:
+                        tasks.append(asyncio.create_task(self.chat_user(f"room-{n % args.rooms}")))
+
+                while time.monotonic() < self.stop_at:
+                    await asyncio.sleep(1)
+                    rss = rss_mb(server.pid)
+                    if rss is not None:
+                        rss_samples.append(rss)
+                await asyncio.wait(tasks, timeout=10)
+                elapsed = time.monotonic() - started
+
+            async with httpx.AsyncClient() as client:
+                upstream = (await client.get(f"{fake_url}/_stats")).json()
+                loop_lag = parse_loop_lag((await client.get(f"{self.base_url}/metrics")).text)
+
+            counters = self.results.counters
+            return {
+                "config": vars(args),
+                "elapsed_s": round(elapsed, 2),
+                "rest": {
+                    name: {**summarize(samples), "errors": self.results.errors.get(name, 0),
+                           "per_sec": round(len(samples) / elapsed, 1)}
+                    for name, samples in sorted(self.results.latency.items()) if name != "chat delivery"
+                },
+                "websocket": {
+                    "song_messages": counters["song_ws_messages"],
+                    "song_messages_per_sec": round(counters["song_ws_messages"] / elapsed, 1),
+                    "song_bytes_per_sec": round(counters["song_ws_bytes"] / elapsed, 1),
+                    "chat_sent": counters["chat_sent"],
+                    "chat_received": counters["chat_received"],
+                    "chat_received_per_sec": round(counters["chat_received"] / elapsed, 1),
+                    "chat_delivery": summarize(self.results.latency.get("chat delivery", [])),
+                    "connection_errors": {k: v for k, v in self.results.errors.items() if k.endswith("_ws")},
+                },
+                "event_loop_lag": loop_lag,
+                "monitor_probe": summarize(probe_samples),
+                "server_rss_mb": {"start": rss_start, "peak": max(rss_samples, default=None),
+                                  "end": rss_samples[-1] if rss_samples else None},
+                "upstream": upstream,
+            }
+        finally:
+            for process in (server, fake):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the server against a fake Spotify API")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--rooms", type=int, default=10, help="chat rooms (0 disables chat)")
+    parser.add_argument("--chat-rate", type=float, default=0.2, help="messages/sec per chatting user")
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean seconds between REST calls per user")
+    parser.add_argument("--poll-interval", type=int, default=5)
+    parser.add_argument("--poll-mode", choices=["fixed", "adaptive"], default="fixed")
+    parser.add_argument("--delta", action="store_true", help="request delta current-song updates")
+    parser.add_argument("--protocol", choices=["json", "msgpack"], default="json", help="encoding for /ws/songs users")
+    parser.add_argument("--latency-ms", type=float, default=30, help="fake Spotify latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream 500s")
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0, help="fraction of upstream 429s")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadTest(args).run())
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
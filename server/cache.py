@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Size-bounded in-process cache with per-entry TTL and LRU eviction.
+
+    Entries can be stored with their own TTL, which is how negative results
+    (e.g. "Track not found") are kept for a shorter time than real data.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_entry(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """(value, seconds since it expired - negative while fresh), keeping expired entries"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        overdue = time.monotonic() - expires_at
+        if overdue > 0:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self._data.move_to_end(key)
+        return value, overdue
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Track metadata is the same for every user, so one cache is shared across tokens
+TRACK_CACHE_SIZE = int(os.getenv("TRACK_CACHE_SIZE", "10000"))
+TRACK_CACHE_TTL = float(os.getenv("TRACK_CACHE_TTL", "86400"))
+TRACK_CACHE_NEGATIVE_TTL = float(os.getenv("TRACK_CACHE_NEGATIVE_TTL", "300"))
+# Expired tracks are still served (and refreshed in the background) this much longer
+TRACK_CACHE_MAX_STALE = float(os.getenv("TRACK_CACHE_MAX_STALE", "604800"))
+
+track_cache = TTLCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
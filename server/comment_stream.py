@@ -0,0 +1,142 @@
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from cache import TTLCache
+from comments import comment_store, comment_change_hooks
+from playback import playback_states
+from polling import PollScheduler
+
+# Comments due within this many seconds of the listener's position are pushed
+STREAM_LOOKAHEAD = int(os.getenv("COMMENT_STREAM_LOOKAHEAD", "10"))
+# How often each listener's stream is advanced (no upstream calls involved)
+STREAM_TICK = float(os.getenv("COMMENT_STREAM_TICK", "3"))
+# Shared per-song comment windows: width in seconds, how many to keep, and for how long
+WINDOW_SECONDS = int(os.getenv("COMMENT_WINDOW_SECONDS", "30"))
+WINDOW_CACHE_SIZE = int(os.getenv("COMMENT_WINDOW_CACHE_SIZE", "2000"))
+WINDOW_CACHE_TTL = float(os.getenv("COMMENT_WINDOW_CACHE_TTL", "60"))
+
+
+class CommentWindows:
+    """Per-song comment windows (WINDOW_SECONDS of song time each) shared by all listeners.
+
+    Concurrent misses for the same window share one store query, and
+    windows are dropped when a comment inside them is added or removed.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(WINDOW_CACHE_SIZE, WINDOW_CACHE_TTL)
+        self._loading: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def _window(self, song_id: str, index: int) -> List[dict]:
+        key = (song_id, index)
+        window = self._cache.get(key)
+        if window is not None:
+            return window
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(
+                comment_store.range, song_id, index * WINDOW_SECONDS, (index + 1) * WINDOW_SECONDS - 1, 10_000
+            ))
+            self._loading[key] = future
+            future.add_done_callback(lambda done: self._loaded(key, done))
+        return await asyncio.shield(future)
+
+    def _loaded(self, key: Tuple[str, int], future: asyncio.Future):
+        # Not cached if the window was invalidated while it was loading
+        if self._loading.get(key) is future:
+            del self._loading[key]
+            if not future.cancelled() and future.exception() is None:
+                self._cache.set(key, future.result())
+
+    async def between(self, song_id: str, start: int, end: int) -> List[dict]:
+        """Comments with start <= time < end (song seconds)"""
+        found = []
+        for index in range(max(start, 0) // WINDOW_SECONDS, max(end - 1, 0) // WINDOW_SECONDS + 1):
+            for comment in await self._window(song_id, index):
+                if start <= comment["time"] < end:
+                    found.append(comment)
+        return found
+
+    def invalidate(self, song_id: str, time: Optional[int]):
+        if time is not None:
+            key = (song_id, time // WINDOW_SECONDS)
+            self._cache.pop(key)
+            self._loading.pop(key, None)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+comment_windows = CommentWindows()
+comment_change_hooks.append(comment_windows.invalidate)
+
+
+class ListenerStream:
+    __slots__ = ("song_id", "cursor")
+
+    def __init__(self):
+        self.song_id: Optional[str] = None
+        # Song second up to which comments have already been pushed
+        self.cursor = 0
+
+
+class CommentStreamer:
+    """Pushes timed comments just ahead of each listener's playback position.
+
+    Position comes from the playback registry (fed by current-song polls)
+    and is extrapolated between polls, so ticks never call Spotify. A jump
+    backwards or past the cursor (seek) restarts the stream at the new
+    position; while paused the cursor stays ahead and nothing is sent.
+    """
+
+    def __init__(self, send: Callable[[dict, str], Awaitable[None]]):
+        self.send = send
+        self.windows = comment_windows
+        self.scheduler = PollScheduler()
+        self._listeners: Dict[str, ListenerStream] = {}
+
+    def start(self, user_id: str):
+        self._listeners.setdefault(user_id, ListenerStream())
+        self.scheduler.schedule(user_id, STREAM_TICK, lambda: self.tick(user_id))
+
+    def stop(self, user_id: str):
+        self.scheduler.cancel(user_id)
+        self._listeners.pop(user_id, None)
+
+    def resync(self, user_id: str):
+        """Advance a listener's stream right away (after a seek or track change)"""
+        self.scheduler.poll_soon(user_id)
+
+    async def tick(self, user_id: str):
+        listener = self._listeners.get(user_id)
+        state = playback_states.get(user_id)
+        if listener is None or state is None or not state.song_id:
+            return None
+
+        position = state.position_ms() // 1000
+        if listener.song_id != state.song_id or position > listener.cursor \
+                or position < listener.cursor - STREAM_LOOKAHEAD - STREAM_TICK:
+            # New track or seek: restart from the current position
+            listener.song_id = state.song_id
+            listener.cursor = position
+
+        end = position + STREAM_LOOKAHEAD
+        if end <= listener.cursor:
+            return None
+        comments = await self.windows.between(state.song_id, listener.cursor, end)
+        start, listener.cursor = listener.cursor, end
+        if comments:
+            await self.send({
+                "action": "timed_comments",
+                "song_id": state.song_id,
+                "from": start,
+                "to": end,
+                "position_ms": state.position_ms(),
+                "data": comments,
+                "success": True
+            }, user_id)
+        return None
+
+    async def close(self):
+        await self.scheduler.stop()
@@ -0,0 +1,200 @@
+import time
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import APIRouter, Header, HTTPException, Query
+
+from db import Database
+from models import Comment, StoredComment
+from fanout import encode
+from pubsub import broadcast_backend
+from websocket import room_channel
+from spotify import get_current_user
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Called with (song_id, time) whenever a comment is added or removed
+comment_change_hooks: List[Callable[[str, Optional[int]], None]] = []
+
+MAX_PAGE_SIZE = 200
+DEFAULT_PAGE_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    song_id TEXT NOT NULL,
+    user TEXT NOT NULL,
+    comment TEXT NOT NULL,
+    time INTEGER,
+    created_at INTEGER NOT NULL
+);
+-- Timeline order within a song; comments without a time sort first
+CREATE INDEX IF NOT EXISTS comments_song_time ON comments (song_id, IFNULL(time, -1), id);
+"""
+
+
+def _row_to_comment(row) -> dict:
+    return dict(row)
+
+
+class CommentStore:
+    """Append-only comment storage with a per-song (time, id) index.
+
+    Queries are keyset-paged so loading a room is one indexed range scan:
+    - `page`: comments in song-time order, continuing from a "time:id" cursor
+    - `range`: comments whose `time` falls in [start, end]
+    - `since`: comments added after a given id (incremental refresh)
+    """
+
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db or Database()
+        self._ready = False
+
+    def _conn(self):
+        conn = self.db.conn
+        if not self._ready:
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    def add(self, comment: Comment) -> dict:
+        created_at = int(time.time() * 1000)
+        with self.db.lock:
+            cursor = self._conn().execute(
+                "INSERT INTO comments (song_id, user, comment, time, created_at) VALUES (?, ?, ?, ?, ?)",
+                (comment.song_id, comment.user, comment.comment, comment.time, created_at),
+            )
+        return StoredComment(id=cursor.lastrowid, created_at=created_at, **comment.model_dump()).model_dump()
+
+    def delete(self, song_id: str, comment_id: int, user: str) -> Optional[dict]:
+        """Delete `user`'s comment; returns it (None if it didn't exist, PermissionError if not theirs)"""
+        with self.db.lock:
+            conn = self._conn()
+            row = conn.execute("SELECT * FROM comments WHERE song_id = ? AND id = ?", (song_id, comment_id)).fetchone()
+            if row is None:
+                return None
+            if row["user"] != user:
+                raise PermissionError("Only the author can delete a comment")
+            conn.execute("DELETE FROM comments WHERE id = ?", (comment_id,))
+        return _row_to_comment(row)
+
+    def page(self, song_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        after_time, after_id = -2, 0
+        if cursor:
+            after_time, after_id = (int(part) for part in cursor.split(":", 1))
+        with self.db.lock:
+            rows = self._conn().execute(
+                "SELECT * FROM comments WHERE song_id = ? AND IFNULL(time, -1) >= ? "
+                "AND (IFNULL(time, -1), id) > (?, ?) ORDER BY IFNULL(time, -1), id LIMIT ?",
+                (song_id, after_time, after_time, after_id, limit + 1),
+            ).fetchall()
+        comments = [_row_to_comment(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = comments[-1]
+            next_cursor = f"{-1 if last['time'] is None else last['time']}:{last['id']}"
+        return comments, next_cursor
+
+    def range(self, song_id: str, start: int, end: int, limit: int = MAX_PAGE_SIZE) -> List[dict]:
+        with self.db.lock:
+            rows = self._conn().execute(
+                "SELECT * FROM comments WHERE song_id = ? AND IFNULL(time, -1) BETWEEN ? AND ? "
+                "ORDER BY IFNULL(time, -1), id LIMIT ?",
+                (song_id, start, end, limit),
+            ).fetchall()
+        return [_row_to_comment(row) for row in rows]
+
+    def since(self, song_id: str, after_id: int = 0, limit: int = MAX_PAGE_SIZE) -> List[dict]:
+        with self.db.lock:
+            rows = self._conn().execute(
+                "SELECT * FROM comments WHERE song_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (song_id, after_id, limit),
+            ).fetchall()
+        return [_row_to_comment(row) for row in rows]
+
+
+comment_store = CommentStore()
+
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+# SQLite calls block, so they run in a worker thread to keep the event loop free
+async def add_comment(comment: Comment) -> dict:
+    stored = await asyncio.to_thread(comment_store.add, comment)
+    for hook in comment_change_hooks:
+        hook(stored["song_id"], stored["time"])
+    return stored
+
+async def delete_comment(song_id: str, comment_id: int, user: str) -> Optional[dict]:
+    removed = await asyncio.to_thread(comment_store.delete, song_id, comment_id, user)
+    if removed is not None:
+        for hook in comment_change_hooks:
+            hook(song_id, removed["time"])
+    return removed
+
+async def get_comments_page(song_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> dict:
+    comments, next_cursor = await asyncio.to_thread(comment_store.page, song_id, clamp_limit(limit), cursor)
+    return {"comments": comments, "next_cursor": next_cursor}
+
+async def get_comments_range(song_id: str, start: int, end: int, limit: int = MAX_PAGE_SIZE) -> dict:
+    comments = await asyncio.to_thread(comment_store.range, song_id, start, end, clamp_limit(limit))
+    return {"comments": comments}
+
+async def get_comments_since(song_id: str, cursor: int = 0, limit: int = MAX_PAGE_SIZE) -> dict:
+    comments = await asyncio.to_thread(comment_store.since, song_id, cursor, clamp_limit(limit))
+    return {"comments": comments, "cursor": comments[-1]["id"] if comments else cursor}
+
+
+# -----------------------------
+# REST API Endpoints
+# -----------------------------
+async def caller_id(authorization: str) -> str:
+    """Spotify user id behind a bearer token (the /me lookup is cached)"""
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid auth header")
+    user = await get_current_user(authorization.split(" ", 1)[1])
+    return user["id"]
+
+@router.post("/comments")
+async def create_comment(body: Comment, authorization: str = Header(...)):
+    # The author is whoever the token belongs to, whatever the body says
+    comment = body.model_copy(update={"user": await caller_id(authorization)})
+    stored = await add_comment(comment)
+    # Live listeners in the song room get the new comment without re-fetching
+    broadcast_backend.publish(room_channel(body.song_id), encode({"action": "comment_added", "data": stored}))
+    return stored
+
+@router.delete("/songs/{song_id}/comments/{comment_id}")
+async def remove_comment(song_id: str, comment_id: int, authorization: str = Header(...)):
+    user = await caller_id(authorization)
+    try:
+        removed = await delete_comment(song_id, comment_id, user)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    broadcast_backend.publish(room_channel(song_id), encode({"action": "comment_removed", "data": {"id": comment_id}}))
+    return {"success": True}
+
+@router.get("/songs/{song_id}/comments")
+async def list_comments(song_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    """Comments in song-time order, one page at a time"""
+    try:
+        return await get_comments_page(song_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/songs/{song_id}/comments/range")
+async def list_comments_range(song_id: str, start: int, end: int, limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """Comments whose time (seconds into the song) is within [start, end]"""
+    return await get_comments_range(song_id, start, end, limit)
+
+@router.get("/songs/{song_id}/comments/since")
+async def list_comments_since(song_id: str, cursor: int = 0, limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """Comments added after `cursor` (the last comment id the client has)"""
+    return await get_comments_since(song_id, cursor, limit)
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import threading
+
+# Local SQLite database shared by the server-side stores (comments, ...)
+DATABASE_PATH = os.getenv("DATABASE_PATH", "spotichat.db")
+
+
+def connect(path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Open a connection tuned for many small appends and indexed reads"""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class Database:
+    """One SQLite connection guarded by a lock, used from worker threads"""
+
+    def __init__(self, path: str = DATABASE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
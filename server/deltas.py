@@ -0,0 +1,53 @@
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+# Progress drift (vs. extrapolating the last sent position) that triggers a correction
+DELTA_PROGRESS_TOLERANCE_MS = int(os.getenv("DELTA_PROGRESS_TOLERANCE_MS", "2000"))
+
+
+def _track_id(song: Optional[dict]) -> Optional[str]:
+    return song.get("id") if song else None
+
+
+class SongStateTracker:
+    """Remembers the last current-song state pushed to each connection.
+
+    `diff` turns a fresh poll result into the message to send:
+    - a full `current_song_update` when the track (or listening state) changes,
+    - a small `current_song_delta` when play state or position drifts,
+    - None when the client's own extrapolation is still correct.
+    """
+
+    def __init__(self, tolerance_ms: int = DELTA_PROGRESS_TOLERANCE_MS):
+        self.tolerance_ms = tolerance_ms
+        self._last: Dict[str, Tuple[float, Optional[dict]]] = {}
+
+    def diff(self, key: str, song: Optional[dict]) -> Optional[dict]:
+        now = time.monotonic()
+        entry = self._last.get(key)
+        if entry is None or _track_id(entry[1]) != _track_id(song):
+            self._last[key] = (now, song)
+            return {"action": "current_song_update", "data": song, "success": song is not None}
+        if song is None:
+            return None
+
+        sent_at, previous = entry
+        changes = {}
+        if song.get("is_playing") != previous.get("is_playing"):
+            changes["is_playing"] = song.get("is_playing")
+            changes["progress_ms"] = song.get("progress_ms")
+        elif song.get("progress_ms") is not None and previous.get("progress_ms") is not None:
+            expected = previous["progress_ms"]
+            if previous.get("is_playing"):
+                expected += int((now - sent_at) * 1000)
+            if abs(song["progress_ms"] - expected) > self.tolerance_ms:
+                changes["progress_ms"] = song["progress_ms"]
+        if not changes:
+            return None
+
+        self._last[key] = (now, song)
+        return {"action": "current_song_delta", "data": {"id": song["id"], **changes}, "success": True}
+
+    def forget(self, key: str):
+        self._last.pop(key, None)
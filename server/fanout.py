@@ -0,0 +1,159 @@
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Dict, Hashable, Optional
+
+from fastapi import WebSocket
+
+from protocol import JSON, Frame, encode_as, transcode
+
+logger = logging.getLogger(__name__)
+
+# Max frames waiting for one slow client before the overflow policy applies
+FANOUT_QUEUE_SIZE = int(os.getenv("FANOUT_QUEUE_SIZE", "256"))
+# "drop_oldest" discards the oldest queued frame; "evict" closes the slow socket
+FANOUT_OVERFLOW_POLICY = os.getenv("FANOUT_OVERFLOW_POLICY", "drop_oldest")
+# Close code used when a client is evicted for falling behind ("try again later")
+EVICT_CLOSE_CODE = 1013
+
+
+def encode(message: dict) -> Frame:
+    """Serialize a message once so every recipient gets the same frame.
+
+    Frames are JSON between workers; compact clients get them transcoded
+    once per broadcast (see FanoutGroup.broadcast).
+    """
+    return json.dumps(message)
+
+
+class Outbox:
+    """Bounded outgoing queue for one WebSocket, drained by its own writer task.
+
+    `put` never awaits, so a slow peer can't hold up whoever is sending.
+    When the queue passes the high-water mark the overflow policy applies.
+    `on_close` runs once when the writer stops (send error or eviction).
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int = FANOUT_QUEUE_SIZE,
+                 policy: str = FANOUT_OVERFLOW_POLICY, on_close: Optional[Callable[[], None]] = None,
+                 protocol: str = JSON):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_close = on_close
+        self.dropped = 0
+        self.closed = False
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._drain())
+
+    def put(self, frame: Frame) -> bool:
+        """Queue a frame; returns False if the connection is (now) closed"""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.maxsize:
+            if self.policy == "evict":
+                logger.warning("Evicting slow WebSocket client (queue full)")
+                self.stop()
+                asyncio.create_task(self.close(EVICT_CLOSE_CODE))
+                return False
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(frame)
+        self._ready.set()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    async def _drain(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    frame = self._queue.popleft()
+                    if isinstance(frame, bytes):
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error sending WebSocket frame: {e}")
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.clear()
+            if self.on_close is not None:
+                self.on_close()
+
+    def stop(self):
+        """Stop the writer and drop anything still queued"""
+        self._writer.cancel()
+        self._finish()
+
+    async def close(self, code: int):
+        """Stop the writer and close the socket (used for eviction)"""
+        self.stop()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class FanoutGroup:
+    """A set of outboxes that receives broadcasts (a song room, or all song sockets)"""
+
+    def __init__(self):
+        self.outboxes: Dict[Hashable, Outbox] = {}
+
+    def add(self, key: Hashable, websocket: WebSocket, on_close: Optional[Callable[[], None]] = None,
+            protocol: str = JSON) -> Outbox:
+        outbox = Outbox(websocket, on_close=on_close, protocol=protocol)
+        self.outboxes[key] = outbox
+        return outbox
+
+    def get(self, key: Hashable) -> Optional[Outbox]:
+        return self.outboxes.get(key)
+
+    def remove(self, key: Hashable):
+        outbox = self.outboxes.pop(key, None)
+        if outbox is not None:
+            outbox.stop()
+
+    def send(self, key: Hashable, frame: Frame) -> bool:
+        outbox = self.outboxes.get(key)
+        return outbox is not None and outbox.put(transcode(frame, outbox.protocol))
+
+    def send_message(self, key: Hashable, message: dict) -> bool:
+        """Encode a message straight into the member's protocol and queue it"""
+        outbox = self.outboxes.get(key)
+        return outbox is not None and outbox.put(encode_as(message, outbox.protocol))
+
+    def broadcast(self, frame: Frame, exclude: Optional[Hashable] = None) -> int:
+        """Queue an already-encoded frame for every member; returns how many got it"""
+        delivered = 0
+        # Re-encoded at most once per protocol, however many members use it
+        frames = {JSON: frame}
+        for key, outbox in list(self.outboxes.items()):
+            if key == exclude:
+                continue
+            encoded = frames.get(outbox.protocol)
+            if encoded is None:
+                encoded = frames[outbox.protocol] = transcode(frame, outbox.protocol)
+            if outbox.put(encoded):
+                delivered += 1
+        return delivered
+
+    def __len__(self) -> int:
+        return len(self.outboxes)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.outboxes
@@ -0,0 +1,189 @@
+import os
+import time
+import heapq
+import hashlib
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Request priorities: lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Budget for the whole app (one Spotify client ID) and for each user token
+GOVERNOR_APP_RATE = float(os.getenv("GOVERNOR_APP_RATE", "25"))
+GOVERNOR_APP_BURST = float(os.getenv("GOVERNOR_APP_BURST", "50"))
+GOVERNOR_TOKEN_RATE = float(os.getenv("GOVERNOR_TOKEN_RATE", "5"))
+GOVERNOR_TOKEN_BURST = float(os.getenv("GOVERNOR_TOKEN_BURST", "10"))
+# Longest a request may queue before it is shed with a local 429
+GOVERNOR_INTERACTIVE_MAX_WAIT = float(os.getenv("GOVERNOR_INTERACTIVE_MAX_WAIT", "15"))
+GOVERNOR_BACKGROUND_MAX_WAIT = float(os.getenv("GOVERNOR_BACKGROUND_MAX_WAIT", "5"))
+# Retry-After used when Spotify sends a 429 without one
+DEFAULT_RETRY_AFTER = 5.0
+
+
+class UpstreamThrottled(Exception):
+    """Spotify (or our own budget) is rate limiting; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until one token is available (0 if it is now)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> bool:
+        if self.delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Governor:
+    """Shapes all Spotify traffic to stay under the rate limit.
+
+    - Each user token has its own bucket, so one busy user can't starve others.
+    - Requests then queue for the app-wide bucket by priority, so interactive
+      calls (/seek, /song) jump ahead of background polls.
+    - A 429 blocks every caller until its Retry-After has passed.
+    Requests that can't get a slot within their max wait are shed with
+    UpstreamThrottled instead of piling onto an already limited API.
+    """
+
+    def __init__(self):
+        self.app_bucket = TokenBucket(GOVERNOR_APP_RATE, GOVERNOR_APP_BURST)
+        self._token_buckets = TTLCache(10_000, 600)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.blocked_until = 0.0
+        self.throttle_events = 0
+        self.throttled_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self.shed = 0
+
+    def _token_bucket(self, token: str) -> TokenBucket:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        bucket = self._token_buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(GOVERNOR_TOKEN_RATE, GOVERNOR_TOKEN_BURST)
+            self._token_buckets.set(key, bucket)
+        return bucket
+
+    async def acquire(self, token: Optional[str], priority: int = INTERACTIVE):
+        """Wait for permission to send one request, or raise UpstreamThrottled"""
+        max_wait = GOVERNOR_INTERACTIVE_MAX_WAIT if priority == INTERACTIVE else GOVERNOR_BACKGROUND_MAX_WAIT
+        started = time.monotonic()
+        deadline = started + max_wait
+        try:
+            if token:
+                bucket = self._token_bucket(token)
+                while not bucket.take():
+                    delay = bucket.delay()
+                    if time.monotonic() + delay > deadline:
+                        raise UpstreamThrottled(delay)
+                    await asyncio.sleep(delay)
+
+            now = time.monotonic()
+            if not self._waiters and now >= self.blocked_until and self.app_bucket.take():
+                return
+            if self.blocked_until > deadline:
+                # Still rate limited when our wait would run out: shed now, not after it
+                raise UpstreamThrottled(self.blocked_until - now)
+
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._seq += 1
+            heapq.heappush(self._waiters, (priority, self._seq, future))
+            self._ensure_dispatcher()
+            try:
+                await asyncio.wait_for(future, max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise UpstreamThrottled(max(self.blocked_until - time.monotonic(), 1.0))
+        except UpstreamThrottled:
+            self.shed += 1
+            raise
+        finally:
+            self.queue_wait_seconds += time.monotonic() - started
+
+    def observe(self, status_code: int, retry_after: Optional[str]):
+        """Record an upstream response; a 429 pauses every caller"""
+        if status_code != 429:
+            return
+        try:
+            delay = float(retry_after) if retry_after else DEFAULT_RETRY_AFTER
+        except ValueError:
+            delay = DEFAULT_RETRY_AFTER
+        now = time.monotonic()
+        until = now + delay
+        if until > self.blocked_until:
+            self.throttled_seconds += until - max(self.blocked_until, now)
+            self.blocked_until = until
+        self.throttle_events += 1
+        logger.warning(f"Spotify rate limit hit, pausing upstream calls for {delay:.1f}s")
+
+    def retry_after(self) -> float:
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        while self._waiters:
+            # Drop waiters that timed out or were cancelled
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                break
+            delay = max(self.blocked_until - time.monotonic(), self.app_bucket.delay())
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.app_bucket.take()
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        queued = [entry for entry in self._waiters if not entry[2].done()]
+        return {
+            "queued": len(queued),
+            "queued_interactive": sum(1 for entry in queued if entry[0] == INTERACTIVE),
+            "queued_background": sum(1 for entry in queued if entry[0] == BACKGROUND),
+            "blocked_for_s": round(self.retry_after(), 3),
+            "throttle_events": self.throttle_events,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "queue_wait_seconds": round(self.queue_wait_seconds, 3),
+            "shed": self.shed,
+        }
+
+
+governor = Governor()
@@ -1,14 +1,39 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from spotify import get_auth_url, exchange_code, get_current_song, get_current_user, get_user_by_id
+from spotify import (
+    get_auth_url, exchange_code, get_current_song, get_current_user, get_user_by_id, get_playback, aged, profile_cache,
+    playback_reads,
+)
+from upstream import UpstreamError, spotify_get, spotify_put, close_clients
+from tracks import (
+    get_song_by_id_helper, get_multiple_songs_helper, parse_fields, project_track, tracks_etag, etag_matches,
+    TRACK_HTTP_MAX_AGE,
+)
+from governor import governor, UpstreamThrottled, INTERACTIVE, BACKGROUND
+from polling import poll_scheduler, AdaptivePolicy, SEEK_REPOLL_DELAY
+from deltas import SongStateTracker
+from fanout import FanoutGroup, encode
+from protocol import negotiate, hello, receive
+from websocket import router as rooms_router, room_manager
+from pubsub import broadcast_backend
+from comments import (
+    router as comments_router, get_comments_page, get_comments_range, get_comments_since, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE,
+)
+from comment_stream import CommentStreamer, comment_windows
+from playback import playback_states
+from presence import router as presence_router, presence
+from tokens import token_manager, parse_expires_at
+from metrics import registry, MetricsMiddleware, loop_lag_monitor, ws_action_seconds, polls_total
+from cache import track_cache
+from store import state_store
 from pydantic import BaseModel
 import os
-import base64
 from dotenv import load_dotenv
-import requests
-import json
+import httpx
+import time
 import asyncio
-from typing import Dict, List
+from typing import Dict, Hashable, List, Optional, Tuple
 import logging
 
 # Setup logging
@@ -20,6 +45,32 @@ load_dotenv()
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_REDIRECT_URI = "https://liscuss.vercel.app/callback"
+# "fixed" polls every `interval` seconds; "adaptive" follows the track boundary
+POLL_DEFAULT_MODE = os.getenv("POLL_DEFAULT_MODE", "fixed")
+# /ws/songs admission: "fanout" keeps every socket of a user and sends each of
+# them the user's messages, "replace" closes the older socket when they connect again
+DUPLICATE_SESSION_POLICY = os.getenv("DUPLICATE_SESSION_POLICY", "fanout")
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+# Per-address cap, off by default (0): behind a proxy every client shares its address
+# unless WS_TRUST_PROXY is set
+WS_MAX_CONNECTIONS_PER_IP = int(os.getenv("WS_MAX_CONNECTIONS_PER_IP", "0"))
+WS_MAX_SESSIONS_PER_USER = int(os.getenv("WS_MAX_SESSIONS_PER_USER", "5"))
+# Use X-Forwarded-For for the per-IP cap (only behind a proxy that sets it)
+WS_TRUST_PROXY = os.getenv("WS_TRUST_PROXY", "0") == "1"
+# Silent sockets get a ping after this long and are closed after WS_IDLE_TIMEOUT.
+# Clients that have never answered a ping (released before the heartbeat) are
+# not reaped for silence; a failed ping write still closes them.
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "120"))
+BUSY_CLOSE_CODE = 1013
+REPLACED_CLOSE_CODE = 4000
+FORBIDDEN_CLOSE_CODE = 4003
+IDLE_CLOSE_CODE = 4002
+# Max pipelined requests one /ws/songs socket may have running at once
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "8"))
+# /seek trusts polled playback state this fresh (seconds) instead of re-reading it,
+# and never older than the user's poll interval
+SEEK_STATE_MAX_AGE = float(os.getenv("SEEK_STATE_MAX_AGE", "5"))
 
 # Updated scope to include seek permissions
 scope = "user-read-currently-playing user-read-playback-state user-modify-playback-state"
@@ -34,127 +85,572 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route latency histograms, exposed at /metrics
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(UpstreamThrottled)
+async def upstream_throttled_handler(request: Request, exc: UpstreamThrottled):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Spotify rate limit reached, try again shortly"},
+        headers={"Retry-After": str(max(int(exc.retry_after + 0.999), 1))}
+    )
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    # Spotify failed (5xx) where the route had no fallback
+    return JSONResponse(status_code=503, content={"detail": "Service temporarily unavailable"})
+
+# Song chat rooms (/ws/{song_id})
+app.include_router(rooms_router)
+# Server-side comment store
+app.include_router(comments_router)
+# Live listener counts per song room
+app.include_router(presence_router)
+
+@app.on_event("startup")
+async def startup_broadcast():
+    await broadcast_backend.start()
+    presence.start()
+    loop_lag_monitor.start()
+    song_manager.start()
+    room_manager.start()
+    state_store.start()
+
+@app.on_event("shutdown")
+async def shutdown_upstream():
+    await song_manager.stop()
+    await room_manager.stop()
+    # After the room manager, whose last snapshots it writes
+    await state_store.stop()
+    await poll_scheduler.stop()
+    await comment_streamer.close()
+    await token_manager.close()
+    await presence.stop()
+    await loop_lag_monitor.stop()
+    await broadcast_backend.stop()
+    await close_clients()
+
+class SongConnection:
+    __slots__ = ("websocket", "user_id", "ip", "last_seen", "answers_pings")
+
+    def __init__(self, websocket: WebSocket, user_id: str, ip: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.ip = ip
+        self.last_seen = time.monotonic()
+        self.answers_pings = False
+
+def client_ip(websocket: WebSocket) -> str:
+    if WS_TRUST_PROXY:
+        forwarded = websocket.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return websocket.client.host if websocket.client else "unknown"
 
 # WebSocket Connection Manager for Songs
 class SongConnectionManager:
+    """Song sockets, keyed by connection, with admission control and idle reaping.
+
+    A user's second socket either replaces the first (closed, its polls torn
+    down) or joins it and receives the same messages, per
+    DUPLICATE_SESSION_POLICY. Per-user state (poller, token, comment stream)
+    lives until the user's last socket goes. Sockets silent for
+    WS_HEARTBEAT_INTERVAL get a ping; past WS_IDLE_TIMEOUT they are closed
+    if they have ever answered one.
+    """
+
     def __init__(self):
+        # Newest socket per user
         self.active_connections: Dict[str, WebSocket] = {}
+        self.connections: Dict[int, SongConnection] = {}
+        self.user_connections: Dict[str, List[int]] = {}
+        self.ip_connections: Dict[str, int] = {}
         self.user_tokens: Dict[str, str] = {}
+        self.token_users: Dict[str, str] = {}
+        # Outgoing frames go through a bounded per-connection queue + writer task
+        self.outboxes = FanoutGroup()
+        # Broadcasts reach song sockets connected to any worker
+        broadcast_backend.subscribe("songs", lambda frame, exclude: self.outboxes.broadcast(frame))
+        self.rejected = 0
+        self.replaced = 0
+        self.reaped = 0
+        self._reaper: Optional[asyncio.Task] = None
+        
+    def _admission_error(self, ip: str, user_id: str) -> Optional[str]:
+        if len(self.connections) >= WS_MAX_CONNECTIONS:
+            return "Server is at capacity"
+        if WS_MAX_CONNECTIONS_PER_IP and self.ip_connections.get(ip, 0) >= WS_MAX_CONNECTIONS_PER_IP:
+            return "Too many connections from this address"
+        if DUPLICATE_SESSION_POLICY == "fanout" and len(self.user_connections.get(user_id, ())) >= WS_MAX_SESSIONS_PER_USER:
+            return "Too many sessions for this user"
+        return None
         
-    async def connect(self, websocket: WebSocket, user_id: str, token: str):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, user_id: str, token: str) -> bool:
+        """Accept the socket if admission allows; False if it was turned away"""
+        # JSON unless the client asked for a compact encoding
+        protocol, subprotocol = negotiate(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        ip = client_ip(websocket)
+        code, reason = BUSY_CLOSE_CODE, self._admission_error(ip, user_id)
+        if not reason:
+            code, reason = await self._owner_error(user_id, token) or (code, None)
+        if reason:
+            self.rejected += 1
+            logger.warning(f"Rejected songs WebSocket for user {user_id}: {reason}")
+            await websocket.close(code=code, reason=reason)
+            return False
+        if DUPLICATE_SESSION_POLICY != "fanout":
+            for conn_id in list(self.user_connections.get(user_id, ())):
+                self.replaced += 1
+                await self._close(conn_id, REPLACED_CLOSE_CODE)
+        
+        conn_id = id(websocket)
+        self.connections[conn_id] = SongConnection(websocket, user_id, ip)
+        self.user_connections.setdefault(user_id, []).append(conn_id)
+        self.ip_connections[ip] = self.ip_connections.get(ip, 0) + 1
         self.active_connections[user_id] = websocket
-        self.user_tokens[user_id] = token
+        self.swap_token(user_id, token)
+        outbox = self.outboxes.add(conn_id, websocket, on_close=lambda: self._drop(conn_id), protocol=protocol)
+        greeting = hello(protocol)
+        if greeting is not None:
+            outbox.put(greeting)
         logger.info(f"User {user_id} connected to songs WebSocket")
-        
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+        return True
+
+    async def _owner_error(self, user_id: str, token: str) -> Optional[Tuple[int, str]]:
+        """(close code, reason) unless the token belongs to user_id.
+
+        Everything sent to a user (including refreshed tokens) goes to all of
+        their sockets, so the id in the path has to be the token's /me id.
+        """
+        try:
+            user = await get_current_user(token)
+        except HTTPException:
+            return FORBIDDEN_CLOSE_CODE, "Invalid token"
+        except (UpstreamThrottled, UpstreamError, httpx.HTTPError):
+            return BUSY_CLOSE_CODE, "Spotify is unavailable, try again shortly"
+        if user.get("id") != user_id:
+            return FORBIDDEN_CLOSE_CODE, "Token does not belong to this user"
+        return None
+
+    def touch(self, websocket: WebSocket, pong: bool = False):
+        """The client sent something, so it's alive"""
+        conn = self.connections.get(id(websocket))
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+            if pong:
+                conn.answers_pings = True
+
+    def swap_token(self, user_id: str, token: str):
+        """Point a live session (and its poller) at a refreshed access token"""
+        old = self.user_tokens.get(user_id)
+        if old is not None:
+            self.token_users.pop(old, None)
+        self.user_tokens[user_id] = token
+        self.token_users[token] = user_id
+
+    def _drop(self, conn_id: int) -> Optional[str]:
+        """Forget one connection; tears the user's state down with their last one"""
+        conn = self.connections.pop(conn_id, None)
+        if conn is None:
+            return None
+        self.outboxes.remove(conn_id)
+        remaining = self.ip_connections.get(conn.ip, 1) - 1
+        if remaining:
+            self.ip_connections[conn.ip] = remaining
+        else:
+            self.ip_connections.pop(conn.ip, None)
+        user_id = conn.user_id
+        siblings = self.user_connections.get(user_id, [])
+        if conn_id in siblings:
+            siblings.remove(conn_id)
+        if siblings:
+            if self.active_connections.get(user_id) is conn.websocket:
+                self.active_connections[user_id] = self.connections[siblings[-1]].websocket
+            return user_id
+        self.user_connections.pop(user_id, None)
+        self.active_connections.pop(user_id, None)
+        poll_scheduler.cancel(user_id)
+        comment_streamer.stop(user_id)
+        token_manager.forget(user_id)
+        song_state.forget(user_id)
+        playback_states.forget(user_id)
         if user_id in self.user_tokens:
+            self.token_users.pop(self.user_tokens[user_id], None)
             del self.user_tokens[user_id]
         logger.info(f"User {user_id} disconnected from songs WebSocket")
+        return user_id
+
+    async def _close(self, conn_id: int, code: int):
+        conn = self.connections.get(conn_id)
+        outbox = self.outboxes.get(conn_id)
+        self._drop(conn_id)
+        if outbox is not None:
+            await outbox.close(code)
+        elif conn is not None:
+            try:
+                await conn.websocket.close(code=code)
+            except Exception:
+                pass
+        
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Drop one socket (or, without one, all of the user's sockets)"""
+        if websocket is not None:
+            self._drop(id(websocket))
+            return
+        for conn_id in list(self.user_connections.get(user_id, ())):
+            self._drop(conn_id)
+        
+    def send_message(self, user_id: str, message: dict):
+        """Queue a message for every socket the user has open"""
+        for conn_id in self.user_connections.get(user_id, ()):
+            self.outboxes.send_message(conn_id, message)
         
     async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error sending message to {user_id}: {e}")
-                self.disconnect(user_id)
+        self.send_message(user_id, message)
                 
     async def broadcast(self, message: dict):
-        disconnected_users = []
-        for user_id, connection in self.active_connections.items():
+        # Serialized once, queued for every connection without awaiting slow peers
+        broadcast_backend.publish("songs", encode(message))
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL / 2)
+            now = time.monotonic()
+            for conn_id, conn in list(self.connections.items()):
+                idle = now - conn.last_seen
+                if idle > WS_IDLE_TIMEOUT and conn.answers_pings:
+                    self.reaped += 1
+                    logger.info(f"Closing idle songs WebSocket for user {conn.user_id}")
+                    await self._close(conn_id, IDLE_CLOSE_CODE)
+                elif idle >= WS_HEARTBEAT_INTERVAL:
+                    # Clients answer with {"action": "pong"}, which counts as activity
+                    self.outboxes.send_message(conn_id, {"action": "ping", "timestamp": int(time.time() * 1000)})
+
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
             try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting to {user_id}: {e}")
-                disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "users": len(self.user_connections),
+            "addresses": len(self.ip_connections),
+            "rejected": self.rejected,
+            "replaced": self.replaced,
+            "reaped": self.reaped,
+        }
 
 song_manager = SongConnectionManager()
+# Last current-song state pushed to each user polling with delta=true
+song_state = SongStateTracker()
+# Timed comments pushed ahead of each listener's playback position
+comment_streamer = CommentStreamer(song_manager.send_personal_message)
 
-# Helper function to get song by ID (shared between REST and WebSocket)
-def get_song_by_id_helper(token: str, song_id: str):
-    """Get song details by Spotify track ID"""
-    try:
-        response = requests.get(
-            f"https://api.spotify.com/v1/tracks/{song_id}",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            track_data = response.json()
-            return {
-                "id": track_data["id"],
-                "name": track_data["name"],
-                "artist": track_data["artists"][0].get("name"),
-                "artists": [artist.get("name") for artist in track_data["artists"]],
-                "album": {
-                    "name": track_data["album"]["name"],
-                    "images": track_data["album"]["images"]
-                },
-                "images": track_data["album"]["images"],
-                "duration_ms": track_data["duration_ms"],
-                "explicit": track_data["explicit"],
-                "external_urls": track_data["external_urls"],
-                "preview_url": track_data.get("preview_url"),
-                "popularity": track_data["popularity"],
-                "is_local": track_data.get("is_local", False),
-                "track_number": track_data.get("track_number"),
-                "disc_number": track_data.get("disc_number")
-            }
-        elif response.status_code == 400:
-            return {"error": "Invalid track ID"}
-        elif response.status_code == 404:
-            return {"error": "Track not found"}
-        else:
-            return {"error": f"Spotify API error: {response.status_code}"}
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error fetching song {song_id}: {e}")
-        return {"error": "Network error"}
-    except Exception as e:
-        logger.error(f"Error fetching song {song_id}: {e}")
-        return {"error": "Internal server error"}
+# Metrics: per-action histograms are bound once; anything else shares "unknown"
+WS_ACTIONS = (
+    "get_current_song", "get_song_by_id", "get_multiple_songs", "start_current_song_polling",
+    "stop_current_song_polling", "get_comments", "start_comment_stream", "stop_comment_stream",
+    "seek", "register_refresh_token", "ping", "pong", "unknown",
+)
+# Actions that may wait on Spotify or the database run concurrently per socket
+PIPELINED_ACTIONS = {"get_current_song", "get_song_by_id", "get_multiple_songs", "get_comments", "seek"}
+ws_action_timers = {action: ws_action_seconds.labels(action) for action in WS_ACTIONS}
+poll_outcomes = {outcome: polls_total.labels(outcome) for outcome in ("pushed", "unchanged", "throttled")}
+
+registry.gauge("spotichat_song_connections", "/ws/songs connections and admission events on this worker", ("stat",),
+               read=lambda: {(key,): value for key, value in song_manager.stats().items()})
+registry.gauge("spotichat_poll_jobs", "Current-song poll jobs by state", ("state",),
+               read=lambda: {(key,): value for key, value in poll_scheduler.stats().items()})
+registry.gauge("spotichat_cache", "Cache size, hits, misses and evictions", ("cache", "stat"),
+               read=lambda: {
+                   (name, stat): value
+                   for name, cache in (("tracks", track_cache), ("profiles", profile_cache), ("comment_windows", comment_windows),
+                                       ("current_song", playback_reads))
+                   for stat, value in cache.stats().items()
+               })
+registry.gauge("spotichat_token_sessions", "Server-side token refresh state", ("stat",),
+               read=lambda: {(key,): value for key, value in token_manager.stats().items()})
+registry.gauge("spotichat_governor", "Spotify rate-limit governor state", ("stat",),
+               read=lambda: {(key,): value for key, value in governor.stats().items()})
+
+def session_token_refreshed(user_id: str, token_info: dict):
+    """Token manager refreshed a session: swap it in and hand the client its new token"""
+    if user_id not in song_manager.active_connections:
+        return
+    song_manager.swap_token(user_id, token_info["access_token"])
+    response = {
+        "action": "token_refreshed",
+        "access_token": token_info["access_token"],
+        "expires_at": token_info["expires_at"],
+        "success": True
+    }
+    if token_info.get("refresh_token"):
+        response["refresh_token"] = token_info["refresh_token"]
+    song_manager.send_message(user_id, response)
+
+token_manager.refresh_hooks.append(session_token_refreshed)
+
+def observe_playback(user_id: str, current_song: Optional[dict]):
+    """Record the user's playback; a track change advances their comment stream now"""
+    previous = playback_states.get(user_id)
+    playback_states.update(user_id, current_song)
+    if current_song and (previous is None or previous.song_id != current_song.get("id")):
+        comment_streamer.resync(user_id)
 
 # WebSocket helper functions
 async def get_song_by_id_ws(token: str, song_id: str):
     """Get song details by Spotify track ID for WebSocket"""
-    return get_song_by_id_helper(token, song_id)
+    return await get_song_by_id_helper(token, song_id)
 
-async def get_current_song_ws(token: str):
-    """Get current playing song for WebSocket"""
+async def get_current_song_ws(token: str, priority: int = INTERACTIVE):
+    """Get current playing song for WebSocket (raises UpstreamThrottled when rate limited).
+
+    During upstream trouble this is the last known song, moved forward and
+    marked "stale" with its "age_ms".
+    """
     try:
-        response = requests.get(
-            "https://api.spotify.com/v1/me/player/currently-playing",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data and data.get("item"):
-                track = data["item"]
-                return {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": track["artists"][0].get("name"),
-                    "images": track["album"]["images"],
-                    "duration_ms": track["duration_ms"],
-                    "explicit": track["explicit"],
-                    "external_urls": track["external_urls"],
-                    "preview_url": track.get("preview_url"),
-                    "popularity": track["popularity"],
-                    "is_playing": data.get("is_playing", False),
-                }
+        playback, age = await get_playback(token, priority)
+    except UpstreamThrottled:
+        raise
+    except UpstreamError as e:
+        if e.status_code == 401:
+            # Expired token: refresh the session now rather than at its planned time
+            expired_user = song_manager.token_users.get(token)
+            if expired_user:
+                token_manager.refresh_now(expired_user)
         return None
     except Exception as e:
         logger.error(f"Error fetching current song: {e}")
         return None
+    if playback is None:
+        return None
+    song = aged(playback, age) if age else dict(playback)
+    del song["artists"]
+    return song
+
+async def handle_song_action(user_id: str, token: str, message: dict) -> Optional[dict]:
+    """Run one /ws/songs action and build its response"""
+    action = message.get("action")
+    
+    if action == "get_current_song":
+        # Get current playing song
+        try:
+            current_song = await get_current_song_ws(token)
+            observe_playback(user_id, current_song)
+            response = {
+                "action": "current_song_response",
+                "data": current_song,
+                "success": current_song is not None
+            }
+        except UpstreamThrottled as e:
+            response = {
+                "action": "current_song_response",
+                "error": "Rate limited",
+                "retry_after": e.retry_after,
+                "success": False
+            }
+        return response
+        
+    elif action == "get_song_by_id":
+        # Get specific song by ID (optionally trimmed to "fields")
+        song_id = message.get("song_id")
+        try:
+            wanted = parse_fields(message.get("fields"))
+            if not song_id:
+                raise ValueError("No song_id provided")
+            song = await get_song_by_id_ws(token, song_id)
+            response = {
+                "action": "song_by_id_response",
+                "data": project_track(song, wanted),
+                "song_id": song_id,
+                "success": song is not None and "error" not in song
+            }
+        except ValueError as e:
+            response = {
+                "action": "song_by_id_response",
+                "error": str(e),
+                "success": False
+            }
+        return response
+        
+    elif action == "get_multiple_songs":
+        # Get multiple songs by IDs
+        song_ids = message.get("song_ids", [])
+        try:
+            wanted = parse_fields(message.get("fields"))
+            if not song_ids or len(song_ids) > 50:  # Spotify API limit
+                raise ValueError("Invalid song_ids (max 50 allowed)")
+            found = await get_multiple_songs_helper(token, song_ids)
+            songs = [project_track(found[song_id], wanted) for song_id in song_ids if "error" not in found[song_id]]
+            
+            response = {
+                "action": "multiple_songs_response",
+                "data": {"tracks": songs},
+                "success": True
+            }
+        except ValueError as e:
+            response = {
+                "action": "multiple_songs_response",
+                "error": str(e),
+                "success": False
+            }
+        return response
+        
+    elif action == "start_current_song_polling":
+        # Start polling current song every N seconds
+        interval = message.get("interval", 5)  # Default 5 seconds
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) or not 0 < interval < float("inf"):
+            return {
+                "action": "polling_started",
+                "error": "interval must be a positive number of seconds",
+                "success": False
+            }
+        mode = message.get("mode", POLL_DEFAULT_MODE)
+        # In adaptive mode `interval` is the longest wait while a track plays
+        policy = AdaptivePolicy(interval) if mode == "adaptive" else None
+        # delta=true: only push changes; older clients keep full updates
+        delta = bool(message.get("delta", False))
+        # First poll after a (re)start always sends the full song
+        song_state.forget(user_id)
+        # (Re)schedule this user's poll; repeated starts only change the interval.
+        # The first poll runs after this response is queued.
+        poll_scheduler.schedule(user_id, interval, lambda: poll_current_song(user_id, policy, delta))
+        response = {
+            "action": "polling_started",
+            "interval": interval,
+            "mode": "adaptive" if policy else "fixed",
+            "delta": delta,
+            "success": True
+        }
+        return response
+        
+    elif action == "stop_current_song_polling":
+        poll_scheduler.cancel(user_id)
+        response = {
+            "action": "polling_stopped",
+            "success": True
+        }
+        return response
+        
+    elif action == "get_comments":
+        # One indexed query: a page (cursor), a time range, or everything since a cursor
+        song_id = message.get("song_id")
+        mode = message.get("mode", "page")
+        limit = message.get("limit", DEFAULT_PAGE_SIZE)
+        try:
+            if not song_id:
+                raise ValueError("No song_id provided")
+            if not isinstance(limit, int) or not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be an integer from 1 to {MAX_PAGE_SIZE}")
+            if mode == "range":
+                data = await get_comments_range(song_id, int(message.get("start", 0)), int(message.get("end", 0)), limit)
+            elif mode == "since":
+                data = await get_comments_since(song_id, int(message.get("cursor", 0)), limit)
+            else:
+                data = await get_comments_page(song_id, limit, message.get("cursor"))
+            response = {
+                "action": "comments_response",
+                "song_id": song_id,
+                "mode": mode,
+                "data": data,
+                "success": True
+            }
+        except (TypeError, ValueError) as e:
+            response = {
+                "action": "comments_response",
+                "error": str(e),
+                "success": False
+            }
+        return response
+        
+    elif action == "start_comment_stream":
+        # Push comments due in the next few seconds of this user's playback
+        comment_streamer.start(user_id)
+        response = {
+            "action": "comment_stream_started",
+            "success": True
+        }
+        return response
+        
+    elif action == "stop_comment_stream":
+        comment_streamer.stop(user_id)
+        response = {
+            "action": "comment_stream_stopped",
+            "success": True
+        }
+        return response
+        
+    elif action == "seek":
+        # Same as POST /seek without the HTTP round trip
+        return await seek_ws(token, message.get("timestamp_ms"), message.get("device_id"))
+        
+    elif action == "register_refresh_token":
+        # Lets the server refresh this session's token before it expires
+        refresh_token = message.get("refresh_token")
+        if refresh_token:
+            token_manager.track(user_id, token, refresh_token, parse_expires_at(message.get("expires_at")))
+            response = {
+                "action": "refresh_token_registered",
+                "success": True
+            }
+        else:
+            response = {
+                "action": "refresh_token_registered",
+                "error": "No refresh_token provided",
+                "success": False
+            }
+        return response
+        
+    elif action == "pong":
+        # Answer to a server heartbeat; the message itself marked the socket alive
+        return None
+        
+    elif action == "ping":
+        # Ping-pong for connection health
+        response = {
+            "action": "pong",
+            "timestamp": message.get("timestamp"),
+            "success": True
+        }
+        return response
+        
+    else:
+        # Unknown action
+        response = {
+            "action": "error",
+            "error": f"Unknown action: {action}",
+            "success": False
+        }
+        return response
+
+async def run_song_action(user_id: str, token: str, message: dict):
+    """Handle an action and send its response, tagged with the client's request_id"""
+    action = message.get("action")
+    timer = ws_action_timers.get(action) or ws_action_timers["unknown"]
+    started = time.perf_counter()
+    try:
+        response = await handle_song_action(user_id, token, message)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error handling {action} for user {user_id}: {e}")
+        response = {"action": "error", "error": "Internal server error", "success": False}
+    timer.observe(time.perf_counter() - started)
+    if response is not None:
+        if "request_id" in message:
+            response["request_id"] = message["request_id"]
+        await song_manager.send_personal_message(response, user_id)
 
 # WebSocket endpoint for song operations
 @app.websocket("/ws/songs/{user_id}")
@@ -165,158 +661,161 @@ async def websocket_songs_endpoint(websocket: WebSocket, user_id: str):
         await websocket.close(code=4001, reason="No token provided")
         return
         
-    await song_manager.connect(websocket, user_id, token)
+    if not await song_manager.connect(websocket, user_id, token):
+        return
+    
+    # Requests still running for this socket, by request_id (or a placeholder for untagged ones)
+    inflight: Dict[Hashable, asyncio.Task] = {}
     
     try:
         while True:
-            # Receive message from client
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            
+            # Receive message from client (JSON text, or binary in compact mode)
+            message = await receive(websocket)
             action = message.get("action")
-            logger.info(f"Received action: {action} from user {user_id}")
+            song_manager.touch(websocket, pong=action == "pong")
+            request_id = message.get("request_id")
+            # The token manager may have swapped in a refreshed token since the last action
+            token = song_manager.user_tokens.get(user_id, token)
+            logger.debug("Received action: %s from user %s", action, user_id)
             
-            if action == "get_current_song":
-                # Get current playing song
-                current_song = await get_current_song_ws(token)
-                response = {
-                    "action": "current_song_response",
-                    "data": current_song,
-                    "success": current_song is not None
-                }
-                await song_manager.send_personal_message(response, user_id)
-                
-            elif action == "get_song_by_id":
-                # Get specific song by ID
-                song_id = message.get("song_id")
-                if song_id:
-                    song = await get_song_by_id_ws(token, song_id)
-                    response = {
-                        "action": "song_by_id_response",
-                        "data": song,
-                        "song_id": song_id,
-                        "success": song is not None and "error" not in song
-                    }
-                else:
-                    response = {
-                        "action": "song_by_id_response",
-                        "error": "No song_id provided",
-                        "success": False
-                    }
-                await song_manager.send_personal_message(response, user_id)
-                
-            elif action == "get_multiple_songs":
-                # Get multiple songs by IDs
-                song_ids = message.get("song_ids", [])
-                if song_ids and len(song_ids) <= 50:  # Spotify API limit
-                    songs = []
-                    for song_id in song_ids:
-                        song = await get_song_by_id_ws(token, song_id)
-                        if song and "error" not in song:
-                            songs.append(song)
-                    
-                    response = {
-                        "action": "multiple_songs_response",
-                        "data": {"tracks": songs},
-                        "success": True
-                    }
-                else:
-                    response = {
-                        "action": "multiple_songs_response",
-                        "error": "Invalid song_ids (max 50 allowed)",
-                        "success": False
-                    }
-                await song_manager.send_personal_message(response, user_id)
-                
-            elif action == "start_current_song_polling":
-                # Start polling current song every N seconds
-                interval = message.get("interval", 5)  # Default 5 seconds
-                response = {
-                    "action": "polling_started",
-                    "interval": interval,
-                    "success": True
-                }
-                await song_manager.send_personal_message(response, user_id)
-                
-                # Start background task for polling
-                asyncio.create_task(poll_current_song(user_id, token, interval))
-                
-            elif action == "stop_current_song_polling":
-                # Stop polling (handled by disconnection or flag)
+            if request_id is not None and (isinstance(request_id, bool) or not isinstance(request_id, (str, int))):
+                # Ids key the in-flight table, so lists/objects (unhashable) are refused
                 response = {
-                    "action": "polling_stopped",
-                    "success": True
+                    "action": "error",
+                    "error": "request_id must be a string or an integer",
+                    "success": False
                 }
                 await song_manager.send_personal_message(response, user_id)
-                
-            elif action == "ping":
-                # Ping-pong for connection health
+            elif action == "cancel":
+                # Stop waiting on an in-flight request; its upstream call may still complete
+                task = inflight.get(request_id) if request_id is not None else None
+                if task is not None:
+                    task.cancel()
                 response = {
-                    "action": "pong",
-                    "timestamp": message.get("timestamp"),
-                    "success": True
+                    "action": "cancel_response",
+                    "request_id": request_id,
+                    "success": task is not None
                 }
                 await song_manager.send_personal_message(response, user_id)
-                
-            else:
-                # Unknown action
+            elif action not in PIPELINED_ACTIONS:
+                # Quick actions (and unknown ones) are answered in order, right away
+                await run_song_action(user_id, token, message)
+            elif len(inflight) >= WS_MAX_INFLIGHT or (request_id is not None and request_id in inflight):
                 response = {
                     "action": "error",
-                    "error": f"Unknown action: {action}",
+                    "error": "Too many requests in flight" if request_id not in inflight else "Duplicate request_id",
+                    "request_id": request_id,
                     "success": False
                 }
                 await song_manager.send_personal_message(response, user_id)
+            else:
+                # May wait on Spotify or the database: run alongside the socket's other requests
+                key = request_id if request_id is not None else object()
+                task = asyncio.create_task(run_song_action(user_id, token, message))
+                inflight[key] = task
+                task.add_done_callback(lambda done, key=key: inflight.pop(key, None))
                 
     except WebSocketDisconnect:
-        song_manager.disconnect(user_id)
+        song_manager.disconnect(user_id, websocket)
     except Exception as e:
         logger.error(f"WebSocket error for user {user_id}: {e}")
-        song_manager.disconnect(user_id)
+        song_manager.disconnect(user_id, websocket)
+    finally:
+        for task in list(inflight.values()):
+            task.cancel()
 
-# Background task for polling current song
-async def poll_current_song(user_id: str, token: str, interval: int):
-    """Poll current song and send updates"""
+async def seek_ws(token: str, timestamp_ms, device_id: Optional[str]) -> dict:
     try:
-        while user_id in song_manager.active_connections:
-            current_song = await get_current_song_ws(token)
-            response = {
-                "action": "current_song_update",
-                "data": current_song,
-                "success": current_song is not None
-            }
-            await song_manager.send_personal_message(response, user_id)
-            await asyncio.sleep(interval)
-    except Exception as e:
-        logger.error(f"Error in polling task for user {user_id}: {e}")
+        if not isinstance(timestamp_ms, int):
+            raise HTTPException(status_code=400, detail="timestamp_ms must be an integer")
+        response = {"action": "seek_response", **await perform_seek(token, timestamp_ms, device_id)}
+    except HTTPException as e:
+        response = {"action": "seek_response", "error": e.detail, "status": e.status_code, "success": False}
+    except UpstreamThrottled as e:
+        response = {"action": "seek_response", "error": "Rate limited", "retry_after": e.retry_after, "success": False}
+    return response
+
+# Single poll run by the shared scheduler
+async def poll_current_song(user_id: str, policy: Optional[AdaptivePolicy] = None, delta: bool = False):
+    """Fetch the user's current song once and push it as an update.
+
+    With `delta`, only changes since the last push are sent (or nothing).
+    Returns the delay until the next poll when polling adaptively.
+    """
+    token = song_manager.user_tokens.get(user_id)
+    if not token:
+        return None
+    try:
+        current_song = await get_current_song_ws(token, priority=BACKGROUND)
+    except UpstreamThrottled as e:
+        # Keep the client's last state and try again once the limit clears
+        poll_outcomes["throttled"].inc()
+        return e.retry_after if policy else None
+    observe_playback(user_id, current_song)
+    if delta:
+        response = song_state.diff(user_id, current_song)
+    else:
+        response = {
+            "action": "current_song_update",
+            "data": current_song,
+            "success": current_song is not None
+        }
+    if response is not None:
+        await song_manager.send_personal_message(response, user_id)
+    poll_outcomes["pushed" if response is not None else "unchanged"].inc()
+    return policy.next_delay(current_song) if policy else None
 
 # -----------------------------
 # REST API Endpoints
 # -----------------------------
-from fastapi import Header, HTTPException
 
 @app.get("/me")
-def me(authorization: str = Header(...)):
+async def me(authorization: str = Header(...)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid auth header")
     token = authorization.split(" ")[1]
-    user = get_current_user(token)
+    user = await get_current_user(token)
     return user
 
 @app.get("/current-song")
-def current(authorization: str = Header(...)):
+async def current(authorization: str = Header(...)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid auth header")
     token = authorization.split(" ")[1]
-    song = get_current_song(token)
+    try:
+        song = await get_current_song(token)
+    except UpstreamError as e:
+        if e.status_code < 500:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        # Spotify is down and there's no recent playback to fall back on
+        raise HTTPException(status_code=503, detail="Service temporarily unavailable")
+    except httpx.HTTPError:
+        raise HTTPException(status_code=503, detail="Service temporarily unavailable")
     if not song:
         return {"message": "Not listening"}
     print(song)
     return song
 
+def get_fields(fields: Optional[str]) -> Optional[tuple]:
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def track_response(body_fn, etag: str, if_none_match: Optional[str], cacheable: bool = True) -> Response:
+    """200 with ETag (and long Cache-Control), or a bodiless 304 when the client has it"""
+    # Track metadata is the same for every user, so shared caches may keep it;
+    # anything else must be revalidated with the ETag before reuse
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TRACK_HTTP_MAX_AGE}" if cacheable else "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body_fn(), headers=headers)
+
 # NEW: Get song by ID REST endpoint
 @app.get("/song/{song_id}")
-def get_song_by_id(song_id: str, authorization: str = Header(...)):
-    """Get song details by Spotify track ID"""
+async def get_song_by_id(song_id: str, fields: Optional[str] = None, authorization: str = Header(...),
+                         if_none_match: Optional[str] = Header(None)):
+    """Get song details by Spotify track ID (?fields=name,artist,image trims the response)"""
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid auth header")
     
@@ -326,58 +825,79 @@ def get_song_by_id(song_id: str, authorization: str = Header(...)):
     if not song_id or len(song_id) != 22:
         raise HTTPException(status_code=400, detail="Invalid Spotify track ID format")
     
-    song = get_song_by_id_helper(token, song_id)
+    wanted = get_fields(fields)
+    song = await get_song_by_id_helper(token, song_id)
     
     if "error" in song:
         if song["error"] == "Track not found":
             raise HTTPException(status_code=404, detail="Track not found")
         elif song["error"] == "Invalid track ID":
             raise HTTPException(status_code=400, detail="Invalid track ID")
-        elif song["error"] == "Network error":
+        elif song["error"] == "Network error" or song["error"].startswith("Spotify API error: 5"):
             raise HTTPException(status_code=503, detail="Service temporarily unavailable")
+        elif song["error"] == "Rate limited":
+            raise UpstreamThrottled(governor.retry_after())
         else:
             raise HTTPException(status_code=500, detail=song["error"])
     
-    return song
+    # Stale metadata (served during upstream trouble) is not for long-term caching
+    return track_response(lambda: project_track(song, wanted), tracks_etag([song], wanted), if_none_match,
+                          cacheable=not song.get("stale"))
 
 # NEW: Get multiple songs by IDs
 class MultipleSongsRequest(BaseModel):
     song_ids: List[str]
 
-@app.post("/songs/multiple")
-def get_multiple_songs(body: MultipleSongsRequest, authorization: str = Header(...)):
-    """Get multiple songs by their Spotify track IDs (max 50)"""
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid auth header")
-    
-    token = authorization.split(" ")[1]
-    
-    if not body.song_ids:
+async def multiple_songs(token: str, song_ids: List[str], fields: Optional[str], if_none_match: Optional[str]) -> Response:
+    if not song_ids:
         raise HTTPException(status_code=400, detail="song_ids list cannot be empty")
     
-    if len(body.song_ids) > 50:
+    if len(song_ids) > 50:
         raise HTTPException(status_code=400, detail="Maximum 50 song IDs allowed")
     
     # Validate all song IDs
-    for song_id in body.song_ids:
+    for song_id in song_ids:
         if not song_id or len(song_id) != 22:
             raise HTTPException(status_code=400, detail=f"Invalid Spotify track ID format: {song_id}")
     
-    songs = []
-    errors = []
+    wanted = get_fields(fields)
     
-    for song_id in body.song_ids:
-        song = get_song_by_id_helper(token, song_id)
-        if "error" in song:
-            errors.append({"song_id": song_id, "error": song["error"]})
-        else:
-            songs.append(song)
+    # One bulk upstream call instead of one request per ID
+    found = await get_multiple_songs_helper(token, song_ids)
+    ordered = [found[song_id] for song_id in song_ids]
+    errors = [{"song_id": song_id, "error": song["error"]} for song_id, song in zip(song_ids, ordered) if "error" in song]
     
-    return {
-        "tracks": songs,
-        "total": len(songs),
-        "errors": errors if errors else None
-    }
+    def body():
+        songs = [project_track(song, wanted) for song in ordered if "error" not in song]
+        return {
+            "tracks": songs,
+            "total": len(songs),
+            "errors": errors if errors else None
+        }
+    
+    # Partial failures may be transient, so only complete, fresh answers get a long max-age
+    cacheable = not errors and not any(song.get("stale") for song in ordered)
+    return track_response(body, tracks_etag(ordered, wanted), if_none_match, cacheable=cacheable)
+
+@app.post("/songs/multiple")
+async def get_multiple_songs(body: MultipleSongsRequest, fields: Optional[str] = None, authorization: str = Header(...)):
+    """Get multiple songs by their Spotify track IDs (max 50)"""
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid auth header")
+    
+    token = authorization.split(" ")[1]
+    # POST can't be revalidated; the ETag lets clients switch to the GET form
+    return await multiple_songs(token, body.song_ids, fields, None)
+
+@app.get("/songs/multiple")
+async def get_multiple_songs_cacheable(ids: str, fields: Optional[str] = None, authorization: str = Header(...),
+                                       if_none_match: Optional[str] = Header(None)):
+    """Cacheable form of POST /songs/multiple: ?ids=a,b,c (max 50)"""
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid auth header")
+    
+    token = authorization.split(" ")[1]
+    return await multiple_songs(token, ids.split(","), fields, if_none_match)
 
 # -----------------------------
 # Seek Functionality
@@ -386,64 +906,75 @@ class SeekRequest(BaseModel):
     timestamp_ms: int
     device_id: str = None
 
-@app.post("/seek")
-def seek_track(body: SeekRequest, authorization: str = Header(...)):
-    """Seek to a specific timestamp in the currently playing track"""
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid auth header")
+async def perform_seek(token: str, timestamp_ms: int, device_id: Optional[str] = None) -> dict:
+    """Seek the user's playback, validating against cached playback state when fresh.
+
+    The blocking GET /me/player pre-read is skipped when this token's user
+    was seen playing more recently than both SEEK_STATE_MAX_AGE and their
+    poll interval, i.e. by their latest poll.
+    """
+    if timestamp_ms < 0:
+        raise HTTPException(status_code=400, detail="Timestamp cannot be negative")
     
-    token = authorization.split(" ")[1]
+    seeking_user = song_manager.token_users.get(token)
+    state = playback_states.get(seeking_user) if seeking_user else None
+    max_age = min(SEEK_STATE_MAX_AGE, poll_scheduler.interval(seeking_user) or SEEK_STATE_MAX_AGE) if seeking_user else 0
     
     try:
-        # First, get current playback to validate
-        current_response = requests.get(
-            "https://api.spotify.com/v1/me/player",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=10
-        )
-        
-        if current_response.status_code == 204:
-            raise HTTPException(status_code=400, detail="No active playback")
-        
-        if current_response.status_code != 200:
-            raise HTTPException(status_code=current_response.status_code, detail="Failed to get current playback")
-        
-        playback_data = current_response.json()
-        
-        track = playback_data.get("item")
+        if state is not None and state.is_playing and state.age() <= max_age:
+            # Fast path: the poller saw this playback moments ago
+            is_playing, track_name = state.is_playing, state.track_name
+        else:
+            # First, get current playback to validate
+            current_response = await spotify_get("/me/player", token)
+            
+            if current_response.status_code == 204:
+                raise HTTPException(status_code=400, detail="No active playback")
+            
+            if current_response.status_code != 200:
+                raise HTTPException(status_code=current_response.status_code, detail="Failed to get current playback")
+            
+            playback_data = current_response.json()
+            track = playback_data.get("item") or {}
+            is_playing, track_name = playback_data.get("is_playing"), track.get("name")
         
-        if not playback_data.get("is_playing"):
+        if not is_playing:
             raise HTTPException(status_code=400, detail="Playback is paused")
         
-        # Validate timestamp is within track duration
-        if body.timestamp_ms < 0:
-            raise HTTPException(status_code=400, detail="Timestamp cannot be negative")
-        
         # Perform the seek
-        seek_url = "https://api.spotify.com/v1/me/player/seek"
-        params = {"position_ms": body.timestamp_ms}
+        seek_url = "/me/player/seek"
+        params = {"position_ms": timestamp_ms}
         
-        if body.device_id:
-            params["device_id"] = body.device_id
+        if device_id:
+            params["device_id"] = device_id
         
-        seek_response = requests.put(
-            seek_url,
-            headers={"Authorization": f"Bearer {token}"},
-            params=params,
-            timeout=10
-        )
+        # Optimistically move the cached position; rolled back unless Spotify confirms the seek
+        previous_state = playback_states.seek(seeking_user, timestamp_ms) if seeking_user else None
+        seeked = False
+        try:
+            seek_response = await spotify_put(seek_url, token, params=params)
+            seeked = seek_response.status_code == 204
+        finally:
+            # Also covers network errors, throttling and cancellation mid-request
+            if seeking_user and not seeked:
+                playback_states.restore(seeking_user, previous_state)
         
         if seek_response.status_code == 204:
             # Success - Spotify returns 204 No Content for successful seeks
-            readable_time = f"{body.timestamp_ms // 60000}:{(body.timestamp_ms % 60000) // 1000:02d}"
+            if seeking_user:
+                # Re-poll shortly to confirm the new position (and track boundary)
+                poll_scheduler.poll_soon(seeking_user, SEEK_REPOLL_DELAY)
+                comment_streamer.resync(seeking_user)
+            readable_time = f"{timestamp_ms // 60000}:{(timestamp_ms % 60000) // 1000:02d}"
             return {
                 "success": True,
-                "seeked_to_ms": body.timestamp_ms,
+                "seeked_to_ms": timestamp_ms,
                 "seeked_to_readable": readable_time,
-                "track_name": track.get("name", "Unknown"),
+                "track_name": track_name or "Unknown",
                 "message": f"Seeked to {readable_time}"
             }
-        elif seek_response.status_code == 403:
+        
+        if seek_response.status_code == 403:
             raise HTTPException(status_code=403, detail="User doesn't have Spotify Premium (required for seeking)")
         elif seek_response.status_code == 404:
             raise HTTPException(status_code=404, detail="Device not found")
@@ -453,21 +984,32 @@ def seek_track(body: SeekRequest, authorization: str = Header(...)):
                 detail=f"Failed to seek: {seek_response.text}"
             )
     
-    except requests.exceptions.RequestException as e:
+    except (HTTPException, UpstreamThrottled):
+        raise
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+@app.post("/seek")
+async def seek_track(body: SeekRequest, authorization: str = Header(...)):
+    """Seek to a specific timestamp in the currently playing track"""
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid auth header")
+    
+    token = authorization.split(" ")[1]
+    return await perform_seek(token, body.timestamp_ms, body.device_id)
+
 # Alternative endpoint with timestamp in URL
 @app.put("/seek/{timestamp_ms}")
-def seek_track_url(timestamp_ms: int, authorization: str = Header(...)):
+async def seek_track_url(timestamp_ms: int, authorization: str = Header(...)):
     """Seek to a specific timestamp via URL parameter"""
     seek_request = SeekRequest(timestamp_ms=timestamp_ms)
-    return seek_track(seek_request, authorization)
+    return await seek_track(seek_request, authorization)
 
 # Get available devices
 @app.get("/devices")
-def get_devices(authorization: str = Header(...)):
+async def get_devices(authorization: str = Header(...)):
     """Get user's available devices"""
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid auth header")
@@ -475,18 +1017,14 @@ def get_devices(authorization: str = Header(...)):
     token = authorization.split(" ")[1]
     
     try:
-        response = requests.get(
-            "https://api.spotify.com/v1/me/player/devices",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=10
-        )
+        response = await spotify_get("/me/player/devices", token)
         
         if response.status_code == 200:
             return response.json()
         else:
             raise HTTPException(status_code=response.status_code, detail="Failed to get devices")
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
 
 # -----------------------------
@@ -498,34 +1036,47 @@ def login():
 
 @app.get("/monitor")
 def monitor():
+    # Cheap liveness probe for uptime pingers; real signals live at /metrics
     return "Monitored!"
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: latencies, connections, rooms, polls, caches, loop lag"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/upstream/stats")
+def upstream_stats():
+    """Rate-limit governor: queue depth and time spent throttled"""
+    return governor.stats()
+
+@app.get("/polling/stats")
+def polling_stats():
+    """Scheduler load: how many polls are due, running and overdue"""
+    return poll_scheduler.stats()
+
 @app.get("/user/{user_id}")
-def spotify_user(user_id: str, authorization: str = Header(...)):
+async def spotify_user(user_id: str, authorization: str = Header(...)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid auth header")
     token = authorization.split(" ")[1]
-    return get_user_by_id(token, user_id)
+    return await get_user_by_id(token, user_id)
 
 class RefreshBody(BaseModel):
     refresh_token: str
 
 @app.post("/auth/refresh")
-def refresh(body: RefreshBody):
-    auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
-    response = requests.post(
-        "https://accounts.spotify.com/api/token",
-        data={"grant_type": "refresh_token", "refresh_token": body.refresh_token},
-        headers={"Authorization": f"Basic {auth_header}"}
-    , timeout=60)
-    return response.json()
+async def refresh(body: RefreshBody, authorization: Optional[str] = Header(None)):
+    # Callers may send the expiring token so its cached profile is dropped.
+    # Shares one accounts call with any server-side refresh of the same token.
+    old_token = authorization.split(" ")[1] if authorization and authorization.startswith("Bearer ") else None
+    return await token_manager.refresh(body.refresh_token, old_token)
 
 class CodeBody(BaseModel):
     code: str
 
 @app.post("/auth/callback")
-def callback(body: CodeBody):
-    token_info = exchange_code(body.code)
+async def callback(body: CodeBody):
+    token_info = await exchange_code(body.code)
     return token_info
 
 # -----------------------------
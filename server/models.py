@@ -2,7 +2,11 @@ from pydantic import BaseModel
 from typing import Optional
 
 class Comment(BaseModel):
-    user: str
+    user: Optional[str] = None  # always set from the poster's token, never trusted from the body
     comment: str
     song_id: str
     time: Optional[int] = None  # in seconds, optional
+
+class StoredComment(Comment):
+    id: int
+    created_at: int  # unix ms
@@ -0,0 +1,66 @@
+import time
+from typing import Dict, Optional
+
+
+class PlaybackState:
+    """Last observed playback for one user, extrapolated forward while playing"""
+
+    __slots__ = ("song_id", "track_name", "progress_ms", "duration_ms", "is_playing", "observed_at")
+
+    def __init__(self, song_id: Optional[str], progress_ms: int, duration_ms: Optional[int], is_playing: bool,
+                 track_name: Optional[str] = None):
+        self.song_id = song_id
+        self.track_name = track_name
+        self.progress_ms = progress_ms
+        self.duration_ms = duration_ms
+        self.is_playing = is_playing
+        self.observed_at = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.observed_at
+
+    def position_ms(self) -> int:
+        position = self.progress_ms
+        if self.is_playing:
+            position += int(self.age() * 1000)
+        if self.duration_ms:
+            position = min(position, self.duration_ms)
+        return position
+
+
+class PlaybackRegistry:
+    """Playback state per user_id, fed by current-song polls"""
+
+    def __init__(self):
+        self._states: Dict[str, PlaybackState] = {}
+
+    def update(self, user_id: str, song: Optional[dict]):
+        if not song:
+            self._states.pop(user_id, None)
+            return
+        self._states[user_id] = PlaybackState(
+            song.get("id"), song.get("progress_ms") or 0, song.get("duration_ms"), bool(song.get("is_playing")),
+            song.get("name")
+        )
+
+    def seek(self, user_id: str, position_ms: int) -> Optional[PlaybackState]:
+        """Optimistically move a user's position; returns the previous state for rollback"""
+        previous = self._states.get(user_id)
+        if previous is not None:
+            self._states[user_id] = PlaybackState(
+                previous.song_id, position_ms, previous.duration_ms, previous.is_playing, previous.track_name
+            )
+        return previous
+
+    def restore(self, user_id: str, state: Optional[PlaybackState]):
+        if state is not None:
+            self._states[user_id] = state
+
+    def get(self, user_id: str) -> Optional[PlaybackState]:
+        return self._states.get(user_id)
+
+    def forget(self, user_id: str):
+        self._states.pop(user_id, None)
+
+
+playback_states = PlaybackRegistry()
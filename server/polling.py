@@ -0,0 +1,241 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Max upstream polls running at once across all users
+POLL_MAX_CONCURRENCY = int(os.getenv("POLL_MAX_CONCURRENCY", "50"))
+# Random spread applied to every interval so polls don't line up (0.1 = +/-10%)
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))
+# First poll happens within this many seconds of scheduling
+POLL_FIRST_DELAY = float(os.getenv("POLL_FIRST_DELAY", "0.5"))
+# A poll that starts this late counts as overdue
+POLL_OVERDUE_AFTER = float(os.getenv("POLL_OVERDUE_AFTER", "1.0"))
+MIN_POLL_INTERVAL = 1.0
+
+# Adaptive mode: shortest/longest delay while playing, and back-off caps otherwise
+ADAPTIVE_MIN_INTERVAL = float(os.getenv("ADAPTIVE_MIN_INTERVAL", "2"))
+ADAPTIVE_BOUNDARY_LEAD = float(os.getenv("ADAPTIVE_BOUNDARY_LEAD", "0.75"))
+ADAPTIVE_BACKOFF_BASE = float(os.getenv("ADAPTIVE_BACKOFF_BASE", "5"))
+ADAPTIVE_PAUSED_MAX = float(os.getenv("ADAPTIVE_PAUSED_MAX", "60"))
+ADAPTIVE_IDLE_MAX = float(os.getenv("ADAPTIVE_IDLE_MAX", "120"))
+# How soon to re-poll after the user seeks
+SEEK_REPOLL_DELAY = float(os.getenv("SEEK_REPOLL_DELAY", "1"))
+
+# A poll callback may return a delay (seconds) to use instead of the job's interval
+PollCallback = Callable[[], Awaitable[Optional[float]]]
+
+
+class PollJob:
+    def __init__(self, key: str, interval: float, callback: PollCallback):
+        self.key = key
+        self.interval = interval
+        self.callback = callback
+        self.due = 0.0
+        self.running = False
+        self.cancelled = False
+
+
+class AdaptivePolicy:
+    """Picks the next poll delay from the last currently-playing response.
+
+    While playing, the next poll lands just after the predicted end of the
+    track (capped at `max_interval` to still catch manual skips). Paused and
+    not-listening users back off exponentially.
+    """
+
+    def __init__(self, max_interval: float):
+        self.max_interval = max(max_interval, ADAPTIVE_MIN_INTERVAL)
+        self.quiet_polls = 0
+
+    def next_delay(self, song: Optional[dict]) -> float:
+        if not song or not song.get("is_playing"):
+            self.quiet_polls += 1
+            cap = ADAPTIVE_PAUSED_MAX if song else ADAPTIVE_IDLE_MAX
+            return min(ADAPTIVE_BACKOFF_BASE * 2 ** (self.quiet_polls - 1), cap)
+
+        self.quiet_polls = 0
+        duration_ms = song.get("duration_ms")
+        progress_ms = song.get("progress_ms")
+        if not duration_ms or progress_ms is None:
+            return self.max_interval
+        remaining = max(duration_ms - progress_ms, 0) / 1000
+        return min(max(remaining + ADAPTIVE_BOUNDARY_LEAD, ADAPTIVE_MIN_INTERVAL), self.max_interval)
+
+
+class PollScheduler:
+    """Runs every user's current-song poll from one timer heap.
+
+    Each key (user_id) has at most one job, so repeated starts just update
+    the interval. Heap entries left behind by a cancel or reschedule are
+    dropped lazily when popped. A semaphore caps concurrent upstream calls.
+    """
+
+    def __init__(self, max_concurrency: int = POLL_MAX_CONCURRENCY, jitter: float = POLL_JITTER):
+        self.jitter = jitter
+        self._jobs: Dict[str, PollJob] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.overdue_total = 0
+        self.max_lag = 0.0
+
+    # -- public API --
+
+    def schedule(self, key: str, interval: float, callback: PollCallback):
+        """Start polling `key`, or update the interval/callback of its existing job"""
+        interval = max(float(interval), MIN_POLL_INTERVAL)
+        job = self._jobs.get(key)
+        if job is None or job.cancelled:
+            job = PollJob(key, interval, callback)
+            self._jobs[key] = job
+            self._push(job, time.monotonic() + random.uniform(0, POLL_FIRST_DELAY))
+        else:
+            job.callback = callback
+            self.set_interval(key, interval)
+        self._ensure_runner()
+
+    def set_interval(self, key: str, interval: float):
+        job = self._jobs.get(key)
+        if job is None:
+            return
+        interval = max(float(interval), MIN_POLL_INTERVAL)
+        previous, job.interval = job.interval, interval
+        # Pull the next poll forward if the new interval is shorter
+        if not job.running and interval < previous:
+            self._push(job, min(job.due, time.monotonic() + self._spread(interval)))
+
+    def poll_soon(self, key: str, delay: float = 0.0):
+        """Move a job's next poll forward (e.g. right after the user seeks)"""
+        job = self._jobs.get(key)
+        if job is not None and not job.running:
+            self._push(job, min(job.due, time.monotonic() + delay))
+
+    def cancel(self, key: str):
+        job = self._jobs.pop(key, None)
+        if job is not None:
+            job.cancelled = True
+
+    def is_scheduled(self, key: str) -> bool:
+        return key in self._jobs
+
+    def interval(self, key: str) -> Optional[float]:
+        """The job's poll interval (seconds), or None when `key` isn't polled"""
+        job = self._jobs.get(key)
+        return job.interval if job is not None else None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        due = overdue = 0
+        for job in self._jobs.values():
+            if not job.running and job.due <= now:
+                due += 1
+                if now - job.due > POLL_OVERDUE_AFTER:
+                    overdue += 1
+        return {
+            "scheduled": len(self._jobs),
+            "due": due,
+            "running": self.running,
+            "waiting_for_slot": self.waiting,
+            "overdue": overdue,
+            "overdue_total": self.overdue_total,
+            "completed": self.completed,
+            "max_lag_s": round(self.max_lag, 3),
+        }
+
+    async def stop(self):
+        """Stop the timer loop and any polls still running"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # -- internals --
+
+    def _spread(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _push(self, job: PollJob, due: float):
+        job.due = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, job.key))
+        if self._wakeup is not None and self._heap[0][2] == job.key:
+            self._wakeup.set()
+
+    def _ensure_runner(self):
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, key = heapq.heappop(self._heap)
+                job = self._jobs.get(key)
+                # Skip entries superseded by a reschedule or cancel
+                if job is None or job.due != due or job.running:
+                    continue
+                job.running = True
+                task = asyncio.create_task(self._execute(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: PollJob):
+        next_delay = None
+        self.waiting += 1
+        acquired = False
+        try:
+            async with self._semaphore:
+                acquired = True
+                self.waiting -= 1
+                lag = time.monotonic() - job.due
+                self.max_lag = max(self.max_lag, lag)
+                if lag > POLL_OVERDUE_AFTER:
+                    self.overdue_total += 1
+                if job.cancelled:
+                    return
+                self.running += 1
+                try:
+                    next_delay = await job.callback()
+                finally:
+                    self.running -= 1
+                    self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in polling task for user {job.key}: {e}")
+        finally:
+            if not acquired:
+                self.waiting -= 1
+            job.running = False
+            if not job.cancelled and self._jobs.get(job.key) is job:
+                delay = job.interval if next_delay is None else max(next_delay, MIN_POLL_INTERVAL)
+                self._push(job, time.monotonic() + self._spread(delay))
+
+
+poll_scheduler = PollScheduler()
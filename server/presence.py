@@ -0,0 +1,175 @@
+import os
+import time
+import uuid
+import bisect
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Query
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# How often this worker's counts are written out (and other workers' read back)
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+# Shards not refreshed for this long belong to dead workers and are ignored
+PRESENCE_STALE_AFTER = float(os.getenv("PRESENCE_STALE_AFTER", "30"))
+MAX_TOP_ROOMS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS room_listeners (
+    song_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    listeners INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (song_id, worker_id)
+);
+CREATE INDEX IF NOT EXISTS room_listeners_updated ON room_listeners (updated_at);
+"""
+
+
+class PresenceTracker:
+    """Listener counts per song room, derived from live WebSocket connections.
+
+    Each worker counts its own sockets (its shard) in memory and writes the
+    changed counts in one batch every PRESENCE_FLUSH_INTERVAL seconds; the
+    other workers' shards are read back in the same pass. Totals are kept
+    in a sorted list so "top rooms" is a slice, not a scan.
+    """
+
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db or Database()
+        self.worker_id = uuid.uuid4().hex
+        self._local: Dict[str, int] = {}
+        self._remote: Dict[str, int] = {}
+        self._totals: Dict[str, int] = {}
+        # (-listeners, song_id), ascending = most listeners first
+        self._ranking: List[Tuple[int, str]] = []
+        self._dirty: Dict[str, int] = {}
+        self._ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    # -- reads --
+
+    def count(self, song_id: str) -> int:
+        return self._totals.get(song_id, 0)
+
+    def top(self, limit: int = 10) -> List[dict]:
+        return [{"song_id": song_id, "listeners": -negative} for negative, song_id in self._ranking[:limit]]
+
+    # -- updates from the room handler --
+
+    def join(self, song_id: str):
+        self._set_local(song_id, self._local.get(song_id, 0) + 1)
+
+    def leave(self, song_id: str):
+        self._set_local(song_id, max(self._local.get(song_id, 0) - 1, 0))
+
+    def _set_local(self, song_id: str, listeners: int):
+        if listeners:
+            self._local[song_id] = listeners
+        else:
+            self._local.pop(song_id, None)
+        self._dirty[song_id] = listeners
+        self._retotal(song_id)
+
+    def _retotal(self, song_id: str):
+        previous = self._totals.get(song_id, 0)
+        total = self._local.get(song_id, 0) + self._remote.get(song_id, 0)
+        if total == previous:
+            return
+        if previous:
+            index = bisect.bisect_left(self._ranking, (-previous, song_id))
+            del self._ranking[index]
+        if total:
+            self._totals[song_id] = total
+            bisect.insort(self._ranking, (-total, song_id))
+        else:
+            self._totals.pop(song_id, None)
+
+    # -- persistence --
+
+    def _sync(self, dirty: Dict[str, int]) -> Dict[str, int]:
+        now = time.time()
+        with self.db.lock:
+            conn = self.db.conn
+            if not self._ready:
+                conn.executescript(SCHEMA)
+                self._ready = True
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT INTO room_listeners (song_id, worker_id, listeners, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (song_id, worker_id) DO UPDATE SET listeners = excluded.listeners, updated_at = excluded.updated_at",
+                    [(song_id, self.worker_id, listeners, now) for song_id, listeners in dirty.items() if listeners],
+                )
+                conn.executemany(
+                    "DELETE FROM room_listeners WHERE song_id = ? AND worker_id = ?",
+                    [(song_id, self.worker_id) for song_id, listeners in dirty.items() if not listeners],
+                )
+                # Heartbeat for our unchanged shard rows, then drop dead workers' rows
+                conn.execute("UPDATE room_listeners SET updated_at = ? WHERE worker_id = ?", (now, self.worker_id))
+                conn.execute("DELETE FROM room_listeners WHERE updated_at < ?", (now - PRESENCE_STALE_AFTER,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            rows = conn.execute(
+                "SELECT song_id, SUM(listeners) AS listeners FROM room_listeners WHERE worker_id != ? GROUP BY song_id",
+                (self.worker_id,),
+            ).fetchall()
+        return {row["song_id"]: row["listeners"] for row in rows}
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, {}
+        try:
+            remote = await asyncio.to_thread(self._sync, dirty)
+        except Exception as e:
+            logger.error(f"Error flushing room presence: {e}")
+            # Retry these counts next time (newer changes win)
+            self._dirty = {**dirty, **self._dirty}
+            return
+        changed = set(self._remote) | set(remote)
+        self._remote = remote
+        for song_id in changed:
+            self._retotal(song_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Our connections are going away with us
+        for song_id in list(self._local):
+            self._dirty[song_id] = 0
+        self._local.clear()
+        await self.flush()
+
+
+presence = PresenceTracker()
+
+
+@router.get("/rooms/top")
+async def top_rooms(limit: int = Query(10, ge=1, le=MAX_TOP_ROOMS)):
+    """Song rooms with the most live listeners"""
+    return {"rooms": presence.top(limit)}
+
+@router.get("/rooms/{song_id}/listeners")
+async def room_listeners(song_id: str):
+    return {"song_id": song_id, "listeners": presence.count(song_id)}
@@ -0,0 +1,147 @@
+import json
+import logging
+from typing import Any, Optional, Tuple, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+# MessagePack is optional; without it every client gets JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+# MessagePack without key shortening: room sockets relay client JSON as-is,
+# and renaming keys inside someone else's payload would change its meaning
+MSGPACK_VERBATIM = "msgpack-verbatim"
+# Sec-WebSocket-Protocol values a client may offer instead of ?protocol=
+SUBPROTOCOLS = {"spotichat.json": JSON, "spotichat.msgpack": MSGPACK}
+
+Frame = Union[str, bytes]
+
+# Field names shortened in compact /ws/songs frames (and expanded in compact frames
+# we receive there). Only server-defined messages use it; clients get the table
+# in the "protocol" hello sent right after connecting.
+SHORT_KEYS = {
+    "action": "a",
+    "data": "d",
+    "success": "s",
+    "error": "e",
+    "song_id": "sid",
+    "song_ids": "sids",
+    "id": "i",
+    "name": "n",
+    "artist": "ar",
+    "images": "im",
+    "url": "u",
+    "height": "h",
+    "width": "w",
+    "duration_ms": "du",
+    "explicit": "x",
+    "external_urls": "eu",
+    "spotify": "sp",
+    "preview_url": "pu",
+    "popularity": "po",
+    "is_playing": "ip",
+    "progress_ms": "pr",
+    "position_ms": "ps",
+    "timestamp": "ts",
+    "timestamp_ms": "tms",
+    "retry_after": "ra",
+    "interval": "iv",
+    "mode": "m",
+    "delta": "dl",
+    "comments": "cs",
+    "comment": "c",
+    "user": "us",
+    "time": "t",
+    "created_at": "ca",
+    "cursor": "cu",
+    "next_cursor": "nc",
+    "tracks": "tr",
+    "stale": "st",
+    "age_ms": "ag",
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+
+def _rekey(value: Any, table: dict) -> Any:
+    if isinstance(value, dict):
+        return {table.get(key, key): _rekey(item, table) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rekey(item, table) for item in value]
+    return value
+
+
+def available(protocol: str) -> bool:
+    return protocol == JSON or (protocol == MSGPACK and msgpack is not None)
+
+
+def negotiate(websocket: WebSocket, verbatim: bool = False) -> Tuple[str, Optional[str]]:
+    """Pick the encoding for a connection: (protocol, subprotocol to accept).
+
+    Clients ask with ?protocol=msgpack or by offering the "spotichat.msgpack"
+    subprotocol. Anything unknown or unavailable falls back to JSON.
+    With `verbatim`, MessagePack frames keep their keys as they are.
+    """
+    subprotocol = None
+    for offered in websocket.scope.get("subprotocols", []):
+        protocol = SUBPROTOCOLS.get(offered)
+        if protocol and available(protocol):
+            subprotocol = offered
+            break
+    else:
+        protocol = websocket.query_params.get("protocol", JSON)
+        if not available(protocol):
+            if protocol != JSON:
+                logger.warning(f"WebSocket asked for unsupported protocol {protocol!r}, using JSON")
+            protocol = JSON
+    if verbatim and protocol == MSGPACK:
+        protocol = MSGPACK_VERBATIM
+    return protocol, subprotocol
+
+
+def hello(protocol: str) -> Optional[bytes]:
+    """First frame for compact connections: the key table (empty when keys are verbatim)"""
+    if protocol == JSON:
+        return None
+    keys = SHORT_KEYS if protocol == MSGPACK else {}
+    return msgpack.packb({"action": "protocol", "encoding": MSGPACK, "keys": keys})
+
+
+def encode_as(message: Any, protocol: str) -> Frame:
+    if protocol == MSGPACK:
+        return msgpack.packb(_rekey(message, SHORT_KEYS))
+    if protocol == MSGPACK_VERBATIM:
+        return msgpack.packb(message)
+    return json.dumps(message)
+
+
+def transcode(frame: Frame, protocol: str) -> Frame:
+    """Re-encode a JSON frame (as published between workers) for a compact client"""
+    if protocol == JSON or isinstance(frame, bytes):
+        return frame
+    return encode_as(json.loads(frame), protocol)
+
+
+def decode(frame: Frame, verbatim: bool = False) -> Any:
+    """Parse an incoming frame: JSON text, or a compact (binary MessagePack) frame"""
+    if isinstance(frame, bytes):
+        if msgpack is None:
+            raise ValueError("Binary frames need MessagePack support")
+        message = msgpack.unpackb(frame)
+        return message if verbatim else _rekey(message, LONG_KEYS)
+    return json.loads(frame)
+
+
+async def receive(websocket: WebSocket, verbatim: bool = False) -> Any:
+    """Next message from the client, text or binary (raises WebSocketDisconnect)"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return decode(message["bytes"], verbatim)
+    return decode(message["text"])
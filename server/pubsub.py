@@ -0,0 +1,217 @@
+"""Cross-worker broadcast for WebSocket rooms.
+
+With one uvicorn worker the default in-process backend is enough. To run
+several workers (or hosts), start a broker and point every worker at it:
+
+    python pubsub.py --listen unix:///tmp/spotichat-broker.sock
+    BROADCAST_URL=unix:///tmp/spotichat-broker.sock uvicorn main:app --workers 4
+
+`tcp://host:port` works too for multi-host setups.
+"""
+import os
+import json
+import base64
+import uuid
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from fanout import Frame
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_URL = os.getenv("BROADCAST_URL", "memory://")
+# Stop writing to the broker if this much is already buffered (broker stalled)
+BROKER_MAX_BUFFER = int(os.getenv("BROKER_MAX_BUFFER", str(4 * 1024 * 1024)))
+BROKER_RECONNECT_DELAY = float(os.getenv("BROKER_RECONNECT_DELAY", "1"))
+
+# handler(frame, exclude) delivers to local members, skipping `exclude`
+Handler = Callable[[Frame, Optional[int]], None]
+
+
+class BroadcastBackend:
+    """Delivers frames published on a channel to its subscribers in every worker.
+
+    Subclasses only have to move frames between processes; local delivery
+    (and skipping the sender's own socket) happens in `_dispatch`.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Handler] = {}
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers[channel] = handler
+
+    def unsubscribe(self, channel: str):
+        self._handlers.pop(channel, None)
+
+    def _dispatch(self, channel: str, frame: Frame, exclude: Optional[int] = None):
+        handler = self._handlers.get(channel)
+        if handler is not None:
+            handler(frame, exclude)
+
+    def publish(self, channel: str, frame: Frame, exclude: Optional[int] = None):
+        self._dispatch(channel, frame, exclude)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class InProcessBackend(BroadcastBackend):
+    """Single-worker default: publish is just local delivery"""
+
+
+def _parse_address(url: str) -> Tuple[str, str]:
+    scheme, _, rest = url.partition("://")
+    if scheme not in ("unix", "tcp") or not rest:
+        raise ValueError(f"Unsupported broker address: {url}")
+    return scheme, rest
+
+
+def _encode_wire(channel: str, frame: Frame, origin: str = "") -> bytes:
+    if isinstance(frame, bytes):
+        body = {"c": channel, "b": base64.b64encode(frame).decode(), "o": origin}
+    else:
+        body = {"c": channel, "t": frame, "o": origin}
+    return json.dumps(body).encode() + b"\n"
+
+
+def _decode_wire(line: bytes) -> Tuple[str, Frame, str]:
+    body = json.loads(line)
+    frame = base64.b64decode(body["b"]) if "b" in body else body["t"]
+    return body["c"], frame, body.get("o", "")
+
+
+async def _open_connection(url: str):
+    scheme, address = _parse_address(url)
+    if scheme == "unix":
+        return await asyncio.open_unix_connection(address)
+    host, _, port = address.rpartition(":")
+    return await asyncio.open_connection(host, int(port))
+
+
+class SocketBrokerBackend(BroadcastBackend):
+    """Shares frames with other workers through a broker (see `run_broker`).
+
+    Frames are delivered locally right away and forwarded to the broker,
+    which relays them to every other connected worker. If the broker is
+    unreachable, local delivery keeps working and we keep reconnecting.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self.origin = uuid.uuid4().hex
+        self.dropped = 0
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, channel: str, frame: Frame, exclude: Optional[int] = None):
+        self._dispatch(channel, frame, exclude)
+        writer = self._writer
+        if writer is None or writer.is_closing() or writer.transport.get_write_buffer_size() > BROKER_MAX_BUFFER:
+            self.dropped += 1
+            return
+        writer.write(_encode_wire(channel, frame, self.origin))
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await _open_connection(self.url)
+            except OSError as e:
+                logger.warning(f"Broadcast broker unavailable ({e}), retrying")
+                await asyncio.sleep(BROKER_RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            logger.info(f"Connected to broadcast broker at {self.url}")
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        channel, frame, origin = _decode_wire(line)
+                        if origin != self.origin:
+                            self._dispatch(channel, frame)
+                    except Exception as e:
+                        # One bad line (or failing room handler) must not end cross-worker delivery
+                        logger.error(f"Error handling broadcast broker frame: {e!r}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Broadcast broker connection lost: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(BROKER_RECONNECT_DELAY)
+
+
+def create_backend(url: str = BROADCAST_URL) -> BroadcastBackend:
+    if url.startswith("memory://"):
+        return InProcessBackend()
+    _parse_address(url)
+    return SocketBrokerBackend(url)
+
+
+broadcast_backend = create_backend()
+
+
+# -----------------------------
+# Broker
+# -----------------------------
+async def run_broker(url: str):
+    """Relay every line from one worker to all the other connected workers"""
+    peers: Set[asyncio.StreamWriter] = set()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for peer in list(peers):
+                    if peer is not writer and not peer.is_closing():
+                        if peer.transport.get_write_buffer_size() <= BROKER_MAX_BUFFER:
+                            peer.write(line)
+        except OSError:
+            pass
+        finally:
+            peers.discard(writer)
+            writer.close()
+
+    scheme, address = _parse_address(url)
+    if scheme == "unix":
+        if os.path.exists(address):
+            os.unlink(address)
+        server = await asyncio.start_unix_server(handle, address)
+    else:
+        host, _, port = address.rpartition(":")
+        server = await asyncio.start_server(handle, host, int(port))
+    logger.info(f"Broadcast broker listening on {url}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Broadcast broker for multi-worker WebSocket rooms")
+    parser.add_argument("--listen", default="unix:///tmp/spotichat-broker.sock")
+    args = parser.parse_args()
+    asyncio.run(run_broker(args.listen))
@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import httpx
+
+from cache import TTLCache
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures (5xx or network errors) that open a route's breaker,
+# and how long it stays open before a half-open probe is let through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# Per-route overrides as "route=threshold:seconds", using the upstream metrics
+# route labels, e.g. "/me/player/currently-playing=3:10,/tracks=5:60"
+BREAKER_ROUTES: Dict[str, Tuple[int, float]] = {}
+for _entry in os.getenv("BREAKER_ROUTES", "").split(","):
+    if "=" in _entry:
+        _route, _config = _entry.rsplit("=", 1)
+        _threshold, _, _seconds = _config.partition(":")
+        BREAKER_ROUTES[_route.strip()] = (int(_threshold), float(_seconds or BREAKER_OPEN_SECONDS))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(httpx.TransportError):
+    """An upstream route's breaker is open; the request was not sent.
+
+    A transport error, so callers already handling network failures
+    (httpx.HTTPError) treat it as one - just without waiting for a timeout.
+    """
+
+    def __init__(self, route: str, retry_after: float):
+        super().__init__(f"Circuit open for {route}, retry after {retry_after:.1f}s")
+        self.route = route
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling an upstream route that keeps failing.
+
+    closed: requests flow; `threshold` consecutive failures open it.
+    open: requests fail fast with CircuitOpen for `open_seconds`.
+    half_open: one probe request at a time; success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, route: str, threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.route = route
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def before_request(self):
+        """Raise CircuitOpen unless a request may go out now"""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN:
+            remaining = self.opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpen(self.route, remaining)
+            self.state = HALF_OPEN
+        if self._probing:
+            self.rejected += 1
+            raise CircuitOpen(self.route, 1.0)
+        self._probing = True
+
+    def record(self, ok: bool):
+        self._probing = False
+        if ok:
+            if self.state != CLOSED:
+                logger.info(f"Upstream {self.route} recovered, closing breaker")
+            self.state = CLOSED
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state == CLOSED:
+                logger.warning(f"Upstream {self.route} failed {self.failures} times in a row, opening breaker")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.opened += 1
+
+    def release(self):
+        """The request was abandoned (e.g. cancelled) without an outcome"""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": _STATE_VALUES[self.state],
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class BreakerRegistry:
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, route: str) -> CircuitBreaker:
+        breaker = self.breakers.get(route)
+        if breaker is None:
+            threshold, open_seconds = BREAKER_ROUTES.get(route, (BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS))
+            breaker = self.breakers[route] = CircuitBreaker(route, threshold, open_seconds)
+        return breaker
+
+    def stats(self) -> Dict[str, dict]:
+        return {route: breaker.stats() for route, breaker in self.breakers.items()}
+
+
+breakers = BreakerRegistry()
+
+# state: 0 closed, 1 half-open, 2 open
+registry.gauge("spotichat_upstream_breaker", "Circuit breaker state per upstream route", ("route", "stat"),
+               read=lambda: {(route, key): value for route, stats in breakers.stats().items()
+                             for key, value in stats.items()})
+
+
+class StaleWhileRevalidate:
+    """Last known value per key, served when the upstream is slow or failing.
+
+    - Within `fresh_ttl` the stored value is returned without a call.
+    - After that one refresh per key runs (callers share it). A caller holding
+      a value younger than `max_stale` waits at most `soft_timeout` for it and
+      otherwise gets the stored value; the refresh carries on in the background.
+    - Only outages fall back to the stored value: errors for which
+      `serve_stale_on` is true (network errors and open circuits by default).
+      Anything else, e.g. a rejected token, reaches the caller.
+    - Without a stored value callers wait for the refresh and see its errors.
+    `get` returns (value, age in seconds); age is 0 for a value just fetched.
+    """
+
+    def __init__(self, name: str, maxsize: int, fresh_ttl: float, max_stale: float, soft_timeout: float,
+                 serve_stale_on: Callable[[Exception], bool] = lambda e: isinstance(e, httpx.HTTPError)):
+        self.name = name
+        self.serve_stale_on = serve_stale_on
+        self.fresh_ttl = fresh_ttl
+        self.soft_timeout = soft_timeout
+        self._values = TTLCache(maxsize, max_stale)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.stale_served = 0
+        self.refresh_failures = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Tuple[Any, float]:
+        entry = self._values.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age <= self.fresh_ttl:
+                return entry[1], age
+        future = self._refresh(key, loader)
+        if entry is None:
+            return await asyncio.shield(future), 0.0
+        try:
+            # shield so a slow refresh keeps going after we stop waiting for it
+            return await asyncio.wait_for(asyncio.shield(future), self.soft_timeout), 0.0
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            if not self.serve_stale_on(e):
+                raise
+        self.stale_served += 1
+        return entry[1], time.monotonic() - entry[0]
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._settle(key, done))
+        return future
+
+    def _settle(self, key: Hashable, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.refresh_failures += 1
+            return
+        self._values.set(key, (time.monotonic(), future.result()))
+
+    def forget(self, key: Hashable):
+        self._values.pop(key)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._values),
+            "refreshing": len(self._inflight),
+            "stale_served": self.stale_served,
+            "refresh_failures": self.refresh_failures,
+        }
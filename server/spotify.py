@@ -1,8 +1,16 @@
-from json import load
 import os
-import spotipy
+import time
+import base64
+import hashlib
+import httpx
 from spotipy.oauth2 import SpotifyOAuth
 from dotenv import load_dotenv
+from fastapi import HTTPException
+from typing import Optional, Tuple
+from upstream import SPOTIFY_ACCOUNTS_URL, UpstreamError, spotify_get, spotify_post
+from governor import governor, UpstreamThrottled, INTERACTIVE
+from resilience import StaleWhileRevalidate
+from cache import TTLCache
 
 load_dotenv()
 
@@ -12,6 +20,29 @@ SPOTIFY_REDIRECT_URI = "https://liscuss.vercel.app/callback"
 
 scope = "user-read-currently-playing user-read-playback-state"
 
+# Profiles almost never change: /me is cached per token, other users by user_id
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "5000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "600"))
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+# Current playback per token: reads within CURRENT_SONG_FRESH_TTL share one call;
+# when Spotify is slow (CURRENT_SONG_SOFT_TIMEOUT) or failing, the last known
+# playback (up to CURRENT_SONG_MAX_STALE old) is served while it is re-fetched
+CURRENT_SONG_FRESH_TTL = float(os.getenv("CURRENT_SONG_FRESH_TTL", "1"))
+CURRENT_SONG_SOFT_TIMEOUT = float(os.getenv("CURRENT_SONG_SOFT_TIMEOUT", "2"))
+CURRENT_SONG_MAX_STALE = float(os.getenv("CURRENT_SONG_MAX_STALE", "300"))
+def _upstream_outage(error: Exception) -> bool:
+    """Worth riding out on the last known playback: 5xx, network errors, open circuits, throttling.
+    4xx answers (e.g. a revoked token) are not, so callers still see them."""
+    if isinstance(error, UpstreamError):
+        return error.status_code >= 500
+    return isinstance(error, (httpx.HTTPError, UpstreamThrottled))
+
+playback_reads = StaleWhileRevalidate(
+    "current_song", 20_000, CURRENT_SONG_FRESH_TTL, CURRENT_SONG_MAX_STALE, CURRENT_SONG_SOFT_TIMEOUT,
+    serve_stale_on=_upstream_outage
+)
+
 sp_oauth = SpotifyOAuth(
     client_id=SPOTIFY_CLIENT_ID,
     client_secret=SPOTIFY_CLIENT_SECRET,
@@ -22,31 +53,130 @@ sp_oauth = SpotifyOAuth(
 def get_auth_url():
     return sp_oauth.get_authorize_url()
 
-def exchange_code(code: str):
-    token_info = sp_oauth.get_access_token(code)
+def basic_auth_header():
+    return base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
+
+async def exchange_code(code: str):
+    response = await spotify_post(
+        SPOTIFY_ACCOUNTS_URL,
+        data={"grant_type": "authorization_code", "code": code, "redirect_uri": SPOTIFY_REDIRECT_URI},
+        headers={"Authorization": f"Basic {basic_auth_header()}"}
+    )
+    token_info = response.json()
+    # Same shape spotipy returned (the client stores expires_at)
+    if "expires_in" in token_info:
+        token_info["expires_at"] = int(time.time()) + token_info["expires_in"]
     return token_info
 
-def get_current_song(token: str):
-    sp = spotipy.Spotify(auth=token)
-    current = sp.current_user_playing_track()
+async def _fetch_playback(token: str, priority: int) -> Optional[dict]:
+    response = await spotify_get("/me/player/currently-playing", token, priority=priority)
+    if response.status_code == 429:
+        raise UpstreamThrottled(governor.retry_after())
+    if response.status_code == 204:
+        return None
+    if response.status_code != 200:
+        raise UpstreamError(response.status_code)
+    current = response.json()
     if not current or not current.get("item"):
         return None
-    #print(current)
+    track = current["item"]
     return {
-        "id": current["item"]["id"],
-        "name": current["item"]["name"],
-        "images": current["item"]["album"]["images"],
-        "artist": ", ".join([a["name"] for a in current["item"]["artists"]]),
-        "is_playing": current["is_playing"]
+        "id": track["id"],
+        "name": track["name"],
+        "artist": track["artists"][0].get("name"),
+        "artists": [artist.get("name") for artist in track["artists"]],
+        "images": track["album"]["images"],
+        "duration_ms": track["duration_ms"],
+        "explicit": track["explicit"],
+        "external_urls": track["external_urls"],
+        "preview_url": track.get("preview_url"),
+        "popularity": track["popularity"],
+        "is_playing": current.get("is_playing", False),
+        "progress_ms": current.get("progress_ms"),
+    }
+
+async def get_playback(token: str, priority: int = INTERACTIVE) -> Tuple[Optional[dict], float]:
+    """The token's current playback (None when nothing plays) and its age in seconds.
+
+    Raises UpstreamError / httpx.HTTPError / UpstreamThrottled only when there is
+    no recent playback to fall back on.
+    """
+    return await playback_reads.get(token_key(token), lambda: _fetch_playback(token, priority))
+
+def aged(playback: dict, age: float) -> dict:
+    """Copy of a remembered playback moved forward by `age` and marked when stale"""
+    playback = dict(playback)
+    if playback.get("is_playing") and playback.get("progress_ms") is not None:
+        position = playback["progress_ms"] + int(age * 1000)
+        playback["progress_ms"] = min(position, playback.get("duration_ms") or position)
+    if age > CURRENT_SONG_FRESH_TTL:
+        playback["stale"] = True
+        playback["age_ms"] = int(age * 1000)
+    return playback
+
+async def get_current_song(token: str):
+    """The playing song (None when nothing plays); raises like get_playback"""
+    playback, age = await get_playback(token)
+    if playback is None:
+        return None
+    if age:
+        playback = aged(playback, age)
+    song = {
+        "id": playback["id"],
+        "name": playback["name"],
+        "images": playback["images"],
+        "artist": ", ".join(playback["artists"]),
+        "is_playing": playback["is_playing"]
     }
-    
-def get_user_by_id(token: str, user_id: str):
-    sp = spotipy.Spotify(auth=token)
-    return sp.user(user_id)
-
-    
-def get_current_user(token: str):
-    sp = spotipy.Spotify(auth=token)
-    user = sp.me()
-    print(user)
+    if playback.get("stale"):
+        song["stale"] = True
+        song["age_ms"] = playback["age_ms"]
+    return song
+
+def token_key(token: str) -> str:
+    """Cache key for a bearer token (never keep raw tokens as keys)"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def invalidate_token(token: str):
+    """Drop everything cached for a token (e.g. once it has been refreshed)"""
+    profile_cache.pop(("me", token_key(token)))
+
+def _profile_or_raise(response) -> dict:
+    """A profile from a 200, else the error as an HTTP status (like spotipy raising before).
+
+    Spotify's own failures (5xx) raise UpstreamError instead, so callers can
+    tell an outage from a rejected token.
+    """
+    if response.status_code == 200:
+        return response.json()
+    if response.status_code == 429:
+        raise UpstreamThrottled(governor.retry_after())
+    if response.status_code >= 500:
+        raise UpstreamError(response.status_code)
+    try:
+        error = response.json().get("error")
+    except ValueError:
+        error = None
+    detail = error.get("message") if isinstance(error, dict) else error
+    raise HTTPException(status_code=response.status_code, detail=detail or "Spotify API error")
+
+async def get_user_by_id(token: str, user_id: str):
+    key = ("user", user_id)
+    user = profile_cache.get(key)
+    if user is not None:
+        return user
+    response = await spotify_get(f"/users/{user_id}", token)
+    user = _profile_or_raise(response)
+    profile_cache.set(key, user)
+    return user
+
+
+async def get_current_user(token: str):
+    key = ("me", token_key(token))
+    user = profile_cache.get(key)
+    if user is not None:
+        return user
+    response = await spotify_get("/me", token)
+    user = _profile_or_raise(response)
+    profile_cache.set(key, user)
     return user
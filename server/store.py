@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import Database, DATABASE_PATH
+from cache import TRACK_CACHE_TTL, TRACK_CACHE_MAX_STALE
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Normalized tracks and chat room history kept on disk, so a restarted worker
+# starts warm. Every worker on the host shares the file (SQLite in WAL mode).
+STATE_STORE_PATH = os.getenv("STATE_STORE_PATH", DATABASE_PATH)
+# Reads go through SQLite's memory map up to this many bytes
+STATE_STORE_MMAP_SIZE = int(os.getenv("STATE_STORE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# New tracks and room history are written in batches this often (seconds)
+STATE_STORE_FLUSH_INTERVAL = float(os.getenv("STATE_STORE_FLUSH_INTERVAL", "2"))
+# Old rows are compacted away this often; the newest STATE_STORE_MAX_TRACKS tracks are kept
+STATE_STORE_COMPACT_INTERVAL = float(os.getenv("STATE_STORE_COMPACT_INTERVAL", "3600"))
+STATE_STORE_MAX_TRACKS = int(os.getenv("STATE_STORE_MAX_TRACKS", "200000"))
+# Room history older than this is not restored
+ROOM_SNAPSHOT_MAX_AGE = float(os.getenv("ROOM_SNAPSHOT_MAX_AGE", "86400"))
+
+# SQLite limits bound parameters per statement
+_MAX_PARAMS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_updated ON tracks (updated_at);
+-- A room's recent frames as a JSON array of strings
+CREATE TABLE IF NOT EXISTS room_snapshots (
+    song_id TEXT PRIMARY KEY,
+    history TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class StateStore:
+    """Write-behind SQLite store for track metadata and room snapshots.
+
+    Nothing is loaded at startup: tracks are read when the in-memory cache
+    misses them and rooms when their first listener joins. Writes are queued
+    and flushed in batches by a background task, which also compacts rows
+    past their useful age.
+    """
+
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db or Database(STATE_STORE_PATH)
+        self._ready = False
+        self._tracks: Dict[str, str] = {}
+        self._rooms: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.track_hits = 0
+        self.track_misses = 0
+        self.tracks_written = 0
+        self.rooms_restored = 0
+        self.rooms_written = 0
+        self.compacted = 0
+
+    def _conn(self):
+        conn = self.db.conn
+        if not self._ready:
+            conn.execute(f"PRAGMA mmap_size={STATE_STORE_MMAP_SIZE}")
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    # -- blocking calls (run in a worker thread) --
+
+    def load_tracks(self, song_ids: List[str]) -> Dict[str, Tuple[dict, float]]:
+        """{song_id: (track, age in seconds)} for the stored ones"""
+        found = {}
+        now = time.time()
+        with self.db.lock:
+            conn = self._conn()
+            for i in range(0, len(song_ids), _MAX_PARAMS):
+                chunk = song_ids[i:i + _MAX_PARAMS]
+                rows = conn.execute(
+                    f"SELECT id, data, updated_at FROM tracks WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for row in rows:
+                    found[row["id"]] = (json.loads(row["data"]), now - row["updated_at"])
+        return found
+
+    def load_room(self, song_id: str) -> List[str]:
+        with self.db.lock:
+            row = self._conn().execute(
+                "SELECT history FROM room_snapshots WHERE song_id = ? AND updated_at >= ?",
+                (song_id, time.time() - ROOM_SNAPSHOT_MAX_AGE)
+            ).fetchone()
+        return json.loads(row["history"]) if row else []
+
+    def write(self, tracks: Dict[str, str], rooms: Dict[str, str]):
+        now = time.time()
+        with self.db.lock:
+            conn = self._conn()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO tracks (id, data, updated_at) VALUES (?, ?, ?)",
+                    [(song_id, data, now) for song_id, data in tracks.items()]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO room_snapshots (song_id, history, updated_at) VALUES (?, ?, ?)",
+                    [(song_id, history, now) for song_id, history in rooms.items()]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def compact(self) -> int:
+        """Drop tracks too old to serve, the oldest beyond the cap, and stale rooms"""
+        now = time.time()
+        with self.db.lock:
+            conn = self._conn()
+            removed = conn.execute(
+                "DELETE FROM tracks WHERE updated_at < ?", (now - TRACK_CACHE_TTL - TRACK_CACHE_MAX_STALE,)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM tracks WHERE id IN (SELECT id FROM tracks ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (STATE_STORE_MAX_TRACKS,)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM room_snapshots WHERE updated_at < ?", (now - ROOM_SNAPSHOT_MAX_AGE,)
+            ).rowcount
+            conn.execute("PRAGMA optimize")
+        return removed
+
+    # -- async API --
+
+    async def get_tracks(self, song_ids: List[str]) -> Dict[str, Tuple[dict, float]]:
+        # Not yet flushed writes are newer than anything on disk
+        found = {song_id: (json.loads(self._tracks[song_id]), 0.0) for song_id in song_ids if song_id in self._tracks}
+        rest = [song_id for song_id in song_ids if song_id not in found]
+        if rest:
+            try:
+                found.update(await asyncio.to_thread(self.load_tracks, rest))
+            except Exception as e:
+                logger.error(f"Error reading stored tracks: {e}")
+        self.track_hits += len(found)
+        self.track_misses += len(song_ids) - len(found)
+        return found
+
+    async def get_room(self, song_id: str) -> List[str]:
+        if song_id in self._rooms:
+            return json.loads(self._rooms[song_id])
+        try:
+            frames = await asyncio.to_thread(self.load_room, song_id)
+        except Exception as e:
+            logger.error(f"Error reading room snapshot for {song_id}: {e}")
+            return []
+        if frames:
+            self.rooms_restored += 1
+        return frames
+
+    def put_track(self, song_id: str, song: dict):
+        self._tracks[song_id] = json.dumps(song)
+
+    def put_room(self, song_id: str, frames: Iterable[str]):
+        self._rooms[song_id] = json.dumps(list(frames))
+
+    async def flush(self):
+        if not self._tracks and not self._rooms:
+            return
+        tracks, rooms = self._tracks, self._rooms
+        self._tracks, self._rooms = {}, {}
+        try:
+            await asyncio.to_thread(self.write, tracks, rooms)
+        except Exception as e:
+            logger.error(f"Error writing state store: {e}")
+            # Keep them for the next flush unless newer values arrived meanwhile
+            self._tracks = {**tracks, **self._tracks}
+            self._rooms = {**rooms, **self._rooms}
+            return
+        self.tracks_written += len(tracks)
+        self.rooms_written += len(rooms)
+
+    async def _run(self):
+        next_compaction = time.monotonic() + STATE_STORE_COMPACT_INTERVAL
+        while True:
+            await asyncio.sleep(STATE_STORE_FLUSH_INTERVAL)
+            await self.flush()
+            if time.monotonic() >= next_compaction:
+                next_compaction = time.monotonic() + STATE_STORE_COMPACT_INTERVAL
+                try:
+                    self.compacted += await asyncio.to_thread(self.compact)
+                except Exception as e:
+                    logger.error(f"Error compacting state store: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "track_hits": self.track_hits,
+            "track_misses": self.track_misses,
+            "tracks_written": self.tracks_written,
+            "tracks_pending": len(self._tracks),
+            "rooms_restored": self.rooms_restored,
+            "rooms_written": self.rooms_written,
+            "compacted": self.compacted,
+        }
+
+
+state_store = StateStore()
+
+registry.gauge("spotichat_state_store", "On-disk track and room store activity", ("stat",),
+               read=lambda: {(key,): value for key, value in state_store.stats().items()})
@@ -0,0 +1,101 @@
+import os
+import sys
+import tempfile
+
+# Tests import the server modules the way uvicorn does (from the server directory)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep SQLite-backed stores away from the real database
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(prefix="spotichat-tests-"), "test.db"))
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "test")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "test")
+
+import httpx
+import pytest
+
+
+def track_data(song_id: str, duration_ms: int = 200_000) -> dict:
+    """A Spotify track object, as /v1/tracks returns it"""
+    return {
+        "id": song_id,
+        "name": f"Song {song_id}",
+        "artists": [{"name": "Artist"}],
+        "album": {"name": "Album", "images": []},
+        "duration_ms": duration_ms,
+        "explicit": False,
+        "external_urls": {},
+        "popularity": 1,
+    }
+
+
+class FakeSpotify:
+    """Answers Spotify Web API requests for app-level tests.
+
+    `users` maps access tokens to their /me id (others get a 401), `playing`
+    is the currently-playing body (None: nothing playing) and `status`
+    forces an error status for a path.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.playing = None
+        self.status = {}
+        self.requests = []
+
+    def play(self, song_id: str, progress_ms: int = 0, is_playing: bool = True, duration_ms: int = 200_000):
+        self.playing = {"item": track_data(song_id, duration_ms), "progress_ms": progress_ms, "is_playing": is_playing}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/v1")
+        self.requests.append((request.method, path))
+        if path in self.status:
+            return httpx.Response(self.status[path], json={"error": {"status": self.status[path], "message": "Upstream error"}})
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if path.startswith("/me") and token not in self.users:
+            return httpx.Response(401, json={"error": {"status": 401, "message": "Invalid access token"}})
+        if path == "/me":
+            return httpx.Response(200, json={"id": self.users[token], "display_name": self.users[token]})
+        if path in ("/me/player", "/me/player/currently-playing"):
+            return httpx.Response(200, json=self.playing) if self.playing else httpx.Response(204)
+        if path == "/me/player/seek":
+            return httpx.Response(204)
+        if path.startswith("/tracks/"):
+            return httpx.Response(200, json=track_data(path.rsplit("/", 1)[1]))
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def spotify(monkeypatch):
+    """A FakeSpotify behind every upstream call, with shared upstream state reset"""
+    import upstream
+    from cache import track_cache
+    from governor import governor
+    from resilience import breakers
+    from spotify import playback_reads, profile_cache
+
+    fake = FakeSpotify()
+    transport = httpx.MockTransport(fake)
+    clients = {}
+
+    def get_client(host):
+        client = clients.get(host)
+        if client is None or client.is_closed:
+            client = clients[host] = httpx.AsyncClient(transport=transport)
+        return client
+
+    monkeypatch.setattr(upstream, "get_client", get_client)
+    for cache in (profile_cache, track_cache):
+        cache.clear()
+    playback_reads._values.clear()
+    breakers.breakers.clear()
+    governor.blocked_until = 0.0
+    return fake
+
+
+@pytest.fixture
+def client(spotify):
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,63 @@
+import uuid
+
+import pytest
+
+from comments import MAX_PAGE_SIZE
+
+ALICE = {"Authorization": "Bearer tok-a"}
+BOB = {"Authorization": "Bearer tok-b"}
+
+
+@pytest.fixture
+def song_id(spotify):
+    spotify.users.update({"tok-a": "alice", "tok-b": "bob"})
+    return uuid.uuid4().hex
+
+
+def post(client, song_id, text, time=None, headers=ALICE, user=None):
+    body = {"comment": text, "song_id": song_id, "time": time}
+    if user:
+        body["user"] = user
+    return client.post("/comments", json=body, headers=headers)
+
+
+def test_author_comes_from_the_token(client, song_id):
+    stored = post(client, song_id, "hi", user="bob").json()
+    assert stored["user"] == "alice"
+    assert post(client, song_id, "hi", headers={"Authorization": "Bearer junk"}).status_code == 401
+
+
+def test_only_the_author_can_delete(client, song_id):
+    comment_id = post(client, song_id, "mine").json()["id"]
+    path = f"/songs/{song_id}/comments/{comment_id}"
+    assert client.delete(path, headers=BOB).status_code == 403
+    assert client.delete(path, headers=ALICE).json() == {"success": True}
+    assert client.delete(path, headers=ALICE).status_code == 404
+
+
+def test_pages_follow_song_time(client, song_id):
+    for text, time in (("late", 90), ("early", 5), ("untimed", None), ("middle", 30)):
+        post(client, song_id, text, time)
+    first = client.get(f"/songs/{song_id}/comments?limit=2").json()
+    assert [c["comment"] for c in first["comments"]] == ["untimed", "early"]
+    rest = client.get(f"/songs/{song_id}/comments", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    assert [c["comment"] for c in rest["comments"]] == ["middle", "late"]
+
+    in_range = client.get(f"/songs/{song_id}/comments/range?start=10&end=60").json()
+    assert [c["comment"] for c in in_range["comments"]] == ["middle"]
+
+
+@pytest.mark.parametrize("limit", [0, -1, MAX_PAGE_SIZE + 1])
+def test_page_limits_are_bounded(client, song_id, limit):
+    for path in ("comments", "comments/since", "comments/range?start=0&end=10"):
+        separator = "&" if "?" in path else "?"
+        assert client.get(f"/songs/{song_id}/{path}{separator}limit={limit}").status_code == 422
+
+
+@pytest.mark.parametrize("limit", [0, -1, "10", MAX_PAGE_SIZE + 1])
+def test_socket_page_limits_are_bounded(client, song_id, limit):
+    with client.websocket_connect("/ws/songs/alice?token=tok-a") as ws:
+        ws.send_json({"action": "get_comments", "song_id": song_id, "limit": limit})
+        response = ws.receive_json()
+        assert response["success"] is False
+        assert response["error"] == f"limit must be an integer from 1 to {MAX_PAGE_SIZE}"
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import governor as governor_module
+from governor import BACKGROUND, INTERACTIVE, Governor, TokenBucket, UpstreamThrottled
+
+
+def make_governor(app_rate: float = 20.0) -> Governor:
+    governor = Governor()
+    # An empty app bucket so every caller has to queue
+    governor.app_bucket = TokenBucket(app_rate, 1)
+    governor.app_bucket.tokens = 0
+    return governor
+
+
+def test_interactive_requests_jump_the_queue():
+    async def scenario():
+        governor = make_governor()
+        order = []
+
+        async def call(name, priority):
+            await governor.acquire(None, priority)
+            order.append(name)
+
+        tasks = []
+        for name in ("poll-1", "poll-2"):
+            tasks.append(asyncio.create_task(call(name, BACKGROUND)))
+            await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("seek", INTERACTIVE)))
+        await asyncio.gather(*tasks)
+        assert order == ["seek", "poll-1", "poll-2"]
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_pauses_every_caller():
+    async def scenario():
+        governor = Governor()
+        governor.observe(429, "0.2")
+        assert governor.retry_after() == pytest.approx(0.2, abs=0.05)
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(governor.acquire(None), governor.acquire("token", BACKGROUND))
+        assert asyncio.get_running_loop().time() - started >= 0.15
+        assert governor.stats()["throttle_events"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_missing_retry_after_uses_default():
+    governor = Governor()
+    governor.observe(429, "soon")
+    assert governor.retry_after() == pytest.approx(governor_module.DEFAULT_RETRY_AFTER, abs=0.05)
+    governor.observe(200, None)
+    assert governor.stats()["throttle_events"] == 1
+
+
+def test_retry_after_past_the_deadline_sheds_at_once():
+    async def scenario():
+        governor = Governor()
+        governor.observe(429, "60")
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(UpstreamThrottled) as raised:
+            await governor.acquire(None, INTERACTIVE)
+        assert asyncio.get_running_loop().time() - started < 0.1
+        assert raised.value.retry_after > 59
+        assert governor.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_requests_past_their_max_wait_are_shed(monkeypatch):
+    monkeypatch.setattr(governor_module, "GOVERNOR_BACKGROUND_MAX_WAIT", 0.05)
+
+    async def scenario():
+        # One slot every 10 s: the queued caller gives up after its 50 ms
+        governor = make_governor(app_rate=0.1)
+        with pytest.raises(UpstreamThrottled):
+            await governor.acquire(None, BACKGROUND)
+        assert governor.stats()["shed"] == 1
+        assert governor.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_busy_token_does_not_use_up_other_tokens(monkeypatch):
+    monkeypatch.setattr(governor_module, "GOVERNOR_TOKEN_RATE", 1.0)
+    monkeypatch.setattr(governor_module, "GOVERNOR_TOKEN_BURST", 2.0)
+    monkeypatch.setattr(governor_module, "GOVERNOR_INTERACTIVE_MAX_WAIT", 0.05)
+
+    async def scenario():
+        governor = Governor()
+        await governor.acquire("busy")
+        await governor.acquire("busy")
+        with pytest.raises(UpstreamThrottled):
+            await governor.acquire("busy")
+        await governor.acquire("quiet")
+
+    asyncio.run(scenario())
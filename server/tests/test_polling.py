@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+import polling
+from polling import AdaptivePolicy, PollScheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(polling, "MIN_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(polling, "POLL_FIRST_DELAY", 0.01)
+
+
+def run(scenario):
+    async def wrapper():
+        scheduler = PollScheduler(max_concurrency=2, jitter=0)
+        try:
+            await scenario(scheduler)
+        finally:
+            await scheduler.stop()
+    asyncio.run(wrapper())
+
+
+def test_concurrency_is_capped():
+    async def scenario(scheduler):
+        active, peak, done = 0, 0, []
+
+        def make(key):
+            async def poll():
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.05)
+                active -= 1
+                done.append(key)
+                scheduler.cancel(key)
+            return poll
+
+        for i in range(6):
+            scheduler.schedule(f"user-{i}", 10, make(f"user-{i}"))
+        await asyncio.sleep(0.4)
+        assert sorted(done) == [f"user-{i}" for i in range(6)]
+        assert peak == 2
+
+    run(scenario)
+
+
+def test_reschedule_keeps_one_job_and_cancel_stops_it():
+    async def scenario(scheduler):
+        calls = []
+
+        async def first():
+            calls.append("first")
+
+        async def second():
+            calls.append("second")
+
+        scheduler.schedule("user", 0.05, first)
+        scheduler.schedule("user", 0.05, second)
+        await asyncio.sleep(0.13)
+        assert calls and set(calls) == {"second"}
+        # One job polling every 50 ms, not two
+        assert len(calls) <= 3
+
+        scheduler.cancel("user")
+        assert not scheduler.is_scheduled("user")
+        count = len(calls)
+        await asyncio.sleep(0.1)
+        assert len(calls) == count
+
+    run(scenario)
+
+
+def test_returned_delay_and_poll_soon():
+    async def scenario(scheduler):
+        calls = []
+
+        async def poll():
+            calls.append(asyncio.get_running_loop().time())
+            return 5
+
+        scheduler.schedule("user", 0.01, poll)
+        await asyncio.sleep(0.1)
+        # The callback asked for 5 s, overriding the 10 ms interval
+        assert len(calls) == 1
+
+        scheduler.poll_soon("user")
+        await asyncio.sleep(0.05)
+        assert len(calls) == 2
+
+    run(scenario)
+
+
+def test_stop_cancels_running_polls():
+    async def scenario():
+        scheduler = PollScheduler()
+        started, cancelled = asyncio.Event(), []
+
+        async def poll():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        scheduler.schedule("user", 10, poll)
+        await asyncio.wait_for(started.wait(), 1)
+        await scheduler.stop()
+        assert cancelled == [True]
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failing_callback_keeps_polling():
+    async def scenario(scheduler):
+        calls = []
+
+        async def poll():
+            calls.append(1)
+            raise RuntimeError("upstream broke")
+
+        scheduler.schedule("user", 0.02, poll)
+        await asyncio.sleep(0.15)
+        assert len(calls) >= 2
+        assert scheduler.stats()["running"] == 0
+
+    run(scenario)
+
+
+def test_adaptive_policy_targets_track_end_and_backs_off():
+    policy = AdaptivePolicy(max_interval=30)
+    playing = {"is_playing": True, "duration_ms": 200_000, "progress_ms": 190_000}
+    assert policy.next_delay(playing) == pytest.approx(10 + polling.ADAPTIVE_BOUNDARY_LEAD)
+    assert policy.next_delay({**playing, "progress_ms": 0}) == 30
+
+    base = polling.ADAPTIVE_BACKOFF_BASE
+    assert [policy.next_delay(None) for _ in range(3)] == [base, base * 2, base * 4]
+    # Playing again starts the back-off over
+    policy.next_delay(playing)
+    assert policy.next_delay({"is_playing": False}) == base
+
+
+def test_interval_reports_the_scheduled_interval():
+    async def scenario(scheduler):
+        async def poll():
+            pass
+
+        assert scheduler.interval("user") is None
+        scheduler.schedule("user", 3, poll)
+        assert scheduler.interval("user") == 3
+        scheduler.set_interval("user", 7)
+        assert scheduler.interval("user") == 7
+
+    run(scenario)
@@ -0,0 +1,52 @@
+import asyncio
+
+from db import Database
+from presence import MAX_TOP_ROOMS, PresenceTracker, presence
+
+
+def test_counts_follow_joins_and_leaves():
+    tracker = PresenceTracker(db=Database(":memory:"))
+    for song_id in ("a", "a", "a", "b", "c", "c"):
+        tracker.join(song_id)
+    tracker.leave("a")
+    tracker.leave("b")
+    # Leaving more often than joining (a crashed client's double leave) can't go negative
+    tracker.leave("b")
+    assert [tracker.count(song_id) for song_id in ("a", "b", "c")] == [2, 0, 2]
+    assert tracker.top(5) == [{"song_id": "a", "listeners": 2}, {"song_id": "c", "listeners": 2}]
+    assert tracker.top(1) == [{"song_id": "a", "listeners": 2}]
+
+
+def test_workers_share_counts_through_the_database(tmp_path):
+    path = str(tmp_path / "presence.db")
+    first, second = PresenceTracker(db=Database(path)), PresenceTracker(db=Database(path))
+
+    async def scenario():
+        first.join("song")
+        first.join("song")
+        second.join("song")
+        second.join("other")
+        await first.flush()
+        await second.flush()
+        await first.flush()
+        assert first.count("song") == second.count("song") == 3
+        assert first.top(1) == [{"song_id": "song", "listeners": 3}]
+
+        # A worker going away takes its listeners with it
+        await second.stop()
+        await first.flush()
+        assert first.count("song") == 2
+        assert first.count("other") == 0
+
+    asyncio.run(scenario())
+
+
+def test_listener_routes(client):
+    presence.join("room-song")
+    try:
+        assert client.get("/rooms/room-song/listeners").json() == {"song_id": "room-song", "listeners": 1}
+        assert {"song_id": "room-song", "listeners": 1} in client.get("/rooms/top?limit=5").json()["rooms"]
+    finally:
+        presence.leave("room-song")
+    for limit in (0, -5, MAX_TOP_ROOMS + 1, "x"):
+        assert client.get(f"/rooms/top?limit={limit}").status_code == 422
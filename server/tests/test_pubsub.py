@@ -0,0 +1,103 @@
+import asyncio
+
+from pubsub import InProcessBackend, SocketBrokerBackend, _encode_wire, run_broker
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_in_process_delivers_locally_with_exclude():
+    backend = InProcessBackend()
+    received = []
+    backend.subscribe("room:a", lambda frame, exclude: received.append((frame, exclude)))
+    backend.publish("room:a", "hi", exclude=7)
+    backend.publish("room:b", "nobody listens")
+    assert received == [("hi", 7)]
+
+
+def test_broker_relays_text_and_binary_between_workers(tmp_path):
+    url = f"unix://{tmp_path / 'broker.sock'}"
+
+    async def scenario():
+        broker = asyncio.create_task(run_broker(url))
+        first, second = SocketBrokerBackend(url), SocketBrokerBackend(url)
+        got_first, got_second = [], []
+        first.subscribe("room:a", lambda frame, exclude: got_first.append((frame, exclude)))
+        second.subscribe("room:a", lambda frame, exclude: got_second.append((frame, exclude)))
+        try:
+            await first.start()
+            await second.start()
+            await wait_until(lambda: first._writer is not None and second._writer is not None)
+            # The broker only relays between connected peers; give it a moment to register both
+            await asyncio.sleep(0.05)
+
+            first.publish("room:a", '{"text": "hello"}', exclude=1)
+            first.publish("room:a", b"\x81\xa1t\x01")
+            await wait_until(lambda: len(got_second) == 2)
+
+            # Local members get it straight away (skipping the sender); remote ones never see the exclude
+            assert got_first == [('{"text": "hello"}', 1), (b"\x81\xa1t\x01", None)]
+            assert got_second == [('{"text": "hello"}', None), (b"\x81\xa1t\x01", None)]
+        finally:
+            await first.stop()
+            await second.stop()
+            broker.cancel()
+            try:
+                await broker
+            except asyncio.CancelledError:
+                pass
+
+    asyncio.run(scenario())
+
+
+def test_bad_lines_and_failing_handlers_do_not_stop_delivery(tmp_path):
+    url = f"unix://{tmp_path / 'broker.sock'}"
+
+    async def scenario():
+        broker = asyncio.create_task(run_broker(url))
+        backend = SocketBrokerBackend(url)
+        received = []
+
+        def handler(frame, exclude):
+            if frame == "boom":
+                raise RuntimeError("room handler failed")
+            received.append(frame)
+
+        backend.subscribe("room:a", handler)
+        try:
+            await backend.start()
+            await wait_until(lambda: backend._writer is not None)
+            # A second worker, speaking the wire format by hand
+            reader, writer = await asyncio.open_unix_connection(str(tmp_path / "broker.sock"))
+            await asyncio.sleep(0.05)
+            writer.write(b'not json\n{"o": "x"}\n')
+            writer.write(_encode_wire("room:a", "boom", "other"))
+            writer.write(_encode_wire("room:a", "still here", "other"))
+            await writer.drain()
+            await wait_until(lambda: received == ["still here"])
+            writer.close()
+        finally:
+            await backend.stop()
+            broker.cancel()
+            try:
+                await broker
+            except asyncio.CancelledError:
+                pass
+
+    asyncio.run(scenario())
+
+
+def test_publish_without_broker_still_delivers_locally(tmp_path):
+    async def scenario():
+        backend = SocketBrokerBackend(f"unix://{tmp_path / 'missing.sock'}")
+        received = []
+        backend.subscribe("songs", lambda frame, exclude: received.append(frame))
+        backend.publish("songs", "update")
+        assert received == ["update"]
+        assert backend.dropped == 1
+
+    asyncio.run(scenario())
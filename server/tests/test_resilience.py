@@ -0,0 +1,168 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, StaleWhileRevalidate
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker("/tracks", threshold=3, open_seconds=60)
+    for _ in range(2):
+        breaker.before_request()
+        breaker.record(False)
+    assert breaker.state == CLOSED
+    breaker.before_request()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.before_request()
+    assert raised.value.retry_after > 59
+    # Callers handling network errors handle an open circuit the same way
+    assert isinstance(raised.value, httpx.HTTPError)
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("/tracks", threshold=2, open_seconds=60)
+    breaker.before_request()
+    breaker.record(False)
+    breaker.before_request()
+    breaker.record(True)
+    breaker.before_request()
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    breaker = CircuitBreaker("/me", threshold=1, open_seconds=10)
+    breaker.before_request()
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+    later = time.monotonic() + 11
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    breaker.before_request()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+
+    # A failed probe opens it again for another full period
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+
+    later += 11
+    breaker.before_request()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    breaker.before_request()
+    breaker.before_request()
+
+
+def test_abandoned_probe_frees_the_slot(monkeypatch):
+    breaker = CircuitBreaker("/me", threshold=1, open_seconds=10)
+    breaker.before_request()
+    breaker.record(False)
+    later = time.monotonic() + 11
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    breaker.before_request()
+    breaker.release()
+    breaker.before_request()
+    assert breaker.state == HALF_OPEN
+
+
+def make_store(**overrides) -> StaleWhileRevalidate:
+    options = dict(maxsize=100, fresh_ttl=60, max_stale=600, soft_timeout=0.05)
+    options.update(overrides)
+    return StaleWhileRevalidate("test", **options)
+
+
+class Loader:
+    def __init__(self, *results, delay: float = 0.0):
+        self.results = list(results)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def upstream_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://api.spotify.com/v1/me")
+    return httpx.HTTPStatusError("upstream", request=request, response=httpx.Response(status, request=request))
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        store = make_store()
+        loader = Loader("song", delay=0.02)
+        results = await asyncio.gather(*(store.get("user", loader) for _ in range(5)))
+        assert results == [("song", 0.0)] * 5
+        assert loader.calls == 1
+
+        value, age = await store.get("user", loader)
+        assert value == "song" and age < 1
+        assert loader.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_outage_serves_the_stored_value():
+    async def scenario():
+        store = make_store(fresh_ttl=0)
+        loader = Loader("song", httpx.ConnectError("down"), CircuitOpen("/me", 5))
+        assert (await store.get("user", loader))[0] == "song"
+        assert (await store.get("user", loader))[0] == "song"
+        assert (await store.get("user", loader))[0] == "song"
+        assert store.stats()["stale_served"] == 2
+        assert store.stats()["refresh_failures"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_other_errors_reach_the_caller():
+    async def scenario():
+        store = make_store(fresh_ttl=0, serve_stale_on=lambda e: isinstance(e, httpx.TransportError))
+        loader = Loader("song", upstream_error(401))
+        await store.get("user", loader)
+        with pytest.raises(httpx.HTTPStatusError):
+            await store.get("user", loader)
+        assert store.stats()["stale_served"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_errors_without_a_stored_value_reach_the_caller():
+    async def scenario():
+        store = make_store()
+        with pytest.raises(httpx.ConnectError):
+            await store.get("user", Loader(httpx.ConnectError("down")))
+
+    asyncio.run(scenario())
+
+
+def test_slow_refresh_serves_stale_and_lands_later():
+    async def scenario():
+        store = make_store(fresh_ttl=0, soft_timeout=0.02)
+        await store.get("user", Loader("old"))
+
+        slow = Loader("new", delay=0.1)
+        value, age = await store.get("user", slow)
+        assert value == "old" and age > 0
+        assert store.stats()["refreshing"] == 1
+
+        await asyncio.sleep(0.15)
+        assert store.stats()["refreshing"] == 0
+        store.fresh_ttl = 60
+        assert (await store.get("user", slow))[0] == "new"
+        assert slow.calls == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+import json
+import uuid
+
+import pytest
+
+import websocket
+from store import state_store
+from websocket import Room, room_manager
+
+
+@pytest.fixture
+def song_id():
+    return uuid.uuid4().hex
+
+
+def test_messages_reach_the_others_and_late_joiners_get_history(client, song_id):
+    with client.websocket_connect(f"/ws/{song_id}") as alice, client.websocket_connect(f"/ws/{song_id}") as watcher:
+        alice.send_json({"text": "first"})
+        # Once it has been relayed it is in the history
+        assert watcher.receive_json() == {"text": "first"}
+        with client.websocket_connect(f"/ws/{song_id}") as bob:
+            replay = bob.receive_json()
+            assert replay == {"action": "room_history", "song_id": song_id, "data": [{"text": "first"}]}
+            alice.send_json({"text": "second"})
+            assert bob.receive_json() == {"text": "second"}
+            bob.send_json({"text": "reply"})
+            # The sender doesn't get its own message back
+            assert alice.receive_json() == {"text": "reply"}
+
+
+def test_saved_history_is_replayed_to_the_first_joiner(client, song_id):
+    state_store.put_room(song_id, [json.dumps({"text": "before restart"})])
+    with client.websocket_connect(f"/ws/{song_id}") as alice:
+        assert alice.receive_json()["data"] == [{"text": "before restart"}]
+        with client.websocket_connect(f"/ws/{song_id}") as watcher:
+            watcher.receive_json()
+            alice.send_json({"text": "after"})
+            assert watcher.receive_json() == {"text": "after"}
+        with client.websocket_connect(f"/ws/{song_id}") as bob:
+            # Restored once, so the saved message isn't replayed twice
+            assert bob.receive_json()["data"] == [{"text": "before restart"}, {"text": "after"}]
+
+
+def test_freed_room_comes_back_with_its_history(client, song_id, monkeypatch):
+    with client.websocket_connect(f"/ws/{song_id}") as alice, client.websocket_connect(f"/ws/{song_id}") as bob:
+        alice.send_json({"text": "kept"})
+        assert bob.receive_json() == {"text": "kept"}
+    monkeypatch.setattr(websocket, "ROOM_EMPTY_GRACE", -1)
+    room_manager.collect()
+    assert song_id not in room_manager.rooms
+
+    with client.websocket_connect(f"/ws/{song_id}") as carol:
+        assert carol.receive_json()["data"] == [{"text": "kept"}]
+
+
+def test_restored_frames_go_ahead_of_newer_ones(monkeypatch):
+    monkeypatch.setattr(websocket, "ROOM_HISTORY_MESSAGES", 3)
+    room = Room("song")
+    room.record('"live"')
+    room.restore(['"saved-1"', '"saved-2"', '"saved-3"'])
+    # Bounded, keeping the newest
+    assert list(room.history) == ['"saved-2"', '"saved-3"', '"live"']
+    assert room.history_bytes == sum(len(frame) for frame in room.history)
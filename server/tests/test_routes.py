@@ -0,0 +1,51 @@
+from cache import track_cache
+from tracks import normalize_track
+from conftest import track_data
+
+AUTH = {"Authorization": "Bearer tok"}
+SONG_ID = "4uLU6hMCjMI75M1A2tKUQC"
+
+
+def test_current_song(client, spotify):
+    spotify.users["tok"] = "alice"
+    spotify.play(SONG_ID)
+    assert client.get("/current-song", headers=AUTH).json()["id"] == SONG_ID
+
+
+def test_not_listening(client, spotify):
+    spotify.users["tok"] = "alice"
+    assert client.get("/current-song", headers=AUTH).json() == {"message": "Not listening"}
+
+
+def test_current_song_outage_is_a_503_not_not_listening(client, spotify):
+    spotify.users["tok"] = "alice"
+    spotify.status["/me/player/currently-playing"] = 502
+    response = client.get("/current-song", headers=AUTH)
+    assert response.status_code == 503
+
+
+def test_current_song_with_a_rejected_token(client, spotify):
+    assert client.get("/current-song", headers=AUTH).status_code == 401
+
+
+def test_song_is_cacheable_for_long(client, spotify):
+    response = client.get(f"/song/{SONG_ID}", headers=AUTH)
+    assert response.status_code == 200
+    assert "stale" not in response.json()
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    cached = client.get(f"/song/{SONG_ID}", headers={**AUTH, "If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+
+def test_stale_song_is_marked_and_not_cached(client, spotify):
+    spotify.status[f"/tracks/{SONG_ID}"] = 503
+    track_cache.set(SONG_ID, normalize_track(track_data(SONG_ID)), ttl=-5)
+    response = client.get(f"/song/{SONG_ID}?fields=name", headers=AUTH)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["stale"] is True and body["age_ms"] > 0
+    assert response.headers["cache-control"] == "no-cache"
+
+    multiple = client.get(f"/songs/multiple?ids={SONG_ID}", headers=AUTH)
+    assert multiple.json()["tracks"][0]["stale"] is True
+    assert multiple.headers["cache-control"] == "no-cache"
@@ -0,0 +1,66 @@
+import pytest
+
+import main
+from playback import playback_states
+
+AUTH = {"Authorization": "Bearer tok"}
+SONG_ID = "4uLU6hMCjMI75M1A2tKUQC"
+
+
+@pytest.fixture
+def listening(client, spotify):
+    """alice connected on /ws/songs with her playback observed once"""
+    spotify.users["tok"] = "alice"
+    spotify.play(SONG_ID, progress_ms=1000)
+    with client.websocket_connect("/ws/songs/alice?token=tok") as ws:
+        ws.send_json({"action": "get_current_song"})
+        assert ws.receive_json()["data"]["id"] == SONG_ID
+        spotify.requests.clear()
+        yield ws
+
+
+def pre_reads(spotify):
+    return [request for request in spotify.requests if request == ("GET", "/me/player")]
+
+
+def test_fresh_playing_state_skips_the_pre_read(client, spotify, listening):
+    response = client.post("/seek", json={"timestamp_ms": 60_000}, headers=AUTH)
+    assert response.json()["seeked_to_ms"] == 60_000
+    assert pre_reads(spotify) == []
+    assert ("PUT", "/me/player/seek") in spotify.requests
+    # Optimistically moved
+    assert playback_states.get("alice").progress_ms == 60_000
+
+
+def test_paused_state_is_checked_with_spotify(client, spotify, listening):
+    playback_states.update("alice", {"id": SONG_ID, "progress_ms": 0, "is_playing": False})
+    spotify.play(SONG_ID, progress_ms=1000)
+    assert client.post("/seek", json={"timestamp_ms": 5_000}, headers=AUTH).json()["success"] is True
+    assert len(pre_reads(spotify)) == 1
+
+
+def test_state_older_than_the_poll_interval_is_not_trusted(client, spotify, listening, monkeypatch):
+    monkeypatch.setattr(main, "SEEK_STATE_MAX_AGE", 60)
+    # Polled every 2 s, last seen 3 s ago: a newer poll may have seen a pause
+    monkeypatch.setattr(main.poll_scheduler, "interval", lambda key: 2.0)
+    playback_states.get("alice").observed_at -= 3
+    spotify.play(SONG_ID, is_playing=False)
+    response = client.post("/seek", json={"timestamp_ms": 5_000}, headers=AUTH)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Playback is paused"
+    assert len(pre_reads(spotify)) == 1
+
+
+def test_failed_seek_rolls_the_optimistic_position_back(client, spotify, listening):
+    spotify.status["/me/player/seek"] = 403
+    response = client.put("/seek/60000", headers=AUTH)
+    assert response.status_code == 403
+    assert playback_states.get("alice").progress_ms == 1000
+
+
+def test_seek_over_the_socket(client, spotify, listening):
+    listening.send_json({"action": "seek", "timestamp_ms": 30_000, "request_id": "s1"})
+    response = listening.receive_json()
+    assert response["request_id"] == "s1"
+    assert response["success"] is True
+    assert pre_reads(spotify) == []
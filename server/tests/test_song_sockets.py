@@ -0,0 +1,102 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import main
+
+
+def closed_with(client, path):
+    with pytest.raises(WebSocketDisconnect) as raised:
+        with client.websocket_connect(path) as ws:
+            ws.receive_json()
+    return raised.value.code, raised.value.reason
+
+
+def ping(ws, timestamp=None):
+    """Round trip, so the socket is registered (accepted sockets are checked before joining)"""
+    ws.send_json({"action": "ping", "timestamp": timestamp})
+    return ws.receive_json()
+
+
+def test_second_tab_joins_the_first_by_default(client, spotify):
+    spotify.users["tok"] = "alice"
+    with client.websocket_connect("/ws/songs/alice?token=tok") as first:
+        ping(first)
+        with client.websocket_connect("/ws/songs/alice?token=tok") as second:
+            assert ping(second, 2)["timestamp"] == 2
+            # Fanned out: the user's messages reach both tabs
+            assert first.receive_json() == {"action": "pong", "timestamp": 2, "success": True}
+            assert main.song_manager.stats()["replaced"] == 0
+
+
+def test_replace_policy_closes_the_older_tab(client, spotify, monkeypatch):
+    monkeypatch.setattr(main, "DUPLICATE_SESSION_POLICY", "replace")
+    spotify.users["tok"] = "alice"
+    with client.websocket_connect("/ws/songs/alice?token=tok") as first:
+        ping(first)
+        with client.websocket_connect("/ws/songs/alice?token=tok") as second:
+            with pytest.raises(WebSocketDisconnect) as raised:
+                first.receive_json()
+            assert raised.value.code == main.REPLACED_CLOSE_CODE
+            assert ping(second)["action"] == "pong"
+
+
+def test_token_must_belong_to_the_user(client, spotify):
+    spotify.users["tok"] = "alice"
+    assert closed_with(client, "/ws/songs/alice?token=junk") == (main.FORBIDDEN_CLOSE_CODE, "Invalid token")
+    assert closed_with(client, "/ws/songs/bob?token=tok") == (
+        main.FORBIDDEN_CLOSE_CODE, "Token does not belong to this user"
+    )
+
+
+def test_spotify_outage_is_not_a_bad_token(client, spotify):
+    spotify.users["tok"] = "alice"
+    spotify.status["/me"] = 503
+    code, _ = closed_with(client, "/ws/songs/alice?token=tok")
+    assert code == main.BUSY_CLOSE_CODE
+
+
+def test_idle_reaping_spares_clients_without_heartbeat(spotify, monkeypatch):
+    monkeypatch.setattr(main, "WS_HEARTBEAT_INTERVAL", 0.2)
+    monkeypatch.setattr(main, "WS_IDLE_TIMEOUT", 0.6)
+    spotify.users.update({"tok-a": "alice", "tok-b": "bob"})
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws/songs/alice?token=tok-a") as current, \
+                client.websocket_connect("/ws/songs/bob?token=tok-b") as legacy:
+            assert current.receive_json()["action"] == "ping"
+            current.send_json({"action": "pong"})
+            # Answered once, then went silent: reaped
+            with pytest.raises(WebSocketDisconnect) as raised:
+                while True:
+                    current.receive_json()
+            assert raised.value.code == main.IDLE_CLOSE_CODE
+
+            # Never answered (an older client): still pinged, never reaped for silence
+            for _ in range(3):
+                assert legacy.receive_json()["action"] == "ping"
+            assert main.song_manager.stats()["connections"] == 1
+
+
+def test_profile_outage_is_a_503(client, spotify):
+    spotify.users["tok"] = "alice"
+    spotify.status["/me"] = 502
+    response = client.get("/me", headers={"Authorization": "Bearer tok"})
+    assert response.status_code == 503
+    del spotify.status["/me"]
+    assert client.get("/me", headers={"Authorization": "Bearer junk"}).status_code == 401
+    assert client.get("/me", headers={"Authorization": "Bearer tok"}).json()["id"] == "alice"
+
+
+@pytest.mark.parametrize("interval", ["abc", None, True, -5, 0, [30]])
+def test_polling_interval_is_validated(client, spotify, interval):
+    spotify.users["tok"] = "alice"
+    with client.websocket_connect("/ws/songs/alice?token=tok") as ws:
+        ws.send_json({"action": "start_current_song_polling", "interval": interval, "request_id": 1})
+        response = ws.receive_json()
+        assert response == {
+            "action": "polling_started",
+            "error": "interval must be a positive number of seconds",
+            "success": False,
+            "request_id": 1,
+        }
+        assert not main.poll_scheduler.is_scheduled("alice")
@@ -0,0 +1,179 @@
+import gc
+import uuid
+import asyncio
+
+import httpx
+import pytest
+
+import tracks
+from tracks import TrackLoader
+
+
+def track_data(song_id: str) -> dict:
+    return {
+        "id": song_id,
+        "name": f"Song {song_id}",
+        "artists": [{"name": "Artist"}],
+        "album": {"name": "Album", "images": []},
+        "duration_ms": 1000,
+        "explicit": False,
+        "external_urls": {},
+        "popularity": 1,
+    }
+
+
+class FakeSpotify:
+    """Stands in for upstream.spotify_get, answering from known track ids"""
+
+    def __init__(self, known, bad_tokens=(), delay: float = 0.01):
+        self.known = set(known)
+        self.bad_tokens = set(bad_tokens)
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, path, token, params=None):
+        self.calls.append((path, token, params))
+        await asyncio.sleep(self.delay)
+        if token in self.bad_tokens:
+            return httpx.Response(401)
+        if path == "/tracks":
+            ids = params["ids"].split(",")
+            if any(not song_id.isalnum() for song_id in ids):
+                return httpx.Response(400)
+            return httpx.Response(200, json={
+                "tracks": [track_data(song_id) if song_id in self.known else None for song_id in ids]
+            })
+        song_id = path.rsplit("/", 1)[1]
+        if not song_id.isalnum():
+            return httpx.Response(400)
+        if song_id not in self.known:
+            return httpx.Response(404)
+        return httpx.Response(200, json=track_data(song_id))
+
+
+def new_ids(count: int):
+    # Fresh ids every test so the shared track cache can't answer for them
+    return [uuid.uuid4().hex for _ in range(count)]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    def install(fake):
+        monkeypatch.setattr(tracks, "spotify_get", fake)
+        return fake
+    return install
+
+
+def test_concurrent_lookups_share_one_bulk_call(upstream):
+    ids = new_ids(3)
+    fake = upstream(FakeSpotify(ids))
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=20)
+        lookups = [loader.get(f"token-{i % 2}", song_id) for i, song_id in enumerate(ids + ids)]
+        results = await asyncio.gather(*lookups)
+        assert [song["id"] for song in results] == ids + ids
+        assert len(fake.calls) == 1
+        path, _, params = fake.calls[0]
+        assert path == "/tracks" and params["ids"].split(",") == ids
+
+        # Now cached: no more upstream calls
+        assert (await loader.get("token-0", ids[0]))["name"] == f"Song {ids[0]}"
+        assert loader.upstream_calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_batches_are_split_at_max_size(upstream):
+    ids = new_ids(5)
+    fake = upstream(FakeSpotify(ids))
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=20, max_batch_size=2)
+        results = await loader.get_many("token", ids)
+        assert set(results) == set(ids)
+        assert sorted(len(params["ids"].split(",")) if params else 1 for _, _, params in fake.calls) == [1, 2, 2]
+
+    asyncio.run(scenario())
+
+
+def test_unknown_and_malformed_ids(upstream):
+    known, missing = new_ids(2)
+    malformed = "not-a-track-" + uuid.uuid4().hex
+    upstream(FakeSpotify([known]))
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=5)
+        results = await loader.get_many("token", [known, missing, malformed])
+        assert results[known]["id"] == known
+        assert results[missing] == {"error": "Track not found"}
+        assert results[malformed] == {"error": "Invalid track ID"}
+
+    asyncio.run(scenario())
+
+
+def test_rejected_token_falls_back_to_another_callers(upstream):
+    ids = new_ids(2)
+    fake = upstream(FakeSpotify(ids, bad_tokens={"expired"}))
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=20)
+        first, second = await asyncio.gather(loader.get("expired", ids[0]), loader.get("valid", ids[1]))
+        assert first["id"] == ids[0] and second["id"] == ids[1]
+        assert [token for _, token, _ in fake.calls] == ["expired", "valid"]
+
+    asyncio.run(scenario())
+
+
+def test_network_errors_are_not_cached(upstream):
+    song_id, = new_ids(1)
+
+    async def failing(path, token, params=None):
+        raise httpx.ConnectError("down")
+
+    upstream(failing)
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=1)
+        assert await loader.get("token", song_id) == {"error": "Network error"}
+        upstream(FakeSpotify([song_id]))
+        assert (await loader.get("token", song_id))["id"] == song_id
+
+    asyncio.run(scenario())
+
+
+def test_expired_tracks_are_served_marked_stale_while_refreshing(upstream):
+    song_id, = new_ids(1)
+    fake = upstream(FakeSpotify([song_id]))
+    old = tracks.normalize_track(track_data(song_id))
+    # Expired ten seconds ago
+    tracks.track_cache.set(song_id, old, ttl=-10)
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=1)
+        song = await loader.get("token", song_id)
+        assert song["stale"] is True
+        assert song["age_ms"] >= (tracks.TRACK_CACHE_TTL + 10) * 1000
+        assert tracks.project_track(song, ("name",)) == {"name": old["name"], "stale": True, "age_ms": song["age_ms"]}
+
+        await asyncio.sleep(0.05)
+        assert len(fake.calls) == 1
+        assert "stale" not in await loader.get("token", song_id)
+
+    asyncio.run(scenario())
+
+
+def test_batch_fetches_are_kept_until_done(upstream):
+    ids = new_ids(2)
+    upstream(FakeSpotify(ids, delay=0.05))
+
+    async def scenario():
+        loader = TrackLoader(batch_window_ms=1)
+        lookup = asyncio.ensure_future(loader.get_many("token", ids))
+        await asyncio.sleep(0.02)
+        assert len(loader._tasks) == 1
+        gc.collect()
+        assert set(await lookup) == set(ids)
+        assert not loader._tasks
+
+    asyncio.run(scenario())
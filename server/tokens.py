@@ -0,0 +1,194 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Set
+
+from cache import TTLCache
+from polling import PollScheduler
+from spotify import basic_auth_header, invalidate_token, token_key
+from upstream import SPOTIFY_ACCOUNTS_URL, spotify_post
+
+logger = logging.getLogger(__name__)
+
+# Refresh this long before a token expires, plus a random share of the spread
+# so sessions that connected together don't all refresh in the same second
+TOKEN_REFRESH_LEAD = float(os.getenv("TOKEN_REFRESH_LEAD", "120"))
+TOKEN_REFRESH_SPREAD = float(os.getenv("TOKEN_REFRESH_SPREAD", "300"))
+# Max refresh calls to the accounts service at once
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "5"))
+# Wait before retrying a failed refresh
+TOKEN_RETRY_DELAY = float(os.getenv("TOKEN_RETRY_DELAY", "30"))
+# A fresh result is reused for repeat refreshes of the same refresh token
+TOKEN_RESULT_TTL = float(os.getenv("TOKEN_RESULT_TTL", "60"))
+# Spotify access tokens last an hour; assumed when a session doesn't say
+DEFAULT_TOKEN_LIFETIME = 3600
+
+# Called with (session_key, token_info) after a session's token was replaced
+RefreshHook = Callable[[str, dict], None]
+
+
+def parse_expires_at(value) -> Optional[float]:
+    """Unix seconds from an expires_at the client kept (seconds or milliseconds)"""
+    try:
+        expires_at = float(value)
+    except (TypeError, ValueError):
+        return None
+    return expires_at / 1000 if expires_at > 1e11 else expires_at
+
+
+class TokenSession:
+    __slots__ = ("access_token", "refresh_token", "expires_at", "refresh_at")
+
+    def __init__(self, access_token: str, refresh_token: str, expires_at: float):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        self.refresh_at = self.plan()
+
+    def plan(self) -> float:
+        """Randomized refresh time ahead of expiry"""
+        lead = TOKEN_REFRESH_LEAD + random.uniform(0, TOKEN_REFRESH_SPREAD)
+        return self.expires_at - lead
+
+
+class TokenManager:
+    """Keeps long-lived sessions' access tokens fresh on the server.
+
+    Each registered session (a /ws/songs user) is refreshed ahead of its
+    expiry at a randomized time, through a dedicated scheduler with capped
+    concurrency. Concurrent refreshes of one refresh token (session timers,
+    /auth/refresh, a 401 from a poll) share a single accounts call, and the
+    result is briefly reused. Refresh hooks swap the new token into the
+    session's pollers and tell the client, so nobody has to reconnect.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, TokenSession] = {}
+        self.refresh_hooks: List[RefreshHook] = []
+        self.scheduler = PollScheduler(max_concurrency=TOKEN_REFRESH_CONCURRENCY, jitter=0)
+        # refresh token hash -> session keys using it
+        self._holders: Dict[str, Set[str]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._recent = TTLCache(10_000, TOKEN_RESULT_TTL)
+        self.refreshes = 0
+        self.failures = 0
+
+    # -- sessions --
+
+    def track(self, key: str, access_token: str, refresh_token: str, expires_at: Optional[float] = None):
+        """Start keeping `key`'s token fresh (expires_at in unix seconds, if known)"""
+        self.forget(key)
+        if expires_at is None:
+            # Unknown expiry: refresh soon to learn it
+            expires_at = time.time() + TOKEN_REFRESH_LEAD + TOKEN_REFRESH_SPREAD
+        self.sessions[key] = TokenSession(access_token, refresh_token, expires_at)
+        self._holders.setdefault(token_key(refresh_token), set()).add(key)
+        self.scheduler.schedule(key, TOKEN_RETRY_DELAY, lambda: self._tick(key))
+
+    def forget(self, key: str):
+        session = self.sessions.pop(key, None)
+        if session is None:
+            return
+        self.scheduler.cancel(key)
+        holders = self._holders.get(token_key(session.refresh_token))
+        if holders is not None:
+            holders.discard(key)
+            if not holders:
+                del self._holders[token_key(session.refresh_token)]
+
+    def refresh_now(self, key: str):
+        """The session's token was rejected (401); refresh it right away"""
+        session = self.sessions.get(key)
+        if session is not None:
+            session.refresh_at = 0.0
+            self.scheduler.poll_soon(key)
+
+    async def _tick(self, key: str) -> Optional[float]:
+        session = self.sessions.get(key)
+        if session is None:
+            return None
+        wait = session.refresh_at - time.time()
+        if wait > 0:
+            return wait
+        info = await self.refresh(session.refresh_token)
+        if info.get("error") == "invalid_grant":
+            # Revoked or already rotated elsewhere; the client has to sign in again
+            self.forget(key)
+            return None
+        if "access_token" not in info:
+            return TOKEN_RETRY_DELAY
+        # refresh() already moved this session (and any sharing its refresh token)
+        session = self.sessions.get(key)
+        return max(session.refresh_at - time.time(), TOKEN_RETRY_DELAY) if session else None
+
+    # -- refreshing --
+
+    async def refresh(self, refresh_token: str, old_access_token: Optional[str] = None) -> dict:
+        """Exchange a refresh token; returns Spotify's JSON (with expires_at on success)"""
+        if old_access_token:
+            invalidate_token(old_access_token)
+        key = token_key(refresh_token)
+        recent = self._recent.get(key)
+        if recent is not None:
+            return recent
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._exchange(refresh_token))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._inflight.pop(key, None))
+        # shield so one cancelled caller doesn't cancel a refresh others share
+        return await asyncio.shield(future)
+
+    async def _exchange(self, refresh_token: str) -> dict:
+        response = await spotify_post(
+            SPOTIFY_ACCOUNTS_URL,
+            data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+            headers={"Authorization": f"Basic {basic_auth_header()}"}
+        )
+        info = response.json()
+        if response.status_code != 200 or "access_token" not in info:
+            self.failures += 1
+            logger.warning(f"Token refresh failed with status {response.status_code}")
+            return info
+        self.refreshes += 1
+        info["expires_at"] = int(time.time()) + info.get("expires_in", DEFAULT_TOKEN_LIFETIME)
+        self._recent.set(token_key(refresh_token), info)
+        self._apply(refresh_token, info)
+        return info
+
+    def _apply(self, refresh_token: str, info: dict):
+        """Move every session using this refresh token onto the new access token"""
+        new_refresh_token = info.get("refresh_token") or refresh_token
+        for key in list(self._holders.get(token_key(refresh_token), ())):
+            session = self.sessions.get(key)
+            if session is None:
+                continue
+            invalidate_token(session.access_token)
+            if new_refresh_token != refresh_token:
+                # Spotify rotated the refresh token
+                self.track(key, info["access_token"], new_refresh_token, info["expires_at"])
+            else:
+                session.access_token = info["access_token"]
+                session.expires_at = info["expires_at"]
+                session.refresh_at = session.plan()
+            for hook in self.refresh_hooks:
+                try:
+                    hook(key, info)
+                except Exception as e:
+                    logger.error(f"Error in token refresh hook: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "refreshing": len(self._inflight),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+    async def close(self):
+        await self.scheduler.stop()
+
+
+token_manager = TokenManager()
@@ -0,0 +1,295 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from upstream import spotify_get
+from governor import UpstreamThrottled
+from cache import TTLCache, track_cache, TRACK_CACHE_SIZE, TRACK_CACHE_TTL, TRACK_CACHE_NEGATIVE_TTL, TRACK_CACHE_MAX_STALE
+from store import state_store
+
+logger = logging.getLogger(__name__)
+
+# Spotify's /v1/tracks endpoint accepts at most 50 IDs per call
+MAX_BATCH_SIZE = 50
+# How long single-track lookups wait for others to share one bulk call
+BATCH_WINDOW_MS = float(os.getenv("TRACK_BATCH_WINDOW_MS", "5"))
+# Browser/CDN cache lifetime for track metadata (revalidated with the ETag after)
+TRACK_HTTP_MAX_AGE = int(os.getenv("TRACK_HTTP_MAX_AGE", "86400"))
+
+# Fields a client may ask for with ?fields=; "image" is just the first album image
+TRACK_FIELDS = (
+    "id", "name", "artist", "artists", "album", "images", "image", "duration_ms", "explicit",
+    "external_urls", "preview_url", "popularity", "is_local", "track_number", "disc_number",
+)
+
+
+def normalize_track(track_data: dict) -> dict:
+    """Build the track dict served by /song/{song_id} from a Spotify track object"""
+    return {
+        "id": track_data["id"],
+        "name": track_data["name"],
+        "artist": track_data["artists"][0].get("name"),
+        "artists": [artist.get("name") for artist in track_data["artists"]],
+        "album": {
+            "name": track_data["album"]["name"],
+            "images": track_data["album"]["images"]
+        },
+        "images": track_data["album"]["images"],
+        "duration_ms": track_data["duration_ms"],
+        "explicit": track_data["explicit"],
+        "external_urls": track_data["external_urls"],
+        "preview_url": track_data.get("preview_url"),
+        "popularity": track_data["popularity"],
+        "is_local": track_data.get("is_local", False),
+        "track_number": track_data.get("track_number"),
+        "disc_number": track_data.get("disc_number")
+    }
+
+
+def _error_for_status(status_code: int) -> dict:
+    if status_code == 400:
+        return {"error": "Invalid track ID"}
+    if status_code == 404:
+        return {"error": "Track not found"}
+    if status_code == 429:
+        return {"error": "Rate limited"}
+    return {"error": f"Spotify API error: {status_code}"}
+
+
+def _remember(song_id: str, song: dict):
+    """Cache a lookup result; 400/404 results are cached negatively"""
+    if "error" not in song:
+        track_cache.set(song_id, song)
+        state_store.put_track(song_id, song)
+    elif song["error"] in ("Invalid track ID", "Track not found"):
+        track_cache.set(song_id, song, ttl=TRACK_CACHE_NEGATIVE_TTL)
+
+
+def _stale(song: dict, age: float) -> dict:
+    """Copy of an expired track marked "stale" with its "age_ms", like spotify.aged"""
+    return {**song, "stale": True, "age_ms": int(age * 1000)}
+
+
+class TrackLoader:
+    """Batches and de-duplicates track metadata lookups.
+
+    - IDs already being fetched are not requested again (singleflight).
+    - Lookups arriving within BATCH_WINDOW_MS are merged into one bulk
+      /v1/tracks?ids= call (up to 50 IDs each).
+    - Tracks missing from memory are read from the on-disk state store
+      (kept by every worker, and across restarts) before going upstream.
+    - Expired tracks (up to TRACK_CACHE_MAX_STALE past their TTL) are served
+      marked "stale" with their "age_ms" while one background lookup
+      refreshes them, so an upstream outage doesn't take known tracks down
+      with it.
+    Track metadata is the same for every user, so any caller's token can
+    fetch a batch; other callers' tokens are kept as fallbacks on 401.
+    """
+
+    def __init__(self, batch_window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = MAX_BATCH_SIZE):
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queue: List[str] = []
+        self._tokens: List[str] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Running batch fetches (the loop only keeps weak references to tasks)
+        self._tasks = set()
+        self.upstream_calls = 0
+        self.stale_served = 0
+
+    async def get(self, token: str, song_id: str) -> dict:
+        return (await self.get_many(token, [song_id]))[song_id]
+
+    async def get_many(self, token: str, song_ids: List[str]) -> Dict[str, dict]:
+        """Look up several tracks; returns {song_id: track dict or {"error": ...}}"""
+        loop = asyncio.get_running_loop()
+        results: Dict[str, dict] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        entries = {song_id: track_cache.get_entry(song_id) for song_id in song_ids}
+
+        cold = [song_id for song_id, entry in entries.items() if entry is None and song_id not in self._inflight]
+        if cold:
+            entries.update(await self._load_stored(cold))
+
+        for song_id, entry in entries.items():
+            if entry is not None:
+                cached, overdue = entry
+                if overdue <= 0:
+                    results[song_id] = cached
+                    continue
+                if overdue <= TRACK_CACHE_MAX_STALE and "error" not in cached:
+                    results[song_id] = _stale(cached, TRACK_CACHE_TTL + overdue)
+                    self.stale_served += 1
+                    self._enqueue(loop, song_id, token)
+                    continue
+            waiting[song_id] = self._enqueue(loop, song_id, token)
+
+        for song_id, future in waiting.items():
+            # shield so one cancelled caller doesn't cancel a lookup others share
+            results[song_id] = await asyncio.shield(future)
+        return results
+
+    async def _load_stored(self, song_ids: List[str]) -> Dict[str, Tuple[dict, float]]:
+        """Warm the memory cache from the state store; returns {song_id: (track, overdue)}"""
+        entries = {}
+        for song_id, (song, age) in (await state_store.get_tracks(song_ids)).items():
+            # Each track keeps its original age: past TRACK_CACHE_TTL it lands
+            # already expired, so it is served stale and refreshed
+            track_cache.set(song_id, song, ttl=TRACK_CACHE_TTL - age)
+            entries[song_id] = (song, age - TRACK_CACHE_TTL)
+        return entries
+
+    def _enqueue(self, loop: asyncio.AbstractEventLoop, song_id: str, token: str) -> asyncio.Future:
+        """Future for a lookup of song_id, joining one already queued or running"""
+        future = self._inflight.get(song_id)
+        if future is None:
+            future = loop.create_future()
+            self._inflight[song_id] = future
+            self._queue.append(song_id)
+        if token not in self._tokens:
+            self._tokens.append(token)
+        if len(self._queue) >= self.max_batch_size:
+            self._flush()
+        elif self._queue and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        queue, tokens = self._queue, self._tokens
+        self._queue, self._tokens = [], []
+        for i in range(0, len(queue), self.max_batch_size):
+            task = asyncio.create_task(self._fetch_batch(queue[i:i + self.max_batch_size], tokens))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch_batch(self, song_ids: List[str], tokens: List[str]):
+        songs: Dict[str, dict] = {}
+        failure = {"error": "Internal server error"}
+        try:
+            songs = await self._fetch(song_ids, tokens)
+        except UpstreamThrottled:
+            failure = {"error": "Rate limited"}
+        except httpx.HTTPError as e:
+            logger.error(f"Request error fetching songs {song_ids}: {e}")
+            failure = {"error": "Network error"}
+        except Exception as e:
+            logger.error(f"Error fetching songs {song_ids}: {e}")
+        for song_id in song_ids:
+            song = songs.get(song_id, failure)
+            _remember(song_id, song)
+            future = self._inflight.pop(song_id, None)
+            if future is not None and not future.done():
+                future.set_result(song)
+
+    async def _fetch(self, song_ids: List[str], tokens: List[str]) -> Dict[str, dict]:
+        for attempt, token in enumerate(tokens):
+            self.upstream_calls += 1
+            if len(song_ids) == 1:
+                response = await spotify_get(f"/tracks/{song_ids[0]}", token)
+                if response.status_code == 401 and attempt + 1 < len(tokens):
+                    continue
+                if response.status_code == 200:
+                    return {song_ids[0]: normalize_track(response.json())}
+                return {song_ids[0]: _error_for_status(response.status_code)}
+
+            response = await spotify_get("/tracks", token, params={"ids": ",".join(song_ids)})
+            if response.status_code == 401 and attempt + 1 < len(tokens):
+                continue
+            if response.status_code == 400:
+                # One malformed ID fails the whole batch; find it with single lookups
+                singles = await asyncio.gather(*(self._fetch([song_id], [token]) for song_id in song_ids))
+                return {k: v for single in singles for k, v in single.items()}
+            if response.status_code != 200:
+                return {song_id: _error_for_status(response.status_code) for song_id in song_ids}
+
+            songs = {}
+            for song_id, track_data in zip(song_ids, response.json().get("tracks", [])):
+                songs[song_id] = normalize_track(track_data) if track_data else {"error": "Track not found"}
+            for song_id in song_ids:
+                songs.setdefault(song_id, {"error": "Track not found"})
+            return songs
+        return {}
+
+
+track_loader = TrackLoader()
+
+
+async def get_song_by_id_helper(token: str, song_id: str) -> dict:
+    """Get song details by Spotify track ID (shared between REST and WebSocket)"""
+    return await track_loader.get(token, song_id)
+
+
+async def get_multiple_songs_helper(token: str, song_ids: List[str]) -> Dict[str, dict]:
+    """Get several songs with one bulk upstream call per 50 IDs"""
+    return await track_loader.get_many(token, song_ids)
+
+
+# -----------------------------
+# Projection and ETags
+# -----------------------------
+
+# ETag per cached track dict, so a track is hashed once rather than per request
+_etags = TTLCache(TRACK_CACHE_SIZE, 86400)
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Parse "name,artist,image" into a canonical tuple (None = every field)"""
+    if not fields:
+        return None
+    wanted = tuple(sorted({field.strip() for field in fields.split(",") if field.strip()}))
+    unknown = [field for field in wanted if field not in TRACK_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return wanted or None
+
+
+def project_track(song: dict, fields: Optional[Tuple[str, ...]]) -> dict:
+    """Trim a track (or error) dict to the requested fields"""
+    if fields is None or "error" in song:
+        return song
+    # Staleness markers are kept whatever the fields
+    projected = {key: song[key] for key in ("stale", "age_ms") if key in song}
+    for field in fields:
+        if field == "image":
+            images = song.get("images") or []
+            projected["image"] = images[0] if images else None
+        else:
+            projected[field] = song.get(field)
+    return projected
+
+
+def track_etag(song: dict) -> str:
+    """Content hash of a normalized track, memoized per cached dict"""
+    key = song.get("id") or json.dumps(song, sort_keys=True)
+    entry = _etags.get(key)
+    if entry is not None and entry[0] is song:
+        return entry[1]
+    digest = hashlib.blake2b(json.dumps(song, sort_keys=True).encode(), digest_size=12).hexdigest()
+    _etags.set(key, (song, digest))
+    return digest
+
+
+def tracks_etag(songs: Iterable[dict], fields: Optional[Tuple[str, ...]]) -> str:
+    """Strong ETag for a response holding these tracks, projected to `fields`"""
+    parts = [track_etag(song) for song in songs]
+    parts.append(",".join(fields) if fields else "*")
+    return '"' + hashlib.blake2b("|".join(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+
+from governor import governor, INTERACTIVE
+from metrics import upstream_request_seconds
+from resilience import breakers
+
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, which is far too chatty for background polling
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+load_dotenv()
+
+# Overridable so benchmarks can point the server at a local stand-in
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com/api/token")
+
+# Connection pool settings (per upstream host)
+HTTP_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("SPOTIFY_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("SPOTIFY_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("SPOTIFY_HTTP2", "1") == "1"
+
+# Optional per-host overrides, e.g. "accounts.spotify.com=10,api.spotify.com=200"
+HOST_MAX_CONNECTIONS: Dict[str, int] = {}
+for _entry in os.getenv("SPOTIFY_HTTP_HOST_LIMITS", "").split(","):
+    if "=" in _entry:
+        _host, _limit = _entry.split("=", 1)
+        HOST_MAX_CONNECTIONS[_host.strip()] = int(_limit)
+
+# HTTP/2 needs the optional "h2" package; fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+except ImportError:
+    HTTP2_ENABLED = False
+
+class UpstreamError(Exception):
+    """Spotify answered with an error status"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Spotify API error: {status_code}")
+        self.status_code = status_code
+
+
+# Web API paths with an ID segment, collapsed so metrics stay low-cardinality
+_ID_ROUTES = {"tracks": "/tracks/{id}", "users": "/users/{id}"}
+
+
+def upstream_route(url: str) -> str:
+    """Metrics label for an upstream URL, e.g. /tracks/{id} for any single-track lookup"""
+    if not url.startswith(SPOTIFY_API_URL):
+        return "accounts" if url.startswith(SPOTIFY_ACCOUNTS_URL) else "other"
+    path = url[len(SPOTIFY_API_URL):].split("?", 1)[0]
+    parts = path.split("/")
+    if len(parts) == 3 and parts[1] in _ID_ROUTES:
+        return _ID_ROUTES[parts[1]]
+    return path
+
+
+# One pooled client per upstream host so each host gets its own connection limit
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(host: str) -> httpx.AsyncClient:
+    """Get (or lazily create) the shared pooled client for an upstream host"""
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        max_connections = HOST_MAX_CONNECTIONS.get(host, HTTP_MAX_CONNECTIONS)
+        client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=min(HTTP_MAX_KEEPALIVE, max_connections),
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _clients[host] = client
+    return client
+
+
+async def close_clients():
+    """Close every pooled client (called on app shutdown)"""
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+
+
+async def spotify_request(method: str, url: str, token: Optional[str] = None,
+                          priority: int = INTERACTIVE, **kwargs) -> httpx.Response:
+    """Send a request to Spotify through the shared pool and rate-limit governor.
+
+    `url` may be a full URL or a path relative to the Web API (e.g. "/me/player").
+    Network failures raise httpx.HTTPError, like requests.RequestException before
+    (including resilience.CircuitOpen when the route's breaker is open);
+    requests shed by the governor raise governor.UpstreamThrottled.
+    """
+    if url.startswith("/"):
+        url = SPOTIFY_API_URL + url
+    headers = kwargs.pop("headers", {})
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    client = get_client(urlsplit(url).netloc)
+    route = upstream_route(url)
+    breaker = breakers.get(route)
+    # Fail fast (before spending rate budget) while the route is known to be down
+    breaker.before_request()
+    try:
+        await governor.acquire(token, priority)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            upstream_request_seconds.labels(method, route, "error").observe(time.perf_counter() - started)
+            breaker.record(ok=False)
+            raise
+    finally:
+        # No outcome recorded (throttled or cancelled): free a half-open probe slot
+        breaker.release()
+    upstream_request_seconds.labels(method, route, response.status_code).observe(time.perf_counter() - started)
+    breaker.record(ok=response.status_code < 500)
+    governor.observe(response.status_code, response.headers.get("Retry-After"))
+    return response
+
+
+async def spotify_get(url: str, token: Optional[str] = None, **kwargs) -> httpx.Response:
+    return await spotify_request("GET", url, token, **kwargs)
+
+
+async def spotify_put(url: str, token: Optional[str] = None, **kwargs) -> httpx.Response:
+    return await spotify_request("PUT", url, token, **kwargs)
+
+
+async def spotify_post(url: str, token: Optional[str] = None, **kwargs) -> httpx.Response:
+    return await spotify_request("POST", url, token, **kwargs)
@@ -1,24 +1,243 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, List
+from typing import Deque, Dict, Hashable, List, Optional
+from fanout import FanoutGroup, Frame, encode
+from protocol import negotiate, hello, receive
+from pubsub import broadcast_backend
+from presence import presence
+from metrics import registry
+from store import state_store
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Keep track of connections per song_id
-rooms: Dict[str, List[WebSocket]] = {}
+# Recent messages kept per room and replayed to late joiners
+ROOM_HISTORY_MESSAGES = int(os.getenv("ROOM_HISTORY_MESSAGES", "50"))
+ROOM_HISTORY_BYTES = int(os.getenv("ROOM_HISTORY_BYTES", str(64 * 1024)))
+# All rooms' history together; the least recently active rooms lose theirs first
+ROOM_HISTORY_BUDGET = int(os.getenv("ROOM_HISTORY_BUDGET", str(32 * 1024 * 1024)))
+# Empty rooms (and their history) are freed after this many seconds
+ROOM_EMPTY_GRACE = float(os.getenv("ROOM_EMPTY_GRACE", "300"))
+ROOM_GC_INTERVAL = float(os.getenv("ROOM_GC_INTERVAL", "30"))
+
+
+class Room(FanoutGroup):
+    """A song room's members on this worker, plus its recent message history.
+
+    History holds the frames exactly as broadcast (already serialized), so
+    replaying it to a joiner is one string join and one send. It is saved to
+    the state store when it changes and restored when the room is recreated
+    (after a restart, or on another worker).
+    """
+
+    def __init__(self, song_id: str):
+        super().__init__()
+        self.song_id = song_id
+        self.history: Deque[str] = deque()
+        self.history_bytes = 0
+        self.last_active = time.monotonic()
+        self.empty_since: Optional[float] = self.last_active
+        self.restoring: Optional[asyncio.Future] = None
+        # Bumped per recorded frame; compared with saved_version to find unsaved history
+        self.version = 0
+        self.saved_version = 0
+
+    def add(self, key: Hashable, websocket: WebSocket, **kwargs):
+        self.empty_since = None
+        self.last_active = time.monotonic()
+        return super().add(key, websocket, **kwargs)
+
+    def remove(self, key: Hashable):
+        super().remove(key)
+        if not self.outboxes:
+            self.empty_since = time.monotonic()
+
+    def record(self, frame: Frame) -> int:
+        """Append a frame to the history; returns the change in bytes held"""
+        self.last_active = time.monotonic()
+        if not isinstance(frame, str) or len(frame) > ROOM_HISTORY_BYTES:
+            return 0
+        before = self.history_bytes
+        self._append(frame)
+        self.version += 1
+        return self.history_bytes - before
+
+    def restore(self, frames: List[str]) -> int:
+        """Put saved frames ahead of any recorded since; returns the change in bytes held"""
+        before = self.history_bytes
+        recent = list(self.history)
+        self.history.clear()
+        self.history_bytes = 0
+        for frame in frames + recent:
+            if len(frame) <= ROOM_HISTORY_BYTES:
+                self._append(frame)
+        return self.history_bytes - before
+
+    def _append(self, frame: str):
+        self.history.append(frame)
+        self.history_bytes += len(frame)
+        while len(self.history) > ROOM_HISTORY_MESSAGES or self.history_bytes > ROOM_HISTORY_BYTES:
+            self.history_bytes -= len(self.history.popleft())
+
+    def clear_history(self) -> int:
+        freed = self.history_bytes
+        self.history.clear()
+        self.history_bytes = 0
+        return freed
+
+    def replay_frame(self) -> Optional[str]:
+        """Every buffered message in one frame (None when there is nothing to replay)"""
+        if not self.history:
+            return None
+        return '{"action": "room_history", "song_id": %s, "data": [%s]}' % (json.dumps(self.song_id), ", ".join(self.history))
+
+
+class RoomManager:
+    """Rooms with members on this worker; empty ones are freed after a grace period"""
+
+    def __init__(self):
+        self.rooms: Dict[str, Room] = {}
+        self.history_bytes = 0
+        self.history_evictions = 0
+        self.freed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, song_id: str) -> Room:
+        room = self.rooms.get(song_id)
+        if room is None:
+            room = self.rooms[song_id] = Room(song_id)
+            # Messages published for this room by any worker reach our members
+            broadcast_backend.subscribe(room_channel(song_id), lambda frame, exclude: self._deliver(room, frame, exclude))
+        return room
+
+    def _deliver(self, room: Room, frame: Frame, exclude: Optional[Hashable]):
+        self.history_bytes += room.record(frame)
+        if self.history_bytes > ROOM_HISTORY_BUDGET:
+            self._evict_history()
+        room.broadcast(frame, exclude=exclude)
+
+    async def restore(self, room: Room):
+        """Load the room's saved history once, when it is first joined here"""
+        if room.empty_since is not None:
+            # A joiner is on the way: don't let collect() free the room meanwhile
+            room.empty_since = time.monotonic()
+        if room.restoring is None:
+            room.restoring = asyncio.ensure_future(self._restore(room))
+        # shield so a joiner that leaves mid-load doesn't cancel it for the others
+        await asyncio.shield(room.restoring)
+
+    async def _restore(self, room: Room):
+        try:
+            frames = await state_store.get_room(room.song_id)
+            if frames:
+                self.history_bytes += room.restore(frames)
+        except Exception as e:
+            logger.error(f"Error restoring history for room {room.song_id}: {e}")
+
+    def snapshot(self):
+        """Queue every room's changed history for the state store"""
+        for room in self.rooms.values():
+            if room.version != room.saved_version:
+                state_store.put_room(room.song_id, room.history)
+                room.saved_version = room.version
+
+    def _evict_history(self):
+        # Down to 90% of the budget so eviction doesn't run on every message
+        target = ROOM_HISTORY_BUDGET * 0.9
+        for room in sorted(self.rooms.values(), key=lambda room: room.last_active):
+            if self.history_bytes <= target:
+                break
+            if room.history:
+                self.history_bytes -= room.clear_history()
+                self.history_evictions += 1
+
+    def collect(self):
+        """Free rooms that have been empty for longer than the grace period"""
+        cutoff = time.monotonic() - ROOM_EMPTY_GRACE
+        # Saved before anything is freed, so a room comes back with its history
+        self.snapshot()
+        for song_id, room in list(self.rooms.items()):
+            if not room.outboxes and room.empty_since is not None and room.empty_since < cutoff:
+                del self.rooms[song_id]
+                broadcast_backend.unsubscribe(room_channel(song_id))
+                self.history_bytes -= room.clear_history()
+                self.freed += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(ROOM_GC_INTERVAL)
+            self.collect()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.snapshot()
+
+    def stats(self) -> dict:
+        sizes = [len(room) for room in self.rooms.values()]
+        return {
+            "rooms": len(sizes),
+            "members": sum(sizes),
+            "largest": max(sizes, default=0),
+            "history_bytes": self.history_bytes,
+            "history_evictions": self.history_evictions,
+            "freed": self.freed,
+        }
+
+
+room_manager = RoomManager()
+
+# Aggregates rather than one series per song, which would be unbounded
+registry.gauge("spotichat_chat_rooms", "Song chat rooms on this worker", ("stat",),
+               read=lambda: {(key,): value for key, value in room_manager.stats().items()})
+
+def room_channel(song_id: str) -> str:
+    return f"room:{song_id}"
+
+def get_room(song_id: str) -> Room:
+    return room_manager.get(song_id)
 
 @router.websocket("/ws/{song_id}")
 async def websocket_endpoint(websocket: WebSocket, song_id: str):
-    await websocket.accept()
-    if song_id not in rooms:
-        rooms[song_id] = []
-    rooms[song_id].append(websocket)
+    # Chat is relayed as the client sent it, so compact frames keep their keys
+    protocol, subprotocol = negotiate(websocket, verbatim=True)
+    await websocket.accept(subprotocol=subprotocol)
+    room = get_room(song_id)
+    # Load saved history before joining, so nothing is both delivered live and replayed
+    await room_manager.restore(room)
+    # Each listener gets its own bounded outbox + writer task
+    outbox = room.add(id(websocket), websocket, protocol=protocol)
+    greeting = hello(protocol)
+    if greeting is not None:
+        outbox.put(greeting)
+    # Catch the joiner up on recent messages in a single frame
+    history = room.replay_frame()
+    if history is not None:
+        room.send(id(websocket), history)
+    presence.join(song_id)
 
     try:
         while True:
-            data = await websocket.receive_json()
-            # Broadcast to all clients in the same room
-            for connection in rooms[song_id]:
-                if connection != websocket:
-                    await connection.send_json(data)
+            data = await receive(websocket, verbatim=True)
+            # Broadcast to all clients in the same room (serialized once), in every worker
+            broadcast_backend.publish(room_channel(song_id), encode(data), exclude=id(websocket))
     except WebSocketDisconnect:
-        rooms[song_id].remove(websocket)
+        pass
+    finally:
+        room.remove(id(websocket))
+        presence.leave(song_id)